@@ -0,0 +1,230 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import pygame
+from main import World, Building, GameEngine, TileType, FlowMonitor, Hauler, Ecology
+
+# ==========================================
+# SCENARIOS
+# ==========================================
+# Each scenario builds its state from a seed and returns (setup, step).
+# step() is one simulation tick or one rendered frame.
+
+def _sim(world):
+    return world.tick
+
+def scen_worldgen(size):
+    def build(seed):
+        return None, lambda: World(seed, size, size)
+    return build
+
+def scen_drills(seed, n=1000):
+    # Drill on iron ore -> furnace directly to its right
+    w = World(seed, 128, 128)
+    rng = random.Random(seed)
+    spots = [(x, y) for y in range(128) for x in range(0, 126, 2)]
+    rng.shuffle(spots)
+    for x, y in spots[:n]:
+        w.set_tile_type(x, y, TileType.ORE_IRON)
+        w.add_building(Building(x, y, "drill", "RIGHT"))
+        w.add_building(Building(x + 1, y, "furnace", "DOWN"))
+    return w, _sim(w)
+
+def scen_conveyor_snake(seed, n=10000):
+    # Boustrophedon belt from the top-left, fed by a drill at its head
+    w = World(seed, 128, 128)
+    placed = 0
+    for y in range(128):
+        xs = range(128) if y % 2 == 0 else range(127, -1, -1)
+        for i, x in enumerate(xs):
+            if placed >= n: break
+            last = i == 127
+            facing = "DOWN" if last else ("RIGHT" if y % 2 == 0 else "LEFT")
+            kind = "drill" if placed == 0 else "conveyor"
+            if kind == "drill": w.set_tile_type(x, y, TileType.ORE_COPPER)
+            w.add_building(Building(x, y, kind, facing))
+            placed += 1
+    for b in list(w.buildings.values())[1::50]:
+        b.inventory.add("ore_copper", 5)
+    return w, _sim(w)
+
+def scen_conveyor_flow(seed):
+    # Same belt with the logistics monitor attached, to track its overhead
+    w, step = scen_conveyor_snake(seed)
+    FlowMonitor().attach(w)
+    return w, step
+
+def scen_fast_forward(seed):
+    # One minute of catch-up per step over the drill/furnace field
+    w, _ = scen_drills(seed)
+    return w, lambda: w.fast_forward(3600)
+
+def scen_totems(seed, n=2000):
+    w = World(seed, 128, 128)
+    rng = random.Random(seed)
+    for _ in range(n):
+        x, y = rng.randrange(128), rng.randrange(128)
+        kind = "totem" if rng.random() < 0.3 else "drill"
+        if (x, y) not in w.buildings:
+            w.add_building(Building(x, y, kind, "DOWN"))
+    return w, _sim(w)
+
+def scen_haulers(seed, n=200, drops=20):
+    # Drills scattered over dry land, each with a hauler flying ore to one
+    # of a few furnaces; fields are shared per furnace
+    w = World(seed, 128, 128)
+    rng = random.Random(seed)
+    dry = [(x, y) for y in range(128) for x in range(128) if w.get_tile_type(x, y) != TileType.WATER]
+    rng.shuffle(dry)
+    furnaces = dry[:drops]
+    for x, y in furnaces: w.add_building(Building(x, y, "furnace", "DOWN"))
+    for i, (x, y) in enumerate(dry[drops:drops + n]):
+        w.set_tile_type(x, y, TileType.ORE_IRON)
+        w.add_building(Building(x, y, "drill", "DOWN"))
+        w.add_hauler(Hauler(i + 1, x, y, (x, y), furnaces[i % drops]))
+    return w, _sim(w)
+
+def scen_ecology(seed):
+    # Random-tick regrowth on a large map; cost should not depend on size
+    w = World(seed, 256, 256)
+    eco, rng = Ecology(), random.Random(seed)
+    return w, lambda: eco.tick(w, rng)
+
+def scen_render(seed, scale=1.0):
+    g = GameEngine(persist=False)
+    g.set_render_scale(scale)
+    g.start_game(seed)
+    rng = random.Random(seed)
+    cx, cy = g.world.width // 2, g.world.height // 2
+    for _ in range(300):
+        x, y = cx + rng.randint(-12, 12), cy + rng.randint(-12, 12)
+        if (x, y) not in g.world.buildings:
+            g.world.add_building(Building(x, y, rng.choice(["drill", "conveyor", "furnace", "assembler"]), "RIGHT"))
+    def step():
+        g.update()
+        g.draw()
+        pygame.display.flip()
+    return g, step
+
+SCENARIOS = {
+    "worldgen_64": scen_worldgen(64),
+    "worldgen_128": scen_worldgen(128),
+    "worldgen_256": scen_worldgen(256),
+    "drills_1k": scen_drills,
+    "conveyor_10k": scen_conveyor_snake,
+    "conveyor_10k_flow": scen_conveyor_flow,
+    "totem_field": scen_totems,
+    "fast_forward_1k": scen_fast_forward,
+    "haulers_200": scen_haulers,
+    "ecology_256": scen_ecology,
+    "render_split": scen_render,
+    "render_split_50": lambda seed: scen_render(seed, 0.5),
+}
+
+# Repetitions per scenario; world generation is far slower than a tick
+STEPS = {"worldgen_64": 5, "worldgen_128": 3, "worldgen_256": 2, "render_split": 300, "render_split_50": 300, "fast_forward_1k": 50}
+
+# ==========================================
+# RUNNER
+# ==========================================
+
+def percentile(vals, p):
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, len(vals) * p // 100)]
+
+def run_scenario(name, seed, steps):
+    build = SCENARIOS[name]
+    tracemalloc.start()
+    _, step = build(seed)
+    for _ in range(min(steps, 10)):
+        step()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    _, step = build(seed)
+    times = []
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        t = time.perf_counter()
+        step()
+        times.append((time.perf_counter() - t) * 1000)
+    wall = time.perf_counter() - t0
+    return {
+        "steps": steps,
+        "ticks_per_sec": round(steps / wall, 2),
+        "p50_ms": round(percentile(times, 50), 3),
+        "p95_ms": round(percentile(times, 95), 3),
+        "p99_ms": round(percentile(times, 99), 3),
+        "peak_mb": round(peak / 2**20, 2),
+    }
+
+# metric -> True if higher is better
+METRICS = {"ticks_per_sec": True, "p95_ms": False, "peak_mb": False}
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if not base: continue
+        for m, higher_better in METRICS.items():
+            old, new = base.get(m), res.get(m)
+            if not old or new is None: continue
+            change = (new - old) / old
+            if (-change if higher_better else change) > threshold:
+                regressions.append(f"{name}.{m}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+def main_cli(argv=None):
+    ap = argparse.ArgumentParser(description="Factorial benchmark suite")
+    ap.add_argument("scenarios", nargs="*", help=f"subset of: {', '.join(SCENARIOS)}")
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--ticks", type=int, default=600, help="steps for simulation scenarios")
+    ap.add_argument("--baseline", default="bench_baseline.json")
+    ap.add_argument("--threshold", type=float, default=0.15, help="allowed fractional regression")
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    names = args.scenarios or list(SCENARIOS)
+    for n in names:
+        if n not in SCENARIOS: ap.error(f"unknown scenario {n}")
+
+    results = {}
+    for n in names:
+        res = run_scenario(n, args.seed, STEPS.get(n, args.ticks))
+        results[n] = res
+        print(f"{n:<18} {res['ticks_per_sec']:>10.1f}/s  p50 {res['p50_ms']:>8.3f}  "
+              f"p95 {res['p95_ms']:>8.3f}  p99 {res['p99_ms']:>8.3f} ms  peak {res['peak_mb']:>7.2f} MB")
+
+    if args.out:
+        with open(args.out, "w") as fh: json.dump(results, fh, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as fh: baseline = json.load(fh)
+        baseline.update(results)
+        with open(args.baseline, "w") as fh: json.dump(baseline, fh, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh: baseline = json.load(fh)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("REGRESSIONS:")
+            for r in regressions: print("  " + r)
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -2,6 +2,24 @@ import pygame
 import random
 import sys
 import math
+import os
+import time
+import json
+import hashlib
+import heapq
+import mmap
+import multiprocessing
+from multiprocessing import shared_memory
+import queue
+import socket
+import asyncio
+import struct
+from fractions import Fraction
+from array import array
+import threading
+import tracemalloc
+import zlib
+from collections import deque
 from enum import Enum
 
 # ==========================================
@@ -11,8 +29,16 @@ from enum import Enum
 SCREEN_WIDTH = 1280
 SCREEN_HEIGHT = 720
 FPS = 60
+# Most simulation ticks run in one frame when frames run long
+CATCH_UP_TICKS = 3
 TILE_SIZE = 32
 HALF_WIDTH = SCREEN_WIDTH // 2
+# World viewports can render into a smaller framebuffer that is upscaled
+# once per frame; F11 cycles through these
+RENDER_SCALES = (1.0, 0.75, 0.5)
+CHUNK_SIZE = 32
+UNDO_DEPTH = 5
+UNDO_TICKS = 600
 
 # Colors
 WHITE = (255, 255, 255)
@@ -41,10 +67,15 @@ GOLD_ORE_COLOR = (255, 200, 50)
 
 def _clamp(x): return max(0, min(255, int(x)))
 def vary_color(col, x, y, amt=15):
-    random.seed(x * 1000 + y)
-    d = random.randint(-amt, amt)
+    # Position hash rather than reseeding the global RNG per tile
+    h = ((x * 73856093) ^ (y * 19349663)) & 0x7fffffff
+    d = h % (2 * amt + 1) - amt
     return (_clamp(col[0]+d), _clamp(col[1]+d), _clamp(col[2]+d))
 
+def scale_rect(r, ts):
+    # World-pixel rect -> the same rect at ts pixels per tile
+    return pygame.Rect(r.x * ts // TILE_SIZE, r.y * ts // TILE_SIZE, r.w * ts // TILE_SIZE, r.h * ts // TILE_SIZE)
+
 # ==========================================
 # DATA & RECIPES
 # ==========================================
@@ -63,10 +94,24 @@ RECIPES = {
     "conveyor":  {"inputs": {"iron_ingot": 1, "gear": 1}, "output": 4, "type": "building"},
     "assembler": {"inputs": {"stone": 10, "circuit": 2}, "output": 1, "type": "building"},
     
+    # Drones (P1)
+    "hauler":    {"inputs": {"circuit": 1, "gear": 2}, "output": 1, "type": "item"},
+
     # Nature Structures (P2)
     "totem":     {"inputs": {}, "output": 1, "type": "nature"}, 
 }
 
+# Ore -> ingot, run by furnaces on their own
+SMELTING = {
+    "iron_ingot":   {"inputs": {"ore_iron": 1}, "output": 1},
+    "copper_ingot": {"inputs": {"ore_copper": 1}, "output": 1},
+    "gold_ingot":   {"inputs": {"ore_gold": 1}, "output": 1},
+}
+
+def compile_recipes(recipes):
+    # -> [(name, ((input, n), ...), ((output, n), ...))] in table order
+    return [(name, tuple(r["inputs"].items()), ((name, r["output"]),)) for name, r in recipes.items()]
+
 # ==========================================
 # SYSTEMS
 # ==========================================
@@ -78,6 +123,7 @@ class GameState(Enum):
     CRAFTING_MENU = 3 
     MAP_VIEW = 4
     CONTROLS = 5
+    STATS = 6
 
 class UnlockManager:
     def __init__(self):
@@ -103,6 +149,155 @@ class UnlockManager:
             return True
         return False
 
+# --- CRAFT PLANNING ---
+# A craft of N batches takes what it can from the backpack and makes the
+# rest of each input from its own recipe, recursively. Leftovers from a
+# sub-craft (gears come in pairs) are reused by later inputs.
+
+_RAW_CACHE = {}
+
+def craftable(item):
+    r = RECIPES.get(item)
+    return r is not None and r["type"] != "nature" and bool(r["inputs"])
+
+def raw_requirements(item):
+    # Raw materials per unit of item, as exact fractions; memoized
+    if item not in _RAW_CACHE:
+        if not craftable(item):
+            _RAW_CACHE[item] = {item: Fraction(1)}
+        else:
+            r, out = RECIPES[item], {}
+            for inp, amt in r["inputs"].items():
+                for raw, n in raw_requirements(inp).items():
+                    out[raw] = out.get(raw, 0) + n * amt / r["output"]
+            _RAW_CACHE[item] = out
+    return _RAW_CACHE[item]
+
+def plan_craft(stock, item, batches):
+    # -> (final stock, {recipe: batches}) or None if materials run out.
+    # stock is not modified.
+    stock, made = dict(stock), {}
+    def need(it, n):
+        take = min(stock.get(it, 0), n)
+        stock[it] = stock.get(it, 0) - take
+        n -= take
+        if n == 0: return True
+        if not craftable(it): return False
+        r = RECIPES[it]
+        k = -(-n // r["output"])
+        for inp, amt in r["inputs"].items():
+            if not need(inp, amt * k): return False
+        made[it] = made.get(it, 0) + k
+        stock[it] += k * r["output"] - n
+        return True
+    r = RECIPES[item]
+    for inp, amt in r["inputs"].items():
+        if not need(inp, amt * batches): return None
+    made[item] = made.get(item, 0) + batches
+    stock[item] = stock.get(item, 0) + batches * r["output"]
+    return {k: v for k, v in stock.items() if v}, made
+
+def max_crafts(stock, item):
+    # Upper bound in closed form from the raw vectors, with everything in
+    # the backpack counted at its raw worth; then bisect on plan_craft,
+    # since batch rounding can only lower it.
+    per_batch = {raw: n * RECIPES[item]["output"] for raw, n in raw_requirements(item).items()}
+    have = {}
+    for it, amt in stock.items():
+        for raw, n in raw_requirements(it).items():
+            have[raw] = have.get(raw, 0) + n * amt
+    hi = min(int(have.get(raw, 0) / n) for raw, n in per_batch.items())
+    lo = 0
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if plan_craft(stock, item, mid): lo = mid
+        else: hi = mid - 1
+    return lo
+
+# (name, seconds per slot, slots): the last minute by the second, the
+# last hour by the minute, the last day in 10 minute buckets.
+STAT_RESOLUTIONS = (("1s", 1, 60), ("1min", 60, 60), ("10min", 600, 144))
+
+class ProductionStats:
+    # Producers bump a per-item counter for the current simulated second;
+    # once a second those are folded into fixed-size rings, so memory is
+    # bounded by the item list, not the session length.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.produced = {}
+        self.consumed = {}
+        self.ticks = 0
+        self.seconds = 0
+        self.rings = {}
+        self.totals = {}
+
+    def attach(self, world):
+        self.reset()
+        world.stats = self
+
+    def produce(self, item, n=1):
+        self.produced[item] = self.produced.get(item, 0) + n
+
+    def consume(self, item, n=1):
+        self.consumed[item] = self.consumed.get(item, 0) + n
+
+    def tick(self):
+        self.ticks += 1
+        if self.ticks >= FPS:
+            self.ticks = 0
+            self.roll()
+
+    def advance(self, ticks):
+        self.ticks += ticks
+        while self.ticks >= FPS:
+            self.ticks -= FPS
+            self.roll()
+
+    def roll(self):
+        self.seconds += 1
+        sec = self.seconds
+        for r, (_, span, slots) in enumerate(STAT_RESOLUTIONS):
+            if sec % span == 0:
+                slot = (sec // span) % slots
+                for rings in self.rings.values(): rings[r][slot] = 0
+        for kind, counts in (("produced", self.produced), ("consumed", self.consumed)):
+            for item, n in counts.items():
+                key = (kind, item)
+                rings = self.rings.get(key)
+                if rings is None:
+                    rings = self.rings[key] = [[0] * slots for _, _, slots in STAT_RESOLUTIONS]
+                for r, (_, span, slots) in enumerate(STAT_RESOLUTIONS):
+                    rings[r][(sec // span) % slots] += n
+                self.totals[key] = self.totals.get(key, 0) + n
+            counts.clear()
+
+    def history(self, kind, item, res=1):
+        # Oldest to newest; the last slot is the current period
+        rings = self.rings.get((kind, item))
+        _, span, slots = STAT_RESOLUTIONS[res]
+        if rings is None: return [0] * slots
+        head = (self.seconds // span) % slots + 1
+        ring = rings[res]
+        return ring[head:] + ring[:head]
+
+    def per_minute(self, kind, item):
+        # Over the last minute of 1s samples
+        hist = self.history(kind, item, 0)
+        return sum(hist) * 60 / max(1, min(self.seconds, len(hist)))
+
+    def items(self):
+        return sorted({item for _, item in self.rings})
+
+    def report(self):
+        return {
+            "seconds": self.seconds,
+            "items": {item: {kind: {"total": self.totals.get((kind, item), 0), "per_min": round(self.per_minute(kind, item), 2),
+                                    **{name: self.history(kind, item, r) for r, (name, _, _) in enumerate(STAT_RESOLUTIONS)}}
+                             for kind in ("produced", "consumed")} for item in self.items()},
+        }
+
 # ==========================================
 # WORLD
 # ==========================================
@@ -119,37 +314,74 @@ class TileType(Enum):
     ORE_GOLD = 8
     ESSENCE = 9
 
-class Tile:
-    def __init__(self, x, y, t_type):
-        self.rect = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-        self.type = t_type
-        self.base_color = self._get_color(t_type, x, y)
-    
-    def _get_color(self, t, x, y):
-        if t == TileType.GRASS: return vary_color(GRASS_GREEN, x, y, 10)
-        if t == TileType.SAND: return vary_color(SAND_TAN, x, y, 10)
-        if t == TileType.WATER: return vary_color(WATER_BLUE, x, y, 5)
-        if t == TileType.STONE: return vary_color(STONE_SLATE, x, y, 10)
-        return BLACK 
+TILE_TYPES = list(TileType)
+GENERATOR_VERSION = 2
+WORLD_CACHE_DIR = "cache"
+FONT_CACHE = os.path.join(WORLD_CACHE_DIR, "fonts.json")
+WORLD_CACHE_MAGIC = b"FWC1"
+
+# What a drill standing on each tile type mines
+DRILL_YIELDS = {TileType.ORE_IRON: "ore_iron", TileType.ORE_COPPER: "ore_copper", TileType.ORE_COAL: "coal",
+                TileType.ORE_GOLD: "ore_gold", TileType.STONE: "stone"}
+
+def tile_color(t, x, y):
+    if t == TileType.GRASS: return vary_color(GRASS_GREEN, x, y, 10)
+    if t == TileType.SAND: return vary_color(SAND_TAN, x, y, 10)
+    if t == TileType.WATER: return vary_color(WATER_BLUE, x, y, 5)
+    if t == TileType.STONE: return vary_color(STONE_SLATE, x, y, 10)
+    return BLACK 
 
 class World:
-    def __init__(self, seed, width=128, height=128):
+    # Tiles live in flat row-major arrays: types holds one TileType value
+    # per tile, colors three bytes (RGB) per tile.
+    def __init__(self, seed, width=128, height=128, generate=True, tiles=None):
         self.seed = seed
         self.width = width
         self.height = height
-        self.tiles = {}
+        if tiles:
+            self.types, self.colors = tiles
+        else:
+            self.types = bytearray(width * height)
+            self.colors = bytearray(width * height * 3)
         self.buildings = {} 
-        self.generate()
+        self.building_chunks = {}
+        self.tile_listeners = []
+        self.building_listeners = []
+        self.inventory_listeners = []
+        self.hauler_listeners = []
+        self.haulers = {}
+        self.next_hauler = 1
+        self.paths = None
+        self.index = None
+        self.snapshots = []
+        self.flow = None
+        self.stats = None
+        if generate and not tiles: self.generate()
+
+    @classmethod
+    def create(cls, seed, width=128, height=128, cache_dir=WORLD_CACHE_DIR, timer=None):
+        w = cls(seed, width, height, generate=False)
+        if cache_dir and w.load_cache(cache_dir):
+            if timer: timer.mark("world_cache_load")
+            return w
+        w.generate()
+        if timer: timer.mark("world_generate")
+        if cache_dir:
+            w.save_cache(cache_dir)
+            if timer: timer.mark("world_cache_save")
+        return w
 
     def generate(self):
-        random.seed(self.seed)
+        rng = random.Random(self.seed)
+        uniform, rand = rng.uniform, rng.random
+        types, colors = self.types, self.colors
+        col_x = [(math.sin(x * 0.05) + math.sin(x * 0.15) * 0.5) for x in range(self.width)]
+        i = 0
         for y in range(self.height):
+            ny = y * 0.05
+            row = math.cos(ny) + math.cos(ny*3) * 0.5
             for x in range(self.width):
-                nx = x * 0.05
-                ny = y * 0.05
-                base = math.sin(nx) + math.cos(ny)
-                detail = math.sin(nx*3) * 0.5 + math.cos(ny*3) * 0.5
-                n = base + detail + random.uniform(-0.2, 0.2)
+                n = col_x[x] + row + uniform(-0.2, 0.2)
 
                 t_type = TileType.GRASS
                 if n < -1.5: t_type = TileType.WATER
@@ -157,39 +389,495 @@ class World:
                 elif n > 1.8: t_type = TileType.STONE
                 
                 if t_type == TileType.GRASS:
-                    if random.random() < 0.08: t_type = TileType.TREE
-                    elif random.random() < 0.02: t_type = TileType.ESSENCE
-                    elif random.random() < 0.015: t_type = TileType.ORE_COAL
+                    if rand() < 0.08: t_type = TileType.TREE
+                    elif rand() < 0.02: t_type = TileType.ESSENCE
+                    elif rand() < 0.015: t_type = TileType.ORE_COAL
                 elif t_type == TileType.STONE:
-                    rnd = random.random()
+                    rnd = rand()
                     if rnd < 0.15: t_type = TileType.ORE_IRON
                     elif rnd < 0.25: t_type = TileType.ORE_COPPER
                     elif rnd < 0.28: t_type = TileType.ORE_GOLD
 
-                self.tiles[(x, y)] = Tile(x, y, t_type)
+                types[i] = t_type.value
+                colors[i*3:i*3+3] = bytes(tile_color(t_type, x, y))
+                i += 1
+
+    # --- GENERATED WORLD CACHE ---
+    def cache_path(self, cache_dir):
+        return os.path.join(cache_dir, f"world_{self.seed}_{self.width}x{self.height}_v{GENERATOR_VERSION}.bin")
+
+    def save_cache(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        path = self.cache_path(cache_dir)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(struct.pack("<4sIII", WORLD_CACHE_MAGIC, GENERATOR_VERSION, self.width, self.height))
+            fh.write(self.types)
+            fh.write(self.colors)
+        os.replace(tmp, path)
+
+    def load_cache(self, cache_dir):
+        path = self.cache_path(cache_dir)
+        n = self.width * self.height
+        hdr = struct.calcsize("<4sIII")
+        try:
+            with open(path, "rb") as fh:
+                # Private copy-on-write mapping: edits never reach the file
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            return False
+        if len(mm) != hdr + n * 4 or struct.unpack_from("<4sIII", mm) != (WORLD_CACHE_MAGIC, GENERATOR_VERSION, self.width, self.height):
+            mm.close()
+            return False
+        view = memoryview(mm)
+        self.types = view[hdr:hdr + n]
+        self.colors = view[hdr + n:hdr + n * 4]
+        return True
+
+    def detach(self):
+        # Copy file-mapped tile arrays into memory so the file can be replaced
+        if isinstance(self.types, memoryview):
+            self.types = bytearray(self.types)
+            self.colors = bytearray(self.colors)
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
 
     def get_tile_type(self, x, y):
-        t = self.tiles.get((x, y))
-        return t.type if t else None
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return TILE_TYPES[self.types[y * self.width + x]]
+        return None
+
+    # --- TILE QUERIES ---
+    def tile_index(self):
+        if self.index is None: self.index = TileIndex(self)
+        return self.index
+
+    def nearest_tiles(self, t, x, y, k=1):
+        return self.tile_index().nearest(t, x, y, k)
+
+    def count_tiles(self, t, x0, y0, x1, y1):
+        return self.tile_index().count(t, x0, y0, x1, y1)
+
+    def get_color(self, x, y):
+        i = (y * self.width + x) * 3
+        return tuple(self.colors[i:i+3])
 
     def set_tile_type(self, x, y, new_type):
-        if (x,y) in self.tiles:
-            self.tiles[(x,y)].type = new_type
-            self.tiles[(x,y)].base_color = self.tiles[(x,y)]._get_color(new_type, x, y)
+        if 0 <= x < self.width and 0 <= y < self.height:
+            if self.snapshots: self._preserve_tiles(x // CHUNK_SIZE, y // CHUNK_SIZE)
+            i = y * self.width + x
+            self.types[i] = new_type.value
+            self.colors[i*3:i*3+3] = bytes(tile_color(new_type, x, y))
+            for fn in self.tile_listeners:
+                fn(x, y)
+
+    def set_tile_types(self, changes):
+        # Batch form of set_tile_type for [(x, y, TileType)]: snapshot
+        # copies happen once per chunk touched, and listeners only hear
+        # about the changed tiles
+        changes = [c for c in changes if self.in_bounds(c[0], c[1])]
+        if self.snapshots:
+            for key in {(x // CHUNK_SIZE, y // CHUNK_SIZE) for x, y, _ in changes}: self._preserve_tiles(*key)
+        types, colors, w = self.types, self.colors, self.width
+        for x, y, t in changes:
+            i = y * w + x
+            types[i] = t.value
+            colors[i*3:i*3+3] = bytes(tile_color(t, x, y))
+        for fn in self.tile_listeners:
+            for x, y, _ in changes: fn(x, y)
 
     def get_building(self, x, y):
         return self.buildings.get((x, y))
 
+    def tick(self):
+        # Every building's timer moves each tick, so a pending snapshot
+        # keeps all timers before the first one runs.
+        for snap in self.snapshots:
+            if snap.timers is None: snap.preserve_timers()
+        for b in self.buildings.values():
+            b.update(self)
+        for h in self.haulers.values():
+            h.update(self)
+        if self.flow: self.flow.tick(self)
+        if self.stats: self.stats.tick()
+
+    def fast_forward(self, ticks):
+        # Catch-up: every building runs the cycles it would have finished
+        # in one batched step. Buildings go one after another rather than
+        # interleaved tick by tick, so long chains settle slightly
+        # differently than ticking would.
+        for snap in self.snapshots:
+            if snap.timers is None: snap.preserve_timers()
+        for b in list(self.buildings.values()):
+            total = b.timer + ticks
+            k = total // b.period
+            b.timer = total - k * b.period
+            if k: b.run_cycles(self, k)
+        for h in self.haulers.values():
+            h.advance(self, ticks)
+        if self.flow:
+            self.flow.ticks += ticks
+            if self.flow.ticks >= self.flow.window: self.flow.roll(self)
+        if self.stats: self.stats.advance(ticks)
+
+    def add_building(self, b):
+        if self.snapshots: self._preserve_building((b.x, b.y))
+        self.buildings[(b.x, b.y)] = b
+        key = (b.x // CHUNK_SIZE, b.y // CHUNK_SIZE)
+        self.building_chunks.setdefault(key, set()).add((b.x, b.y))
+        b.inventory.listener = self.on_inventory_change
+        for fn in self.building_listeners:
+            fn("add", b)
+
+    def buildings_in_rect(self, x0, y0, x1, y1):
+        for cy in range(max(0, y0) // CHUNK_SIZE, max(0, y1) // CHUNK_SIZE + 1):
+            for cx in range(max(0, x0) // CHUNK_SIZE, max(0, x1) // CHUNK_SIZE + 1):
+                for loc in self.building_chunks.get((cx, cy), ()):
+                    if x0 <= loc[0] <= x1 and y0 <= loc[1] <= y1:
+                        yield self.buildings[loc]
+
+    def set_recipe(self, b, name):
+        if self.snapshots: self._preserve_building((b.x, b.y))
+        b.select_recipe(name)
+        for fn in self.building_listeners:
+            fn("recipe", b)
+
+    def add_buildings(self, bs):
+        # Batch form of add_building: chunk index updates happen once per
+        # chunk rather than once per building.
+        by_chunk = {}
+        for b in bs:
+            by_chunk.setdefault((b.x // CHUNK_SIZE, b.y // CHUNK_SIZE), []).append(b)
+            if self.snapshots: self._preserve_building((b.x, b.y))
+        for key, group in by_chunk.items():
+            self.building_chunks.setdefault(key, set()).update((b.x, b.y) for b in group)
+        self.buildings.update(((b.x, b.y), b) for b in bs)
+        for b in bs:
+            b.inventory.listener = self.on_inventory_change
+        for fn in self.building_listeners:
+            for b in bs: fn("add", b)
+
+    def remove_building(self, x, y):
+        if self.snapshots and (x, y) in self.buildings: self._preserve_building((x, y))
+        b = self.buildings.pop((x, y), None)
+        if b:
+            key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+            chunk = self.building_chunks.get(key)
+            if chunk:
+                chunk.discard((x, y))
+                if not chunk: del self.building_chunks[key]
+            b.inventory.listener = None
+            for fn in self.building_listeners:
+                fn("remove", b)
+        return b
+
+    # --- HAULERS ---
+    def add_hauler(self, h):
+        self.haulers[h.id] = h
+        self.next_hauler = max(self.next_hauler, h.id + 1)
+        h.inventory.listener = self.on_inventory_change
+        for fn in self.hauler_listeners:
+            fn("add", h)
+
+    def move_hauler(self, h, x, y):
+        h.x, h.y = x, y
+        for fn in self.hauler_listeners:
+            fn("move", h)
+
+    def remove_hauler(self, h_id):
+        h = self.haulers.pop(h_id, None)
+        if h:
+            h.inventory.listener = None
+            for fn in self.hauler_listeners:
+                fn("remove", h)
+        return h
+
+    def flow_field(self, goal):
+        if self.paths is None: self.paths = PathCache(self)
+        return self.paths.field(goal)
+
+    def on_inventory_change(self, owner, item, delta):
+        if self.snapshots and owner[0] == "b":
+            # Listeners fire after the change, so back it out of the copy
+            loc = (owner[1], owner[2])
+            for snap in self.snapshots:
+                if loc not in snap.buildings:
+                    snap.preserve_building(loc)
+                    snap.unapply_inventory(loc, item, delta)
+        for fn in self.inventory_listeners:
+            fn(owner, item, delta)
+
+    # --- SNAPSHOTS ---
+    def snapshot(self):
+        snap = WorldSnapshot(self)
+        self.snapshots.append(snap)
+        return snap
+
+    def _preserve_tiles(self, cx, cy):
+        for snap in self.snapshots:
+            if (cx, cy) not in snap.tiles: snap.preserve_tiles((cx, cy))
+
+    def _preserve_building(self, loc):
+        for snap in self.snapshots:
+            if loc not in snap.buildings: snap.preserve_building(loc)
+
+    def chunk_bounds(self, cx, cy):
+        x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+        return x0, y0, min(self.width, x0 + CHUNK_SIZE), min(self.height, y0 + CHUNK_SIZE)
+
+    def restore(self, snap):
+        # Rolls every chunk touched since the snapshot back through the
+        # normal mutation calls, so listeners (minimap, autosave) follow.
+        for (cx, cy), saved in list(snap.tiles.items()):
+            x0, y0, x1, y1 = self.chunk_bounds(cx, cy)
+            i = 0
+            for y in range(y0, y1):
+                row = y * self.width
+                for x in range(x0, x1):
+                    if self.types[row + x] != saved[i]:
+                        self.set_tile_type(x, y, TILE_TYPES[saved[i]])
+                    i += 1
+        for loc, rec in list(snap.buildings.items()):
+            self.remove_building(*loc)
+            if rec:
+                b = building_from_record(rec)
+                items = b.inventory.items
+                b.inventory.items = {}
+                b.select_recipe(b.default_recipe)
+                self.add_building(b)
+                if rec[6] != b.recipe: self.set_recipe(b, rec[6])
+                for item, amt in items.items():
+                    b.inventory.add(item, amt)
+        if snap.timers is not None:
+            for loc, b in self.buildings.items():
+                if loc not in snap.buildings: b.timer = snap.timers[loc]
+
+# --- TILE INDEX ---
+# Where every tile of each type is, bucketed by chunk: each bucket is an
+# array('H') of local offsets (ly * CHUNK_SIZE + lx), two bytes a tile.
+# GRASS and WATER cover most of any map, so they get no buckets; queries
+# for them read the chunk back from the index's own copy of the type
+# array, which it keeps anyway to know what a changed tile used to be.
+# Kept current as a tile listener; the engine builds it while a game
+# starts or loads so the HUD's first scan never pays for it.
+
+class TileIndex:
+    UNINDEXED = frozenset((TileType.GRASS.value, TileType.WATER.value))
+    PAD = 255  # not a tile type; fills chunk rows past the map edge
+
+    def __init__(self, world):
+        self.world = world
+        self.known = bytearray(world.types)
+        self.chunks = [{} for _ in TILE_TYPES]
+        wanted = [t.value for t in TILE_TYPES if t.value not in self.UNINDEXED]
+        for cy in range((world.height + CHUNK_SIZE - 1) // CHUNK_SIZE):
+            for cx in range((world.width + CHUNK_SIZE - 1) // CHUNK_SIZE):
+                cell = self.cell_bytes(cx, cy)
+                for t in wanted:
+                    if t in cell: self.chunks[t][(cx, cy)] = self.find_all(cell, t)
+        world.tile_listeners.append(self.on_tile)
+
+    def cell_bytes(self, cx, cy):
+        # The chunk's types as CHUNK_SIZE full rows, padded past the edges
+        w, known = self.world.width, self.known
+        x0, x1 = cx * CHUNK_SIZE, min((cx + 1) * CHUNK_SIZE, w)
+        rows = b"".join(known[y * w + x0:y * w + x1].ljust(CHUNK_SIZE, bytes((self.PAD,)))
+                        for y in range(cy * CHUNK_SIZE, min((cy + 1) * CHUNK_SIZE, self.world.height)))
+        return rows.ljust(CHUNK_SIZE * CHUNK_SIZE, bytes((self.PAD,)))
+
+    @staticmethod
+    def find_all(cell, t):
+        offsets, i = array('H'), cell.find(t)
+        while i >= 0:
+            offsets.append(i)
+            i = cell.find(t, i + 1)
+        return offsets
+
+    def cell(self, t, cx, cy):
+        # Local offsets of the tiles of type value t in chunk (cx, cy)
+        if t not in self.UNINDEXED: return self.chunks[t].get((cx, cy), ())
+        if not (0 <= cx * CHUNK_SIZE < self.world.width and 0 <= cy * CHUNK_SIZE < self.world.height): return ()
+        return self.find_all(self.cell_bytes(cx, cy), t)
+
+    def on_tile(self, x, y):
+        i = y * self.world.width + x
+        old, new = self.known[i], self.world.types[i]
+        if old == new: return
+        self.known[i] = new
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        off = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+        if old not in self.UNINDEXED:
+            cell = self.chunks[old][key]
+            cell.remove(off)
+            if not cell: del self.chunks[old][key]
+        if new not in self.UNINDEXED:
+            self.chunks[new].setdefault(key, array('H')).append(off)
+
+    def resync(self):
+        # Catches up with changes that bypassed the listeners
+        w = self.world.width
+        for i, (old, new) in enumerate(zip(self.known, self.world.types)):
+            if old != new: self.on_tile(i % w, i // w)
+
+    def total(self, t):
+        if t.value in self.UNINDEXED: return self.known.count(t.value)
+        return sum(len(c) for c in self.chunks[t.value].values())
+
+    def nbytes(self):
+        return sys.getsizeof(self.known) + sum(sys.getsizeof(d) + sum(sys.getsizeof(k) + sys.getsizeof(c) for k, c in d.items())
+                                               for d in self.chunks)
+
+    def count(self, t, x0, y0, x1, y1):
+        # Tiles of type t in the inclusive rectangle; chunks wholly inside
+        # it are counted by size
+        n = 0
+        for cy in range(max(0, y0) // CHUNK_SIZE, max(0, y1) // CHUNK_SIZE + 1):
+            for cx in range(max(0, x0) // CHUNK_SIZE, max(0, x1) // CHUNK_SIZE + 1):
+                cell = self.cell(t.value, cx, cy)
+                if not len(cell): continue
+                bx, by = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+                if x0 <= bx and bx + CHUNK_SIZE - 1 <= x1 and y0 <= by and by + CHUNK_SIZE - 1 <= y1:
+                    n += len(cell)
+                else:
+                    n += sum(1 for o in cell if x0 <= bx + o % CHUNK_SIZE <= x1 and y0 <= by + o // CHUNK_SIZE <= y1)
+        return n
+
+    def nearest(self, t, x, y, k=1):
+        # Up to k tiles of type t by straight-line distance from (x, y).
+        # Chunks are searched in square rings outward; every tile in ring r
+        # is at least (r - 1) * CHUNK_SIZE + 1 away, so the search stops
+        # once the k-th best is closer than that.
+        if not (t.value in self.known if t.value in self.UNINDEXED else self.chunks[t.value]): return []
+        ccx, ccy = x // CHUNK_SIZE, y // CHUNK_SIZE
+        max_r = max(self.world.width, self.world.height) // CHUNK_SIZE + 1
+        found = []
+        for r in range(max_r + 1):
+            if len(found) >= k and r and found[k - 1][0] <= ((r - 1) * CHUNK_SIZE + 1) ** 2: break
+            for cy in range(ccy - r, ccy + r + 1):
+                step = 1 if cy in (ccy - r, ccy + r) else 2 * r or 1
+                for cx in range(ccx - r, ccx + r + 1, step):
+                    bx, by = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+                    for o in self.cell(t.value, cx, cy):
+                        tx, ty = bx + o % CHUNK_SIZE, by + o // CHUNK_SIZE
+                        found.append(((tx - x) ** 2 + (ty - y) ** 2, ty, tx))
+            found.sort()
+            del found[k:]
+        return [(tx, ty) for _, ty, tx in found]
+
+# --- ECOLOGY ---
+# Random ticks: every game tick looks at a fixed number of random tiles,
+# so the cost is the same on any map size. Grass beside a tree may sprout
+# one and bare grass very rarely brings up essence. Rolls come from the
+# engine's gameplay rng, so replays see the same growth.
+ECO_SAMPLES = 16
+ECO_TREE_CHANCE = 0.01
+ECO_ESSENCE_CHANCE = 0.0002
+
+class Ecology:
+    def __init__(self, samples=ECO_SAMPLES):
+        self.samples = samples
+        self.grown = self.respawned = 0
+
+    def tick(self, world, rng):
+        types, w, h = world.types, world.width, world.height
+        grass, tree = TileType.GRASS.value, TileType.TREE.value
+        changes = []
+        for i in rng.choices(range(w * h), k=self.samples):
+            if types[i] != grass: continue
+            x, y = i % w, i // w
+            if (x, y) in world.buildings: continue
+            roll = rng.random()
+            if roll < ECO_ESSENCE_CHANCE:
+                changes.append((x, y, TileType.ESSENCE))
+                self.respawned += 1
+            elif roll < ECO_TREE_CHANCE and ((y > 0 and types[i - w] == tree) or (y < h - 1 and types[i + w] == tree)
+                                             or (x > 0 and types[i - 1] == tree) or (x < w - 1 and types[i + 1] == tree)):
+                changes.append((x, y, TileType.TREE))
+                self.grown += 1
+        if changes: world.set_tile_types(changes)
+
+def building_record(b):
+    return (b.x, b.y, b.type, b.facing, b.timer, dict(b.inventory.items), b.recipe)
+
+def building_from_record(rec):
+    b = Building(rec[0], rec[1], rec[2], rec[3])
+    b.timer = rec[4]
+    b.inventory.items = dict(rec[5])
+    b.select_recipe(rec[6])
+    return b
+
+class WorldSnapshot:
+    # Taking one is O(1); a chunk's tile types are copied the first time
+    # the live world is about to change them, and a building's record the
+    # first time it is added, removed, retuned or its inventory changes.
+    # Timers move every tick, so the first tick saves just those, one int
+    # per building. Anything not copied is read from the live world.
+    def __init__(self, world):
+        self.world = world
+        self.tiles = {}
+        self.buildings = {}     # loc -> record as of the snapshot, None if empty
+        self.timers = None
+
+    def preserve_tiles(self, key):
+        w = self.world
+        x0, y0, x1, y1 = w.chunk_bounds(*key)
+        self.tiles[key] = b"".join(bytes(w.types[y * w.width + x0:y * w.width + x1]) for y in range(y0, y1))
+
+    def preserve_building(self, loc):
+        b = self.world.buildings.get(loc)
+        self.buildings[loc] = self.record(b) if b else None
+
+    def preserve_timers(self):
+        self.timers = {loc: b.timer for loc, b in self.world.buildings.items()}
+
+    def record(self, b):
+        # A live building that has not been copied, as it was at the snapshot
+        rec = building_record(b)
+        if self.timers is None: return rec
+        return rec[:4] + (self.timers.get((b.x, b.y), b.timer),) + rec[5:]
+
+    def unapply_inventory(self, loc, item, delta):
+        rec = self.buildings[loc]
+        if rec:
+            amt = rec[5].get(item, 0) - delta
+            if amt > 0: rec[5][item] = amt
+            else: rec[5].pop(item, None)
+
+    def release(self):
+        if self in self.world.snapshots: self.world.snapshots.remove(self)
+
+    def materialize(self):
+        # A detached World equal to the snapshot, for what-if runs
+        live = self.world
+        w = World(live.seed, live.width, live.height, tiles=(bytearray(live.types), bytearray(live.colors)))
+        for key, saved in self.tiles.items():
+            x0, y0, x1, y1 = live.chunk_bounds(*key)
+            cw = x1 - x0
+            for y in range(y0, y1):
+                row = saved[(y - y0) * cw:(y - y0 + 1) * cw]
+                w.types[y * live.width + x0:y * live.width + x1] = row
+                for x in range(x0, x1):
+                    i = y * live.width + x
+                    w.colors[i*3:i*3+3] = bytes(tile_color(TILE_TYPES[w.types[i]], x, y))
+        records = [self.record(b) for loc, b in live.buildings.items() if loc not in self.buildings]
+        records += [rec for rec in self.buildings.values() if rec]
+        w.add_buildings([building_from_record(rec) for rec in records])
+        return w
+
 # ==========================================
 # ENTITIES
 # ==========================================
 
 class Inventory:
-    def __init__(self):
+    def __init__(self, owner=None):
         self.items = {}
+        self.owner = owner
+        self.listener = None
 
     def add(self, item, amount=1):
         self.items[item] = self.items.get(item, 0) + amount
+        if self.listener: self.listener(self.owner, item, amount)
 
     def has(self, item, amount=1):
         return self.items.get(item, 0) >= amount
@@ -199,6 +887,7 @@ class Inventory:
             self.items[item] -= amount
             if self.items[item] <= 0:
                 del self.items[item]
+            if self.listener: self.listener(self.owner, item, -amount)
             return True
         return False
     
@@ -211,24 +900,31 @@ class Player:
         self.rect = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE-6, TILE_SIZE-6)
         self.color = color
         self.speed = 5
-        self.inventory = Inventory()
+        self.inventory = Inventory(("p", p_id))
         self.facing = "DOWN" 
         self.interact_rect = self.rect.copy()
         
         self.hotbar_index = 0
 
-    def update(self, keys, w_px, h_px):
+    def read_keys(self, keys):
         dx, dy = 0, 0
         if self.id == 1: 
-            if keys[pygame.K_w]: dy = -1; self.facing = "UP"
-            if keys[pygame.K_s]: dy = 1; self.facing = "DOWN"
-            if keys[pygame.K_a]: dx = -1; self.facing = "LEFT"
-            if keys[pygame.K_d]: dx = 1; self.facing = "RIGHT"
+            if keys[pygame.K_w]: dy = -1
+            if keys[pygame.K_s]: dy = 1
+            if keys[pygame.K_a]: dx = -1
+            if keys[pygame.K_d]: dx = 1
         else: 
-            if keys[pygame.K_UP]: dy = -1; self.facing = "UP"
-            if keys[pygame.K_DOWN]: dy = 1; self.facing = "DOWN"
-            if keys[pygame.K_LEFT]: dx = -1; self.facing = "LEFT"
-            if keys[pygame.K_RIGHT]: dx = 1; self.facing = "RIGHT"
+            if keys[pygame.K_UP]: dy = -1
+            if keys[pygame.K_DOWN]: dy = 1
+            if keys[pygame.K_LEFT]: dx = -1
+            if keys[pygame.K_RIGHT]: dx = 1
+        return dx, dy
+
+    def update(self, dx, dy, w_px, h_px):
+        if dx == 1: self.facing = "RIGHT"
+        elif dx == -1: self.facing = "LEFT"
+        elif dy == 1: self.facing = "DOWN"
+        elif dy == -1: self.facing = "UP"
 
         if dx != 0 or dy != 0:
             mag = math.sqrt(dx*dx + dy*dy)
@@ -256,24 +952,27 @@ class Player:
         if self.hotbar_index >= len(items): self.hotbar_index = 0
         return items[self.hotbar_index]
 
-    def render(self, surface, cam):
-        r = self.rect.move(-cam[0], -cam[1])
+    def render(self, surface, cam, ts=TILE_SIZE):
+        # cam is in surface pixels, at ts pixels per tile
+        k = ts / TILE_SIZE
+        r = scale_rect(self.rect, ts).move(-cam[0], -cam[1])
         pygame.draw.rect(surface, self.color, r)
-        pygame.draw.rect(surface, BLACK, r, 2)
+        pygame.draw.rect(surface, BLACK, r, max(1, round(2 * k)))
         
         eye_color = WHITE
         eye_off_x, eye_off_y = 0, 0
-        if self.facing == "UP": eye_off_y = -4
-        if self.facing == "DOWN": eye_off_y = 4
-        if self.facing == "LEFT": eye_off_x = -4
-        if self.facing == "RIGHT": eye_off_x = 4
+        e, d, rad = round(4 * k), round(3 * k), max(1, round(2 * k))
+        if self.facing == "UP": eye_off_y = -e
+        if self.facing == "DOWN": eye_off_y = e
+        if self.facing == "LEFT": eye_off_x = -e
+        if self.facing == "RIGHT": eye_off_x = e
         
-        pygame.draw.circle(surface, eye_color, (r.centerx + eye_off_x - 3, r.centery + eye_off_y - 3), 2)
-        pygame.draw.circle(surface, eye_color, (r.centerx + eye_off_x + 3, r.centery + eye_off_y - 3), 2)
+        pygame.draw.circle(surface, eye_color, (r.centerx + eye_off_x - d, r.centery + eye_off_y - d), rad)
+        pygame.draw.circle(surface, eye_color, (r.centerx + eye_off_x + d, r.centery + eye_off_y - d), rad)
 
-        sel = self.interact_rect.move(-cam[0], -cam[1])
-        tx, ty = sel.centerx // TILE_SIZE, sel.centery // TILE_SIZE
-        grid_sel = pygame.Rect(tx*TILE_SIZE - cam[0], ty*TILE_SIZE - cam[1], TILE_SIZE, TILE_SIZE)
+        sel = scale_rect(self.interact_rect, ts).move(-cam[0], -cam[1])
+        tx, ty = sel.centerx // ts, sel.centery // ts
+        grid_sel = pygame.Rect(tx*ts - cam[0], ty*ts - cam[1], ts, ts)
         pygame.draw.rect(surface, (255, 255, 255), grid_sel, 1)
 
 # ==========================================
@@ -281,137 +980,2375 @@ class Player:
 # ==========================================
 
 class Building:
+    # Building(x, y, "drill") returns the class registered for that type
+    # in BUILDING_TYPES. Per-type data are class attributes and behaviour
+    # is in run_cycles/draw overrides, so a tick goes straight to the
+    # right code without comparing type names.
+    period = 1 << 30        # ticks per work cycle
+    unlock = None           # UnlockManager key needed to build it
+    placed_by = None        # id of the player who places it
+    limits = None           # per-item buffer limits, "*" for unlisted items
+    recipes = None          # compiled recipes, for converting machines
+    default_recipe = None   # set when the recipe is chosen per machine
+    map_color = WHITE
+    boostable = True        # sped up by nearby totems
+
+    def __new__(cls, x, y, b_type, facing="DOWN"):
+        if cls is Building: cls = BUILDING_TYPES.get(b_type, Building)
+        return super().__new__(cls)
+
     def __init__(self, x, y, b_type, facing="DOWN"):
         self.x, self.y = x, y
         self.type = b_type
         self.facing = facing
         self.rect = pygame.Rect(x*TILE_SIZE, y*TILE_SIZE, TILE_SIZE, TILE_SIZE)
-        self.inventory = Inventory()
+        self.inventory = Inventory(("b", x, y))
         self.timer = 0
-        
+        # Work-cycle outcomes and items handed on, read by FlowMonitor
+        self.cycles = [0, 0, 0, 0]
+        self.sent = 0
+        # Last work cycle could not pass its output on
+        self.stalled = False
+        dx, dy = FACING_STEPS.get(facing, (0, 0))
+        self.target = (x + dx, y + dy)
+        self.select_recipe(self.default_recipe)
+
+    def select_recipe(self, name):
+        self.recipe = name
+        self.active = [r for r in self.recipes if r[0] == name] if self.recipes and name else self.recipes
+
+    def room(self, item):
+        limits = self.limits
+        if limits is None: return 1 << 30
+        return limits.get(item, limits["*"]) - self.inventory.items.get(item, 0)
+
+    def offers(self):
+        # What a hauler may take: a machine's recipe outputs, or anything
+        # for buildings without recipes
+        items = self.inventory.items
+        if not self.active: return list(items.items())
+        outs = {item for _, _, outputs in self.active for item, _ in outputs}
+        return [(item, n) for item, n in items.items() if item in outs]
+
     def update(self, world):
         self.timer += 1
-        
-        if self.type == "drill":
-            if self.timer >= 100: 
-                self.timer = 0
-                tile = world.get_tile_type(self.x, self.y)
-                res = None
-                if tile == TileType.ORE_IRON: res = "ore_iron"
-                elif tile == TileType.ORE_COPPER: res = "ore_copper"
-                elif tile == TileType.ORE_COAL: res = "coal"
-                elif tile == TileType.ORE_GOLD: res = "ore_gold"
-                elif tile == TileType.STONE: res = "stone"
-                
-                if res:
-                    self.output_item(world, res)
-
-        elif self.type == "furnace":   
-            if self.timer >= 150: 
-                self.timer = 0
-                for ore, ingot in [("ore_iron", "iron_ingot"), 
-                                   ("ore_copper", "copper_ingot"), 
-                                   ("ore_gold", "gold_ingot")]:
-                    if self.inventory.has(ore):
-                        self.inventory.remove(ore, 1)
-                        self.inventory.add(ingot, 1)
-                        break
-
-        elif self.type == "conveyor":
-            if self.timer >= 30: 
-                self.timer = 0
-                for item, amt in list(self.inventory.items.items()):
-                    if amt > 0:
-                        if self.output_item(world, item):
-                            self.inventory.remove(item, 1)
-                            break 
-
-        elif self.type == "assembler":
-            if self.timer >= 200:
-                self.timer = 0
-                if self.inventory.has("iron_ingot", 1):
-                    self.inventory.remove("iron_ingot", 1)
-                    self.inventory.add("gear", 2)
-
-        elif self.type == "totem":
-            if self.timer >= 60:
-                self.timer = 0
-                for dy in range(-2, 3):
-                    for dx in range(-2, 3):
-                        b = world.get_building(self.x + dx, self.y + dy)
-                        if b and b.type != "totem":
-                            b.timer += 20 
-
-    def output_item(self, world, item_name):
-        nx, ny = self.get_neighbor_coords()
-        target = world.get_building(nx, ny)
-        if target:
-            target.inventory.add(item_name, 1)
-            return True
-        elif self.type == "drill":
-            self.inventory.add(item_name, 1)
-            return True
-        return False
+        if self.timer >= self.period:
+            self.timer = 0
+            self.run_cycles(world, 1)
+
+    def run_cycles(self, world, k):
+        # k work cycles in one step. Each machine does its k cycles with a
+        # handful of min() and bulk add/remove calls, so cost does not
+        # depend on k.
+        pass
+
+    def end_cycles(self, k, done, state):
+        self.cycles[FLOW_WORK] += done
+        if done < k: self.cycles[state] += k - done
+        self.stalled = done < k and state == FLOW_BLOCKED
 
     def get_neighbor_coords(self):
-        nx, ny = self.x, self.y
-        if self.facing == "UP": ny -= 1
-        elif self.facing == "DOWN": ny += 1
-        elif self.facing == "LEFT": nx -= 1
-        elif self.facing == "RIGHT": nx += 1
-        return nx, ny
+        return self.target
 
     def render(self, surface, cam):
-        r = self.rect.move(-cam[0], -cam[1])
-        
-        if self.type == "furnace":
-            pygame.draw.rect(surface, (60, 60, 70), r)
-            pygame.draw.rect(surface, (20, 20, 20), r.inflate(-8, -8))
-            if self.inventory.items: 
-                 pygame.draw.rect(surface, (255, 100, 0), r.inflate(-12, -12))
-        
-        elif self.type == "assembler":
-            pygame.draw.rect(surface, BLUE, r)
-            pygame.draw.rect(surface, WHITE, r.inflate(-10,-10), 2)
+        self.paint(surface, self.rect.move(-cam[0], -cam[1]), self.facing, bool(self.inventory.items), self.stalled)
 
-        elif self.type == "drill":
-            pygame.draw.rect(surface, DRILL_ORANGE, r)
-            self.draw_arrow(surface, r)
+    # Drawing only needs facing and two flags, so a renderer that has no
+    # Building objects (the split simulation's snapshot) can use it too
+    @classmethod
+    def paint(cls, surface, r, facing, holding, stalled):
+        cls.draw(surface, r, facing, holding)
+        if stalled:
+            pygame.draw.rect(surface, RED, (r.right - 8, r.top + 2, 6, 6))
 
-        elif self.type == "conveyor":
-            pygame.draw.rect(surface, CONVEYOR_GRAY, r)
-            self.draw_arrow(surface, r, color=(200, 200, 200))
-            if self.inventory.items:
-                pygame.draw.circle(surface, BLUE, r.center, 6)
-        
-        elif self.type == "totem":
-            pygame.draw.rect(surface, (50, 200, 50), r)
-            pygame.draw.circle(surface, GOLD, r.center, 8)
+    @classmethod
+    def draw(cls, surface, r, facing, holding):
+        pygame.draw.rect(surface, cls.map_color, r)
 
-    def draw_arrow(self, surf, rect, color=BLACK):
+    @staticmethod
+    def draw_arrow(surf, rect, facing, color=BLACK):
         cx, cy = rect.center
         off = 8
-        if self.facing == "UP":
+        if facing == "UP":
             pygame.draw.line(surf, color, (cx, cy+off), (cx, cy-off), 3)
-        elif self.facing == "DOWN":
+        elif facing == "DOWN":
             pygame.draw.line(surf, color, (cx, cy-off), (cx, cy+off), 3)
-        elif self.facing == "LEFT":
+        elif facing == "LEFT":
             pygame.draw.line(surf, color, (cx+off, cy), (cx-off, cy), 3)
-        elif self.facing == "RIGHT":
+        elif facing == "RIGHT":
             pygame.draw.line(surf, color, (cx-off, cy), (cx+off, cy), 3)
 
+FACING_STEPS = {"UP": (0, -1), "DOWN": (0, 1), "LEFT": (-1, 0), "RIGHT": (1, 0)}
+
+class Drill(Building):
+    period, unlock, placed_by = 100, "automation", 1
+    limits = {"*": 10}
+    map_color = DRILL_ORANGE
+
+    def run_cycles(self, world, k):
+        res = DRILL_YIELDS.get(world.get_tile_type(self.x, self.y))
+        if res is None:
+            self.end_cycles(k, 0, FLOW_IDLE); return
+        target = world.get_building(*self.target)
+        dest = target or self
+        n = min(k, max(0, dest.room(res)))
+        if n:
+            dest.inventory.add(res, n)
+            if target: self.sent += n
+            if world.stats: world.stats.produce(res, n)
+        self.end_cycles(k, n, FLOW_BLOCKED)
+
+    @classmethod
+    def draw(cls, surface, r, facing, holding):
+        pygame.draw.rect(surface, DRILL_ORANGE, r)
+        cls.draw_arrow(surface, r, facing)
+
+class Conveyor(Building):
+    period, unlock, placed_by = 30, "automation", 1
+    limits = {"*": 4}
+    map_color = CONVEYOR_GRAY
+
+    def run_cycles(self, world, k):
+        if not self.inventory.items:
+            self.end_cycles(k, 0, FLOW_STARVED); return
+        target = world.get_building(*self.target)
+        done = 0
+        if target:
+            for item, amt in list(self.inventory.items.items()):
+                n = min(k - done, amt, max(0, target.room(item)))
+                if n:
+                    self.inventory.remove(item, n)
+                    target.inventory.add(item, n)
+                    done += n
+                    if done == k: break
+            self.sent += done
+        self.end_cycles(k, done, FLOW_BLOCKED)
+
+    @classmethod
+    def draw(cls, surface, r, facing, holding):
+        pygame.draw.rect(surface, CONVEYOR_GRAY, r)
+        cls.draw_arrow(surface, r, facing, color=(200, 200, 200))
+        if holding:
+            pygame.draw.circle(surface, BLUE, r.center, 6)
+
+class Converter(Building):
+    # Runs compiled recipes: the selected one, or else the first one it
+    # has inputs for
+    def run_cycles(self, world, k):
+        items, inv, stats = self.inventory.items, self.inventory, world.stats
+        done, state = 0, FLOW_STARVED
+        for name, inputs, outputs in self.active:
+            n = k - done
+            for item, amt in inputs: n = min(n, items.get(item, 0) // amt)
+            if n == 0: continue
+            for item, amt in outputs: n = min(n, self.room(item) // amt)
+            if n == 0:
+                state = FLOW_BLOCKED
+                continue
+            for item, amt in inputs:
+                inv.remove(item, amt * n)
+                if stats: stats.consume(item, amt * n)
+            for item, amt in outputs:
+                inv.add(item, amt * n)
+                if stats: stats.produce(item, amt * n)
+            done += n
+            if done == k: break
+        self.end_cycles(k, done, state)
+
+class Furnace(Converter):
+    period, unlock, placed_by = 150, "smelting", 1
+    limits = {"*": 10, "iron_ingot": 20, "copper_ingot": 20, "gold_ingot": 20}
+    recipes = compile_recipes(SMELTING)
+    map_color = (255, 100, 0)
+
+    @classmethod
+    def draw(cls, surface, r, facing, holding):
+        pygame.draw.rect(surface, (60, 60, 70), r)
+        pygame.draw.rect(surface, (20, 20, 20), r.inflate(-8, -8))
+        if holding:
+             pygame.draw.rect(surface, (255, 100, 0), r.inflate(-12, -12))
+
+class Assembler(Converter):
+    period, unlock, placed_by = 200, "advanced", 1
+    limits = {"*": 10, "gear": 40}
+    recipes = compile_recipes({k: v for k, v in RECIPES.items() if v["type"] == "item"})
+    default_recipe = "gear"
+    map_color = BLUE
+
+    @classmethod
+    def draw(cls, surface, r, facing, holding):
+        pygame.draw.rect(surface, BLUE, r)
+        pygame.draw.rect(surface, WHITE, r.inflate(-10,-10), 2)
+
+class Totem(Building):
+    period, unlock, placed_by = 60, "druidry", 2
+    limits = {"*": 0}
+    map_color = (50, 200, 50)
+    boostable = False
+
+    def run_cycles(self, world, k):
+        for dy in range(-2, 3):
+            for dx in range(-2, 3):
+                b = world.get_building(self.x + dx, self.y + dy)
+                if b and b.boostable:
+                    b.timer += 20 * k
+
+    @classmethod
+    def draw(cls, surface, r, facing, holding):
+        pygame.draw.rect(surface, (50, 200, 50), r)
+        pygame.draw.circle(surface, GOLD, r.center, 8)
+
+BUILDING_TYPES = {"drill": Drill, "conveyor": Conveyor, "furnace": Furnace, "assembler": Assembler, "totem": Totem}
+
+class BuildingSprites:
+    # Building looks use fixed pixel offsets, so for a scaled framebuffer
+    # each (type, facing, flags) combination is painted once at full size
+    # and shrunk rather than redrawn every frame
+    def __init__(self):
+        self.cache = {}
+
+    def paint(self, surface, cls, r, facing, holding, stalled):
+        if r.w == TILE_SIZE:
+            cls.paint(surface, r, facing, holding, stalled)
+            return
+        key = (cls, facing, bool(holding), bool(stalled), r.w)
+        sprite = self.cache.get(key)
+        if sprite is None:
+            full = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
+            cls.paint(full, full.get_rect(), facing, holding, stalled)
+            sprite = self.cache[key] = pygame.transform.smoothscale(full, r.size)
+        surface.blit(sprite, r)
+
+# --- BLUEPRINTS ---
+# A blueprint is a list of (dx, dy, type, facing) relative to the top-left
+# of the captured rectangle. Totems cost essence rather than items and are
+# left out.
+
+class Blueprint:
+    def __init__(self, width, height, entries):
+        self.width, self.height = width, height
+        self.entries = entries
+
+    @classmethod
+    def capture(cls, world, x0, y0, x1, y1):
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        entries = sorted((b.x - x0, b.y - y0, b.type, b.facing)
+                         for b in world.buildings_in_rect(x0, y0, x1, y1) if b.placed_by == 1)
+        return cls(x1 - x0 + 1, y1 - y0 + 1, entries)
+
+    def cost(self):
+        out = {}
+        for _, _, t, _ in self.entries: out[t] = out.get(t, 0) + 1
+        return out
+
+    def check(self, world, x, y):
+        # -> None if the footprint at (x, y) is buildable, else a reason.
+        # Rows of the type array are scanned with bytes membership and only
+        # rows that contain water are looked at tile by tile.
+        if x < 0 or y < 0 or x + self.width > world.width or y + self.height > world.height:
+            return "Out of bounds"
+        cells = {(x + dx, y + dy) for dx, dy, _, _ in self.entries}
+        if not cells.isdisjoint(world.buildings): return "Area occupied"
+        types, w, water = world.types, world.width, TileType.WATER.value
+        rows = {}
+        for cx, cy in cells: rows.setdefault(cy, []).append(cx)
+        for cy, xs in rows.items():
+            row = types[cy * w + x:cy * w + x + self.width]
+            if water in row and any(types[cy * w + cx] == water for cx in xs):
+                return "Blocked by water"
+        return None
+
+    def buildings(self, x, y):
+        return [Building(x + dx, y + dy, t, f) for dx, dy, t, f in self.entries]
+
+# --- HAULER DRONES ---
+# Haulers fly items from one building to another, steering by flow
+# fields: the BFS distance from every tile to one goal over a shared
+# passability grid (no water, no buildings). A field is computed once per
+# goal and shared by every drone heading there. When a tile changes, each
+# cached field is repaired around that tile only: a newly open tile
+# relaxes distances outward from itself, a newly blocked one clears the
+# tiles whose shortest path ran through it and refills them from their
+# intact neighbours.
+
+UNREACHED = 0xFFFF
+PATH_CACHE_MAX = 256
+
+class FlowField:
+    def __init__(self, grid, goal):
+        self.grid = grid
+        self.goal = goal[1] * grid.width + goal[0]
+        dist = self.dist = array("H", [UNREACHED]) * (grid.width * grid.height)
+        dist[self.goal] = 0
+        frontier = deque([self.goal])
+        # Neighbours inline from the index: up, down, left, right, with -1
+        # for the ones off the map
+        passable, w, n = grid.passable, grid.width, len(dist)
+        while frontier:
+            i = frontier.popleft()
+            d = dist[i] + 1
+            x = i % w
+            for j in (i - w, i + w if i + w < n else -1, i - 1 if x else -1, i + 1 if x < w - 1 else -1):
+                if j >= 0 and passable[j] and dist[j] == UNREACHED:
+                    dist[j] = d
+                    frontier.append(j)
+
+    def relax(self, seeds):
+        dist, passable, nbrs = self.dist, self.grid.passable, self.grid.neighbors
+        heap = list(seeds)
+        heapq.heapify(heap)
+        while heap:
+            d, i = heapq.heappop(heap)
+            if d >= dist[i]: continue
+            dist[i] = d
+            for j in nbrs(i):
+                if passable[j] and d + 1 < dist[j]: heapq.heappush(heap, (d + 1, j))
+
+    def opened(self, i):
+        best = min((self.dist[j] for j in self.grid.neighbors(i)), default=UNREACHED)
+        if best < UNREACHED and best + 1 < self.dist[i]: self.relax([(best + 1, i)])
+
+    def closed(self, i):
+        dist, nbrs = self.dist, self.grid.neighbors
+        old = dist[i]
+        if old == UNREACHED or i == self.goal: return
+        dist[i] = UNREACHED
+        # Tiles are visited in distance order, so a tile's possible
+        # parents have all been settled by the time it is checked
+        orphans, frontier = [], deque(j for j in nbrs(i) if dist[j] == old + 1)
+        while frontier:
+            u = frontier.popleft()
+            du = dist[u]
+            if du == UNREACHED or any(dist[v] == du - 1 for v in nbrs(u)): continue
+            dist[u] = UNREACHED
+            orphans.append(u)
+            frontier.extend(v for v in nbrs(u) if dist[v] == du + 1)
+        seeds = []
+        for u in orphans:
+            best = min(dist[v] for v in nbrs(u))
+            if best < UNREACHED: seeds.append((best + 1, u))
+        self.relax(seeds)
+
+    def next_step(self, x, y):
+        # Neighbouring tile one step closer to the goal, or None
+        w, dist = self.grid.width, self.dist
+        here = y * w + x
+        best, step = dist[here], None
+        for j in self.grid.neighbors(here):
+            if dist[j] < best: best, step = dist[j], j
+        return None if step is None else (step % w, step // w)
+
+class PathCache:
+    # Passability grid plus flow fields by goal, least recently used last
+    def __init__(self, world):
+        self.world = world
+        self.width, self.height = world.width, world.height
+        water = TileType.WATER.value
+        self.passable = bytearray(t != water for t in world.types)
+        for x, y in world.buildings: self.passable[y * self.width + x] = 0
+        self.fields = {}
+        self.builds = self.repairs = 0
+        world.tile_listeners.append(self.on_tile)
+        world.building_listeners.append(self.on_building)
+
+    def neighbors(self, i):
+        # Up, down, left, right of tile i, from the index alone; a table
+        # of these would cost a tuple per tile of the map
+        w, x = self.width, i % self.width
+        if 0 < x < w - 1 and w <= i < len(self.passable) - w: return (i - w, i + w, i - 1, i + 1)
+        return tuple(j for j, ok in ((i - w, i >= w), (i + w, i + w < len(self.passable)), (i - 1, x > 0), (i + 1, x < w - 1)) if ok)
+
+    def field(self, goal):
+        f = self.fields.pop(goal, None)
+        if f is None:
+            f = FlowField(self, goal)
+            self.builds += 1
+            if len(self.fields) >= PATH_CACHE_MAX: del self.fields[next(iter(self.fields))]
+        self.fields[goal] = f
+        return f
+
+    def refresh(self, x, y):
+        i = y * self.width + x
+        now = self.world.types[i] != TileType.WATER.value and (x, y) not in self.world.buildings
+        if now == self.passable[i]: return
+        self.passable[i] = now
+        self.repairs += len(self.fields)
+        for f in self.fields.values():
+            if now: f.opened(i)
+            else: f.closed(i)
+
+    def on_tile(self, x, y):
+        self.refresh(x, y)
+
+    def on_building(self, event, b):
+        if event != "recipe": self.refresh(b.x, b.y)
+
+class Hauler:
+    period = 6         # ticks per tile flown
+    capacity = 10
+
+    def __init__(self, h_id, x, y, source, dest):
+        self.id = h_id
+        self.x, self.y = x, y
+        self.prev = (x, y)
+        self.source, self.dest = source, dest
+        self.inventory = Inventory(("h", h_id))
+        self.timer = 0
+
+    def update(self, world):
+        self.timer += 1
+        if self.timer >= self.period:
+            self.timer = 0
+            self.step(world)
+
+    def advance(self, world, ticks):
+        total = self.timer + ticks
+        k = total // self.period
+        self.timer = total - k * self.period
+        for _ in range(k): self.step(world)
+
+    def step(self, world):
+        # Loaded haulers head for the destination, empty ones for the source
+        goal = self.dest if self.inventory.items else self.source
+        b = world.get_building(*goal)
+        self.prev = (self.x, self.y)
+        if b is None: return
+        if abs(self.x - goal[0]) + abs(self.y - goal[1]) <= 1:
+            if self.inventory.items:
+                for item, amt in list(self.inventory.items.items()):
+                    n = min(amt, max(0, b.room(item)))
+                    if n:
+                        self.inventory.remove(item, n)
+                        b.inventory.add(item, n)
+            else:
+                room = self.capacity
+                for item, amt in b.offers():
+                    n = min(amt, room)
+                    b.inventory.remove(item, n)
+                    self.inventory.add(item, n)
+                    room -= n
+                    if not room: break
+            return
+        nxt = world.flow_field(goal).next_step(self.x, self.y)
+        if nxt: world.move_hauler(self, *nxt)
+
+    def screen_pos(self, cam, ts=TILE_SIZE):
+        # Eased between the last two tiles so flight looks continuous
+        f = self.timer / self.period
+        px = (self.prev[0] + (self.x - self.prev[0]) * f + 0.5) * ts
+        py = (self.prev[1] + (self.y - self.prev[1]) * f + 0.5) * ts
+        return int(px) - cam[0], int(py) - cam[1]
+
+    @staticmethod
+    def paint(surface, pos, loaded, ts=TILE_SIZE):
+        x, y = pos
+        a = 7 * ts // TILE_SIZE
+        pygame.draw.polygon(surface, (240, 230, 120), [(x, y - a), (x + a, y), (x, y + a), (x - a, y)])
+        pygame.draw.polygon(surface, BLACK, [(x, y - a), (x + a, y), (x, y + a), (x - a, y)], 1)
+        if loaded: pygame.draw.circle(surface, BLUE, (x, y), max(1, 3 * ts // TILE_SIZE))
+
+def hauler_record(h):
+    return (h.id, h.x, h.y, h.source, h.dest, h.timer, dict(h.inventory.items))
+
+def hauler_from_record(rec):
+    h = Hauler(rec[0], rec[1], rec[2], tuple(rec[3]), tuple(rec[4]))
+    h.timer = rec[5]
+    h.inventory.items = dict(rec[6])
+    return h
+
+# ==========================================
+# MAP VIEW
+# ==========================================
+
+MINIMAP_OVERRIDES = {
+    TileType.ORE_IRON: (150, 100, 100), TileType.ORE_COPPER: (200, 120, 60),
+    TileType.ORE_GOLD: GOLD, TileType.ORE_COAL: (20, 20, 20), TileType.TREE: TREE_GREEN,
+}
+# Decorated tiles as one flat rect, for when the quality governor drops decorations
+FLAT_TILE_COLORS = {**MINIMAP_OVERRIDES, TileType.ESSENCE: (250, 240, 160)}
+
+def minimap_color(world, x, y):
+    return MINIMAP_OVERRIDES.get(world.get_tile_type(x, y)) or world.get_color(x, y)
+
+def minimap_rgb(world):
+    # Start from the base colors and only visit the overridden tiles
+    rgb = bytearray(world.colors)
+    types = bytes(world.types)
+    for t, col in MINIMAP_OVERRIDES.items():
+        needle, c = bytes([t.value]), bytes(col)
+        i = types.find(needle)
+        while i != -1:
+            rgb[i*3:i*3+3] = c
+            i = types.find(needle, i + 1)
+    return rgb
+
+def build_minimap(world):
+    return pygame.image.frombytes(bytes(minimap_rgb(world)), (world.width, world.height), "RGB")
+
+class MapView:
+    # levels[k] holds the world image at 1 / 2**k pixels per tile. Tile
+    # changes only touch one pixel per level, patched lazily on draw.
+    MIN_ZOOM = 1 / 64
+    MAX_ZOOM = 16.0
+
+    def __init__(self, base):
+        self.levels = [base]
+        while max(self.levels[-1].get_size()) > 64:
+            w, h = self.levels[-1].get_size()
+            self.levels.append(pygame.transform.smoothscale(self.levels[-1], (max(1, w // 2), max(1, h // 2))))
+        self.dirty = set()
+        self.zoom = 1.0
+        self.center = [base.get_width() / 2, base.get_height() / 2]
+
+    def set_pixel(self, x, y, color):
+        self.levels[0].set_at((x, y), color)
+        self.dirty.add((x, y))
+
+    def patch(self):
+        if not self.dirty: return
+        cur = self.dirty
+        for k in range(1, len(self.levels)):
+            src, dst = self.levels[k-1], self.levels[k]
+            sw, sh = src.get_size()
+            dw, dh = dst.get_size()
+            nxt = set()
+            for x, y in cur:
+                px, py = x // 2, y // 2
+                if px >= dw or py >= dh or (px, py) in nxt: continue
+                nxt.add((px, py))
+                r = g = b = n = 0
+                for yy in (py*2, py*2 + 1):
+                    for xx in (px*2, px*2 + 1):
+                        if xx < sw and yy < sh:
+                            c = src.get_at((xx, yy))
+                            r += c[0]; g += c[1]; b += c[2]; n += 1
+                dst.set_at((px, py), (r // n, g // n, b // n))
+            cur = nxt
+        self.dirty.clear()
+
+    def fit(self, view_w, view_h):
+        w, h = self.levels[0].get_size()
+        self.zoom = min(view_w / w, view_h / h)
+        self.center = [w / 2, h / 2]
+
+    def zoom_by(self, factor):
+        self.zoom = max(self.MIN_ZOOM, min(self.MAX_ZOOM, self.zoom * factor))
+
+    def pan(self, dx, dy):
+        # dx/dy in screen pixels
+        w, h = self.levels[0].get_size()
+        self.center[0] = max(0, min(w, self.center[0] + dx / self.zoom))
+        self.center[1] = max(0, min(h, self.center[1] + dy / self.zoom))
+
+    def world_to_screen(self, tx, ty, view_w, view_h):
+        return (int((tx - self.center[0]) * self.zoom + view_w / 2),
+                int((ty - self.center[1]) * self.zoom + view_h / 2))
+
+    def draw(self, surface, world):
+        self.patch()
+        vw, vh = surface.get_size()
+        k = 0
+        while k + 1 < len(self.levels) and self.zoom * (2 ** (k + 1)) <= 1.0:
+            k += 1
+        level = self.levels[k]
+        lw, lh = level.get_size()
+        # level pixels per tile (may be slightly off 1/2**k for odd sizes)
+        sx = lw / self.levels[0].get_width()
+        sy = lh / self.levels[0].get_height()
+
+        x0 = self.center[0] - vw / 2 / self.zoom
+        y0 = self.center[1] - vh / 2 / self.zoom
+        x1 = self.center[0] + vw / 2 / self.zoom
+        y1 = self.center[1] + vh / 2 / self.zoom
+        lx0 = max(0, int(x0 * sx)); ly0 = max(0, int(y0 * sy))
+        lx1 = min(lw, int(math.ceil(x1 * sx))); ly1 = min(lh, int(math.ceil(y1 * sy)))
+        if lx1 > lx0 and ly1 > ly0:
+            window = level.subsurface((lx0, ly0, lx1 - lx0, ly1 - ly0))
+            ox, oy = self.world_to_screen(lx0 / sx, ly0 / sy, vw, vh)
+            ex, ey = self.world_to_screen(lx1 / sx, ly1 / sy, vw, vh)
+            surface.blit(pygame.transform.scale(window, (max(1, ex - ox), max(1, ey - oy))), (ox, oy))
+
+        self.draw_markers(surface, world, int(x0), int(y0), int(x1), int(y1))
+
+    def draw_markers(self, surface, world, x0, y0, x1, y1):
+        vw, vh = surface.get_size()
+        chunk_px = CHUNK_SIZE * self.zoom
+        if chunk_px < 12:
+            # Zoomed far out: one marker per occupied chunk
+            for (cx, cy), locs in world.building_chunks.items():
+                if not (x0 // CHUNK_SIZE <= cx <= x1 // CHUNK_SIZE and y0 // CHUNK_SIZE <= cy <= y1 // CHUNK_SIZE): continue
+                p = self.world_to_screen((cx + 0.5) * CHUNK_SIZE, (cy + 0.5) * CHUNK_SIZE, vw, vh)
+                pygame.draw.circle(surface, WHITE, p, 2 + min(4, len(locs) // 8))
+            return
+        size = max(2, int(self.zoom))
+        for b in world.buildings_in_rect(x0, y0, x1, y1):
+            px, py = self.world_to_screen(b.x, b.y, vw, vh)
+            pygame.draw.rect(surface, b.map_color, (px, py, size, size))
+
+# ==========================================
+# SAVE / LOAD
+# ==========================================
+# Layout: header, section table, then sections. Tile sections are raw
+# arrays so a load maps them straight from the file; everything else is
+# a fixed-size struct table that struct.iter_unpack walks in one go.
+#   STRS  length-prefixed utf-8 strings (item, building and unlock names)
+#   TTYP  one byte per tile (TileType value)
+#   TCOL  three bytes per tile (RGB)
+#   BLDG  x, y, type, facing, timer, inventory start, inventory count
+#   PLYR  id, x, y, facing, hotbar index, inventory start, inventory count
+#   INVT  item string, count (rows referenced by BLDG and PLYR)
+#   UNLK  points, then unlock key string and unlocked flag per unlock
+#   RCPE  x, y, recipe string for machines not on their default recipe
+#         (optional; older saves have none)
+#   HAUL  id, x, y, source x/y, destination x/y, timer, inventory start,
+#         inventory count (optional; older saves have none)
+
+SAVE_MAGIC = b"FSAV"
+SAVE_VERSION = 1
+SAVE_DIR = "saves"
+FACINGS = ("UP", "DOWN", "LEFT", "RIGHT")
+SAVE_HEADER = struct.Struct("<4sHHIIiI")
+SAVE_SECTION = struct.Struct("<4sQQ")
+SAVE_BLDG = struct.Struct("<iiHBiII")
+SAVE_PLYR = struct.Struct("<BiiBIII")
+SAVE_INVT = struct.Struct("<HI")
+SAVE_UNLK = struct.Struct("<HB")
+SAVE_RCPE = struct.Struct("<iiH")
+SAVE_HAUL = struct.Struct("<IiiiiiiiII")
+
+class SaveError(Exception):
+    pass
+
+def write_save(path, world, players, unlocks):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        for chunk in pack_save(world, players, unlocks):
+            fh.write(chunk)
+    os.replace(tmp, path)
+
+def pack_save(world, players, unlocks):
+    # Returns the file contents as a list of buffers (tile arrays unchanged)
+    strings, index = [], {}
+    def sid(name):
+        if name not in index:
+            index[name] = len(strings)
+            strings.append(name)
+        return index[name]
+
+    invt = bytearray()
+    inv_rows = [0]
+    def pack_inventory(inv):
+        start = inv_rows[0]
+        for item, amt in inv.items.items():
+            invt.extend(SAVE_INVT.pack(sid(item), amt))
+        inv_rows[0] += len(inv.items)
+        return start, len(inv.items)
+
+    bldg, rcpe = bytearray(), bytearray()
+    for b in world.buildings.values():
+        start, count = pack_inventory(b.inventory)
+        bldg.extend(SAVE_BLDG.pack(b.x, b.y, sid(b.type), FACINGS.index(b.facing), b.timer, start, count))
+        if b.recipe != b.default_recipe:
+            rcpe.extend(SAVE_RCPE.pack(b.x, b.y, sid(b.recipe)))
+
+    haul = bytearray()
+    for h in world.haulers.values():
+        start, count = pack_inventory(h.inventory)
+        haul.extend(SAVE_HAUL.pack(h.id, h.x, h.y, *h.source, *h.dest, h.timer, start, count))
+
+    plyr = bytearray()
+    for p in players:
+        start, count = pack_inventory(p.inventory)
+        plyr.extend(SAVE_PLYR.pack(p.id, p.rect.x, p.rect.y, FACINGS.index(p.facing), p.hotbar_index, start, count))
+
+    unlk = bytearray(struct.pack("<i", unlocks.points))
+    for key, data in unlocks.unlocks.items():
+        unlk.extend(SAVE_UNLK.pack(sid(key), data["unlocked"]))
+
+    strs = bytearray()
+    for name in strings:
+        raw = name.encode("utf-8")
+        strs.extend(struct.pack("<H", len(raw)) + raw)
+
+    sections = [(b"STRS", strs), (b"TTYP", world.types), (b"TCOL", world.colors),
+                (b"BLDG", bldg), (b"PLYR", plyr), (b"INVT", invt), (b"UNLK", unlk), (b"RCPE", rcpe), (b"HAUL", haul)]
+    offset = SAVE_HEADER.size + SAVE_SECTION.size * len(sections)
+    table = bytearray()
+    for tag, data in sections:
+        table.extend(SAVE_SECTION.pack(tag, offset, len(data)))
+        offset += len(data)
+
+    header = SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, 0, world.width, world.height, world.seed, len(sections))
+    return [header, table] + [data for _, data in sections]
+
+def read_save(path):
+    # Returns (world, players, unlocks); players is a list ordered by id
+    with open(path, "rb") as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_COPY)
+    return parse_save(mm)
+
+def parse_save(mm):
+    # mm is any buffer; tile arrays are views into it, not copies
+    if len(mm) < SAVE_HEADER.size:
+        raise SaveError("Truncated save file")
+    magic, version, _, width, height, seed, n_sections = SAVE_HEADER.unpack_from(mm)
+    if magic != SAVE_MAGIC:
+        raise SaveError("Not a save file")
+    if version != SAVE_VERSION:
+        raise SaveError(f"Unsupported save version {version}")
+    view = memoryview(mm)
+    sections = {}
+    for i in range(n_sections):
+        tag, off, length = SAVE_SECTION.unpack_from(mm, SAVE_HEADER.size + i * SAVE_SECTION.size)
+        if off + length > len(mm):
+            raise SaveError(f"Section {tag!r} runs past end of file")
+        sections[tag] = view[off:off + length]
+    for tag in (b"STRS", b"TTYP", b"TCOL", b"BLDG", b"PLYR", b"INVT", b"UNLK"):
+        if tag not in sections:
+            raise SaveError(f"Missing section {tag.decode()}")
+
+    strings = []
+    strs, pos = sections[b"STRS"], 0
+    while pos < len(strs):
+        n = struct.unpack_from("<H", strs, pos)[0]
+        strings.append(bytes(strs[pos + 2:pos + 2 + n]).decode("utf-8"))
+        pos += 2 + n
+
+    if len(sections[b"TTYP"]) != width * height or len(sections[b"TCOL"]) != width * height * 3:
+        raise SaveError("Tile sections do not match world size")
+    world = World(seed, width, height, tiles=(sections[b"TTYP"], sections[b"TCOL"]))
+
+    invt = list(SAVE_INVT.iter_unpack(sections[b"INVT"]))
+    def fill(inv, start, count):
+        for item, amt in invt[start:start + count]:
+            inv.items[strings[item]] = amt
+
+    for x, y, b_type, facing, timer, start, count in SAVE_BLDG.iter_unpack(sections[b"BLDG"]):
+        b = Building(x, y, strings[b_type], FACINGS[facing])
+        b.timer = timer
+        fill(b.inventory, start, count)
+        world.add_building(b)
+    for x, y, name in SAVE_RCPE.iter_unpack(sections.get(b"RCPE", b"")):
+        b = world.get_building(x, y)
+        if b and b.default_recipe and strings[name] in {r[0] for r in b.recipes}:
+            b.select_recipe(strings[name])
+    for h_id, x, y, sx, sy, dx, dy, timer, start, count in SAVE_HAUL.iter_unpack(sections.get(b"HAUL", b"")):
+        h = Hauler(h_id, x, y, (sx, sy), (dx, dy))
+        h.timer = timer
+        fill(h.inventory, start, count)
+        world.add_hauler(h)
+
+    players = []
+    colors = {1: BLUE, 2: GREEN}
+    for p_id, x, y, facing, hotbar, start, count in SAVE_PLYR.iter_unpack(sections[b"PLYR"]):
+        p = Player(p_id, 0, 0, colors.get(p_id, WHITE))
+        p.rect.topleft = (x, y)
+        p.facing = FACINGS[facing]
+        p.hotbar_index = hotbar
+        fill(p.inventory, start, count)
+        players.append(p)
+    players.sort(key=lambda p: p.id)
+
+    unlocks = UnlockManager()
+    unlk = sections[b"UNLK"]
+    unlocks.points = struct.unpack_from("<i", unlk)[0]
+    for key, flag in SAVE_UNLK.iter_unpack(unlk[4:]):
+        if strings[key] in unlocks.unlocks:
+            unlocks.unlocks[strings[key]]["unlocked"] = bool(flag)
+    return world, players, unlocks
+
+# --- AUTOSAVE JOURNAL ---
+# Mutations are queued as tuples by the frame loop and encoded, written
+# and applied to a private shadow copy of the game by a writer thread.
+# The shadow is periodically written out as a full snapshot, which
+# starts the next journal generation:
+#   <name>.<gen>.fsav     snapshot the journal of the same gen applies to
+#   <name>.<gen>.journal  header, then [length, crc32, records] batches
+# Recovery loads the newest snapshot and replays its journal up to the
+# first torn batch.
+
+JOURNAL_MAGIC = b"FJNL"
+J_TILE, J_PLACE, J_REMOVE, J_INV_B, J_INV_P, J_UNLOCK, J_POINTS, J_POS, J_RECIPE, J_HAULER, J_RECALL, J_INV_H, J_HOTBAR = range(1, 14)
+J_HAULER_REC = struct.Struct("<BIiiiiii")
+
+def _pack_str(s):
+    raw = s.encode("utf-8")
+    return bytes([len(raw)]) + raw
+
+def _unpack_str(buf, pos):
+    n = buf[pos]
+    return bytes(buf[pos + 1:pos + 1 + n]).decode("utf-8"), pos + 1 + n
+
+def encode_record(rec):
+    kind = rec[0]
+    if kind == "tile": return struct.pack("<BiiB", J_TILE, rec[1], rec[2], rec[3])
+    if kind == "place": return struct.pack("<BiiB", J_PLACE, rec[1], rec[2], FACINGS.index(rec[4])) + _pack_str(rec[3])
+    if kind == "remove": return struct.pack("<Bii", J_REMOVE, rec[1], rec[2])
+    if kind == "inv":
+        owner = rec[1]
+        if owner[0] == "b": return struct.pack("<Biii", J_INV_B, owner[1], owner[2], rec[3]) + _pack_str(rec[2])
+        if owner[0] == "h": return struct.pack("<BIi", J_INV_H, owner[1], rec[3]) + _pack_str(rec[2])
+        return struct.pack("<BBi", J_INV_P, owner[1], rec[3]) + _pack_str(rec[2])
+    if kind == "unlock": return bytes([J_UNLOCK]) + _pack_str(rec[1])
+    if kind == "points": return struct.pack("<Bi", J_POINTS, rec[1])
+    if kind == "pos": return struct.pack("<BBiiB", J_POS, rec[1], rec[2], rec[3], FACINGS.index(rec[4]))
+    if kind == "recipe": return struct.pack("<Bii", J_RECIPE, rec[1], rec[2]) + _pack_str(rec[3] or "")
+    if kind == "hauler": return J_HAULER_REC.pack(J_HAULER, *rec[1:])
+    if kind == "recall": return struct.pack("<BI", J_RECALL, rec[1])
+    if kind == "hotbar": return struct.pack("<BBi", J_HOTBAR, rec[1], rec[2])
+    raise ValueError(f"Unknown journal record {kind}")
+
+def decode_records(buf):
+    pos, out = 0, []
+    while pos < len(buf):
+        kind = buf[pos]
+        if kind == J_TILE:
+            _, x, y, t = struct.unpack_from("<BiiB", buf, pos); pos += 10
+            out.append(("tile", x, y, t))
+        elif kind == J_PLACE:
+            _, x, y, f = struct.unpack_from("<BiiB", buf, pos)
+            b_type, pos = _unpack_str(buf, pos + 10)
+            out.append(("place", x, y, b_type, FACINGS[f]))
+        elif kind == J_REMOVE:
+            _, x, y = struct.unpack_from("<Bii", buf, pos); pos += 9
+            out.append(("remove", x, y))
+        elif kind == J_INV_B:
+            _, x, y, d = struct.unpack_from("<Biii", buf, pos)
+            item, pos = _unpack_str(buf, pos + 13)
+            out.append(("inv", ("b", x, y), item, d))
+        elif kind == J_INV_P:
+            _, p_id, d = struct.unpack_from("<BBi", buf, pos)
+            item, pos = _unpack_str(buf, pos + 6)
+            out.append(("inv", ("p", p_id), item, d))
+        elif kind == J_UNLOCK:
+            key, pos = _unpack_str(buf, pos + 1)
+            out.append(("unlock", key))
+        elif kind == J_POINTS:
+            _, v = struct.unpack_from("<Bi", buf, pos); pos += 5
+            out.append(("points", v))
+        elif kind == J_POS:
+            _, p_id, x, y, f = struct.unpack_from("<BBiiB", buf, pos); pos += 11
+            out.append(("pos", p_id, x, y, FACINGS[f]))
+        elif kind == J_RECIPE:
+            _, x, y = struct.unpack_from("<Bii", buf, pos)
+            name, pos = _unpack_str(buf, pos + 9)
+            out.append(("recipe", x, y, name or None))
+        elif kind == J_HAULER:
+            out.append(("hauler",) + J_HAULER_REC.unpack_from(buf, pos)[1:]); pos += J_HAULER_REC.size
+        elif kind == J_RECALL:
+            _, h_id = struct.unpack_from("<BI", buf, pos); pos += 5
+            out.append(("recall", h_id))
+        elif kind == J_INV_H:
+            _, h_id, d = struct.unpack_from("<BIi", buf, pos)
+            item, pos = _unpack_str(buf, pos + 9)
+            out.append(("inv", ("h", h_id), item, d))
+        elif kind == J_HOTBAR:
+            _, p_id, i = struct.unpack_from("<BBi", buf, pos); pos += 6
+            out.append(("hotbar", p_id, i))
+        else:
+            raise SaveError(f"Bad journal record kind {kind}")
+    return out
+
+def apply_record(world, players, unlocks, rec):
+    # players maps id -> Player
+    kind = rec[0]
+    if kind == "tile":
+        world.set_tile_type(rec[1], rec[2], TILE_TYPES[rec[3]])
+    elif kind == "place":
+        world.add_building(Building(rec[1], rec[2], rec[3], rec[4]))
+    elif kind == "remove":
+        world.remove_building(rec[1], rec[2])
+    elif kind == "inv":
+        owner = rec[1]
+        if owner[0] == "b":
+            b = world.get_building(owner[1], owner[2])
+            inv = b.inventory if b else None
+        elif owner[0] == "h":
+            h = world.haulers.get(owner[1])
+            inv = h.inventory if h else None
+        else:
+            p = players.get(owner[1])
+            inv = p.inventory if p else None
+        if inv is None: return
+        amt = inv.items.get(rec[2], 0) + rec[3]
+        if amt > 0: inv.items[rec[2]] = amt
+        else: inv.items.pop(rec[2], None)
+    elif kind == "unlock":
+        if rec[1] in unlocks.unlocks: unlocks.unlocks[rec[1]]["unlocked"] = True
+    elif kind == "points":
+        unlocks.points = rec[1]
+    elif kind == "pos":
+        p = players.get(rec[1])
+        if p:
+            p.rect.topleft = (rec[2], rec[3])
+            p.facing = rec[4]
+    elif kind == "hotbar":
+        p = players.get(rec[1])
+        if p: p.hotbar_index = rec[2]
+    elif kind == "recipe":
+        b = world.get_building(rec[1], rec[2])
+        if b: world.set_recipe(b, rec[3])
+    elif kind == "hauler":
+        # Placement and every move carry the whole route
+        h = world.haulers.get(rec[1])
+        if h is None: world.add_hauler(Hauler(rec[1], rec[2], rec[3], (rec[4], rec[5]), (rec[6], rec[7])))
+        else:
+            world.move_hauler(h, rec[2], rec[3])
+            h.prev = (h.x, h.y)
+    elif kind == "recall":
+        world.remove_hauler(rec[1])
+
+def read_journal(path):
+    records = []
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except OSError:
+        return records
+    if data[:4] != JOURNAL_MAGIC: return records
+    pos = 8
+    while pos + 8 <= len(data):
+        length, crc = struct.unpack_from("<II", data, pos)
+        payload = data[pos + 8:pos + 8 + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break  # torn tail from a crash
+        records.extend(decode_records(payload))
+        pos += 8 + length
+    return records
+
+def _journal_gens(directory, name):
+    gens = []
+    try:
+        files = os.listdir(directory)
+    except OSError:
+        return gens
+    for f in files:
+        parts = f.split(".")
+        if len(parts) == 3 and parts[0] == name and parts[2] == "fsav" and parts[1].isdigit():
+            gens.append(int(parts[1]))
+    return sorted(gens)
+
+def recover_autosave(directory=SAVE_DIR, name="autosave"):
+    gens = _journal_gens(directory, name)
+    if not gens:
+        raise SaveError("No autosave found")
+    base = os.path.join(directory, f"{name}.{gens[-1]}")
+    world, players, unlocks = read_save(base + ".fsav")
+    by_id = {p.id: p for p in players}
+    for rec in read_journal(base + ".journal"):
+        apply_record(world, by_id, unlocks, rec)
+    return world, players, unlocks
+
+class MutationRecorder:
+    # Turns the World and Inventory change hooks into journal-style
+    # records and hands each one to record, the sink the subclass passes in.
+    def __init__(self, record):
+        self.record = record
+
+    def attach(self, world):
+        # Player inventories report through the world (see
+        # GameEngine.hook_players), so one inventory listener covers all
+        world.tile_listeners.append(self.on_tile(world))
+        world.building_listeners.append(self.on_building)
+        world.inventory_listeners.append(self.on_inventory)
+        world.hauler_listeners.append(self.on_hauler)
+
+    def on_tile(self, world):
+        def fn(x, y):
+            self.record(("tile", x, y, world.types[y * world.width + x]))
+        return fn
+
+    def on_building(self, event, b):
+        if event == "add":
+            self.record(("place", b.x, b.y, b.type, b.facing))
+            if b.recipe != b.default_recipe: self.record(("recipe", b.x, b.y, b.recipe))
+        elif event == "recipe": self.record(("recipe", b.x, b.y, b.recipe))
+        else: self.record(("remove", b.x, b.y))
+
+    def on_inventory(self, owner, item, delta):
+        self.record(("inv", owner, item, delta))
+
+    def on_hauler(self, event, h):
+        if event == "remove": self.record(("recall", h.id))
+        else: self.record(("hauler", h.id, h.x, h.y) + h.source + h.dest)
+
+class Journal(MutationRecorder):
+    def __init__(self, directory=SAVE_DIR, name="autosave", sync_interval=0.5, compact_interval=120.0):
+        self.directory = directory
+        self.name = name
+        self.sync_interval = sync_interval
+        self.compact_interval = compact_interval
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.error = None
+        super().__init__(self.queue.put)
+
+    def base_path(self, gen):
+        return os.path.join(self.directory, f"{self.name}.{gen}")
+
+    def start(self, world, players, unlocks):
+        # The base snapshot is the one synchronous write; it happens when
+        # a game is started or loaded, never mid-session.
+        gens = _journal_gens(self.directory, self.name)
+        self.gen = (gens[-1] + 1) if gens else 1
+        write_save(self.base_path(self.gen) + ".fsav", world, players, unlocks)
+        s_world, s_players, self.s_unlocks = read_save(self.base_path(self.gen) + ".fsav")
+        s_world.detach()
+        self.s_world, self.s_players = s_world, {p.id: p for p in s_players}
+        for g in gens: self._remove_gen(g)
+        self.fh = self._open_journal(self.gen)
+
+        self.attach(world)
+        self.thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _open_journal(self, gen):
+        fh = open(self.base_path(gen) + ".journal", "wb")
+        fh.write(JOURNAL_MAGIC + struct.pack("<I", gen))
+        return fh
+
+    def _remove_gen(self, gen):
+        for ext in (".fsav", ".journal"):
+            try: os.remove(self.base_path(gen) + ext)
+            except OSError: pass
+
+    def _run(self):
+        last_sync = last_compact = time.monotonic()
+        pending = False
+        running = True
+        while running:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.sync_interval))
+                while True: batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in batch:
+                running = False
+                batch = [r for r in batch if r is not None]
+            try:
+                if batch:
+                    payload = b"".join(encode_record(r) for r in batch)
+                    self.fh.write(struct.pack("<II", len(payload), zlib.crc32(payload)) + payload)
+                    for r in batch:
+                        apply_record(self.s_world, self.s_players, self.s_unlocks, r)
+                    pending = True
+                now = time.monotonic()
+                if pending and (now - last_sync >= self.sync_interval or not running):
+                    self.fh.flush()
+                    os.fsync(self.fh.fileno())
+                    last_sync = now
+                    pending = False
+                if now - last_compact >= self.compact_interval and running:
+                    self._compact()
+                    last_compact = now
+            except (OSError, ValueError) as e:
+                self.error = e
+        self.fh.close()
+
+    def _compact(self):
+        old = self.gen
+        self.gen += 1
+        players = [self.s_players[k] for k in sorted(self.s_players)]
+        write_save(self.base_path(self.gen) + ".fsav", self.s_world, players, self.s_unlocks)
+        self.fh.close()
+        self.fh = self._open_journal(self.gen)
+        self._remove_gen(old)
+
+# ==========================================
+# REPLAY
+# ==========================================
+# Session logs are JSON lines: a header with the start point, then
+# [tick, command, args...] entries. A command stamped T ran after T
+# simulation ticks; a "move" entry stamped T holds the movement of both
+# players for tick T+1. "hash" entries are state checkpoints.
+
+REPLAY_DIR = "replays"
+REPLAY_CHECKPOINT = 600
+
+class InputLog:
+    def __init__(self, path, start):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.fh = open(path, "w")
+        self.fh.write(json.dumps({"version": 1, "generator": GENERATOR_VERSION, **start}) + "\n")
+        self.last_tick = 0
+
+    def record(self, tick, cmd):
+        self.fh.write(json.dumps([tick, *cmd]) + "\n")
+
+    def checkpoint(self, tick, digest):
+        self.fh.write(json.dumps([tick, "hash", digest]) + "\n")
+        self.last_tick = tick
+        self.fh.flush()
+
+    def close(self, tick=None):
+        if self.fh:
+            if tick is not None: self.fh.write(json.dumps([tick, "end"]) + "\n")
+            self.fh.close()
+            self.fh = None
+
+def read_input_log(path):
+    with open(path) as fh:
+        header = json.loads(fh.readline())
+        entries = [json.loads(line) for line in fh if line.strip()]
+    return header, entries
+
+def run_replay(path, verify=True, cache_dir=WORLD_CACHE_DIR):
+    # Re-executes a session log headlessly as fast as possible.
+    # Returns (ticks, seconds, checkpoints passed, mismatches).
+    header, entries = read_input_log(path)
+    g = GameEngine(headless=True)
+    if header.get("save"):
+        if not g.load_game(header["save"]): raise SaveError(f"Cannot load {header['save']}")
+    else:
+        g.start_game(header["seed"], cache_dir=cache_dir)
+    passed, mismatches = 0, []
+    move = (0, 0, 0, 0)
+    t0 = time.perf_counter()
+    for tick, kind, *args in entries:
+        while g.tick_no < tick:
+            g.move_intent = move
+            move = (0, 0, 0, 0)
+            g.update()
+        if kind == "move":
+            move = tuple(args)
+        elif kind == "end":
+            break
+        elif kind == "hash":
+            if not verify: continue
+            digest = g.state_hash()
+            if digest == args[0]: passed += 1
+            else: mismatches.append((tick, args[0], digest))
+        else:
+            g.execute((kind, *args))
+    if any(move):
+        g.move_intent = move
+        g.update()
+    return g.tick_no, time.perf_counter() - t0, passed, mismatches
+
+# ==========================================
+# NETWORK
+# ==========================================
+# Frames are [type u8][length u32][payload]. The server owns the game
+# and runs the simulation; clients send commands and get per-tick
+# deltas in the autosave record encoding. A zlib-compressed save image
+# goes out on join, every NET_FULL_INTERVAL ticks, and to any client
+# that fell behind. A command the server refuses comes back as a NACK
+# carrying the command and the reason.
+
+NET_PORT = 7777
+NET_FULL_INTERVAL = 600
+NET_MAX_BACKLOG = 1 << 20
+NET_HELLO, NET_WELCOME, NET_FULL, NET_DELTA, NET_CMD, NET_NACK = range(1, 7)
+NET_FRAME = struct.Struct("<BI")
+P1_COMMANDS = {"p1_interact", "craft", "cycle_hotbar", "undo_placement", "capture_blueprint", "stamp_blueprint", "cycle_recipe",
+               "assign_hauler", "recall_haulers"}
+P2_COMMANDS = {"p2_interact", "p2_replant", "p2_build_totem", "try_unlock"}
+
+def net_frame(kind, payload):
+    return NET_FRAME.pack(kind, len(payload)) + payload
+
+class DeltaCollector(MutationRecorder):
+    def __init__(self):
+        self.records = []
+        super().__init__(self.records.append)
+
+    def flush(self):
+        # Last tile type wins; inventory deltas are summed between
+        # placements/removals so ordering against them is kept.
+        out, tiles, inv = [], {}, {}
+        def flush_inv():
+            for (owner, item), d in inv.items():
+                if d: out.append(("inv", owner, item, d))
+            inv.clear()
+        for rec in self.records:
+            kind = rec[0]
+            if kind == "tile": tiles[(rec[1], rec[2])] = rec[3]
+            elif kind == "inv": inv[(rec[1], rec[2])] = inv.get((rec[1], rec[2]), 0) + rec[3]
+            else:
+                if kind in ("place", "remove"): flush_inv()
+                out.append(rec)
+        flush_inv()
+        out.extend(("tile", x, y, t) for (x, y), t in tiles.items())
+        self.records.clear()
+        return out
+
+class NetServer:
+    def __init__(self, seed=None, host="127.0.0.1", port=NET_PORT, tick_rate=FPS, cache_dir=WORLD_CACHE_DIR, quiet=False):
+        self.host, self.port, self.tick_rate = host, port, tick_rate
+        self.quiet = quiet
+        self.engine = GameEngine(headless=True)
+        self.engine.start_game(seed, cache_dir=cache_dir)
+        self.collector = DeltaCollector()
+        self.collector.attach(self.engine.world)
+        self.player_state = None
+        self.clients = {}
+        self.commands = []
+        self.intents = {1: (0, 0), 2: (0, 0)}
+        self.tick_ms = deque(maxlen=600)
+
+    def log(self, msg):
+        if not self.quiet: print(f"[server] {msg}", flush=True)
+
+    def full_payload(self):
+        g = self.engine
+        image = b"".join(bytes(c) for c in pack_save(g.world, [g.p1, g.p2], g.unlocks))
+        return struct.pack("<I", g.tick_no) + zlib.compress(image, 1)
+
+    def send(self, writer, kind, payload):
+        data = net_frame(kind, payload)
+        writer.write(data)
+        self.clients[writer]["bytes_out"] += len(data)
+
+    async def handle(self, reader, writer):
+        try:
+            kind, payload = await self.read_frame(reader)
+            if kind != NET_HELLO: return
+            want = json.loads(payload).get("player", 0)
+            owned = {1, 2} if want not in (1, 2) else {want}
+            self.clients[writer] = {"owned": owned, "bytes_out": 0, "bytes_in": 0, "stale": False, "peer": writer.get_extra_info("peername")}
+            self.send(writer, NET_WELCOME, json.dumps({"players": sorted(owned), "seed": self.engine.world.seed}).encode())
+            self.send(writer, NET_FULL, self.full_payload())
+            while True:
+                kind, payload = await self.read_frame(reader)
+                self.clients[writer]["bytes_in"] += NET_FRAME.size + len(payload)
+                if kind == NET_CMD:
+                    self.commands.append((writer, owned, json.loads(payload)[1:]))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            info = self.clients.pop(writer, None)
+            if info:
+                for pid in info["owned"]: self.intents[pid] = (0, 0)
+            writer.close()
+
+    async def read_frame(self, reader):
+        kind, length = NET_FRAME.unpack(await reader.readexactly(NET_FRAME.size))
+        return kind, await reader.readexactly(length)
+
+    def apply(self, writer, owned, cmd):
+        try:
+            if cmd[0] == "move":
+                if cmd[1] not in owned: raise ValueError(f"player {cmd[1]} is not yours")
+                self.intents[cmd[1]] = (int(cmd[2]), int(cmd[3]))
+            elif (cmd[0] in P1_COMMANDS and 1 in owned) or (cmd[0] in P2_COMMANDS and 2 in owned):
+                self.engine.execute(tuple(cmd))
+            else:
+                raise ValueError("not allowed for your player" if cmd[0] in P1_COMMANDS | P2_COMMANDS else "unknown command")
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            self.reject(writer, cmd, e)
+
+    def reject(self, writer, cmd, err):
+        info = self.clients.get(writer)
+        self.log(f"rejected {cmd!r} from {info['peer'] if info else 'closed client'}: {err!r}")
+        if info: self.send(writer, NET_NACK, json.dumps([cmd, str(err)]).encode())
+
+    def step(self):
+        g = self.engine
+        for writer, owned, cmd in self.commands:
+            self.apply(writer, owned, cmd)
+        self.commands.clear()
+        g.move_intent = self.intents[1] + self.intents[2]
+        g.update()
+        self.player_state = g.record_player_changes(self.collector.record, self.player_state)
+        records = self.collector.flush()
+        full = g.tick_no % NET_FULL_INTERVAL == 0
+        delta = struct.pack("<I", g.tick_no) + b"".join(encode_record(r) for r in records) if records else None
+        full_payload = None
+        for writer, info in list(self.clients.items()):
+            if writer.transport.get_write_buffer_size() > NET_MAX_BACKLOG:
+                info["stale"] = True
+                continue
+            if full or info["stale"]:
+                if full_payload is None: full_payload = self.full_payload()
+                self.send(writer, NET_FULL, full_payload)
+                info["stale"] = False
+            elif delta:
+                self.send(writer, NET_DELTA, delta)
+
+    async def tick_loop(self):
+        period = 1 / self.tick_rate
+        next_t = time.perf_counter()
+        last_report, sent = time.monotonic(), {}
+        while True:
+            t0 = time.perf_counter()
+            self.step()
+            self.tick_ms.append((time.perf_counter() - t0) * 1000)
+            now = time.monotonic()
+            if now - last_report >= 5:
+                ms = sorted(self.tick_ms)
+                rates = []
+                for w, info in self.clients.items():
+                    prev = sent.get(w, 0)
+                    rates.append(f"{(info['bytes_out'] - prev) / (now - last_report) / 1024:.1f}")
+                    sent[w] = info["bytes_out"]
+                self.log(f"tick {self.engine.tick_no} | {len(self.engine.world.buildings)} buildings | "
+                         f"tick ms p50 {ms[len(ms) // 2]:.2f} p95 {ms[len(ms) * 95 // 100]:.2f} | "
+                         f"clients {len(self.clients)} out KB/s [{', '.join(rates)}]")
+                last_report = now
+            next_t += period
+            delay = next_t - time.perf_counter()
+            if delay < -1:
+                # More than a second behind: batch the machines forward
+                # over the missed ticks instead of dropping them
+                missed = int(-delay * self.tick_rate)
+                self.engine.world.fast_forward(missed)
+                self.engine.tick_no += missed
+                next_t = time.perf_counter()
+            await asyncio.sleep(max(0, delay))
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.log(f"seed {self.engine.world.seed} listening on {self.host}:{self.port}")
+        async with server:
+            await self.tick_loop()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+class NetClient:
+    # Non-blocking socket polled once per frame from the game loop
+    def __init__(self, host, port=NET_PORT, player=0):
+        self.sock = socket.create_connection((host, port), timeout=5)
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buf = bytearray()
+        self.out = bytearray()
+        self.owned = set()
+        self.intents = {}
+        self.server_tick = 0
+        self.bytes_in = self.bytes_out = 0
+        self.rate_in = self.rate_out = 0.0
+        self.rate_mark = (time.monotonic(), 0, 0)
+        self.closed = False
+        self.send(NET_HELLO, json.dumps({"player": player}).encode())
+
+    def send(self, kind, payload):
+        data = net_frame(kind, payload)
+        self.out += data
+        self.bytes_out += len(data)
+        self.flush()
+
+    def flush(self):
+        try:
+            while self.out:
+                n = self.sock.send(self.out)
+                del self.out[:n]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self.closed = True
+
+    def send_command(self, cmd):
+        # Stamped with the last server tick seen, as in the input log
+        self.send(NET_CMD, json.dumps([self.server_tick] + list(cmd)).encode())
+
+    def send_intents(self, move):
+        for pid in self.owned:
+            intent = tuple(move[0:2]) if pid == 1 else tuple(move[2:4])
+            if self.intents.get(pid) != intent:
+                self.intents[pid] = intent
+                self.send_command(("move", pid) + intent)
+
+    def poll(self, engine):
+        self.flush()
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    self.closed = True
+                    break
+                self.buf += data
+                self.bytes_in += len(data)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self.closed = True
+        pos = 0
+        while len(self.buf) - pos >= NET_FRAME.size:
+            kind, length = NET_FRAME.unpack_from(self.buf, pos)
+            if len(self.buf) - pos - NET_FRAME.size < length: break
+            payload = bytes(self.buf[pos + NET_FRAME.size:pos + NET_FRAME.size + length])
+            pos += NET_FRAME.size + length
+            self.handle(engine, kind, payload)
+        del self.buf[:pos]
+        now = time.monotonic()
+        t, b_in, b_out = self.rate_mark
+        if now - t >= 1:
+            self.rate_in = (self.bytes_in - b_in) / (now - t)
+            self.rate_out = (self.bytes_out - b_out) / (now - t)
+            self.rate_mark = (now, self.bytes_in, self.bytes_out)
+
+    def handle(self, engine, kind, payload):
+        if kind == NET_WELCOME:
+            self.owned = set(json.loads(payload)["players"])
+        elif kind == NET_FULL:
+            self.server_tick = struct.unpack_from("<I", payload)[0]
+            world, players, unlocks = parse_save(zlib.decompress(payload[4:]))
+            world.detach()
+            engine.adopt_state(world, players, unlocks)
+        elif kind == NET_DELTA and engine.world:
+            self.server_tick = struct.unpack_from("<I", payload)[0]
+            players = {1: engine.p1, 2: engine.p2}
+            for rec in decode_records(payload[4:]):
+                apply_record(engine.world, players, engine.unlocks, rec)
+                if rec[0] == "inv" and rec[1] == ("p", 1): engine.craft_counts = None
+        elif kind == NET_NACK:
+            cmd, reason = json.loads(payload)
+            engine.notify(f"Server refused {cmd[0] if cmd else 'command'}: {reason}", RED)
+
+    def close(self):
+        try: self.sock.close()
+        except OSError: pass
+        self.closed = True
+
+# ==========================================
+# SIMULATION PROCESS
+# ==========================================
+# With --split a child process owns the World and runs the ticks while
+# this one only draws. Tile arrays live in a shared-memory block both
+# sides map, with a ring of changed tile indices for the minimap. After
+# each tick the simulation writes a snapshot (players, unlocks and the
+# building table as flat arrays) into whichever of two slots the
+# renderer is not using and bumps the published sequence number. The
+# renderer acks the sequence it draws from, and nothing is published
+# until the newest snapshot has been picked up, so a slot is never
+# rewritten under a reader. Commands go back over a queue.
+#
+# Block: header, tile ring, slot 0, slot 1, tile types, tile colors.
+# Slot: header, state JSON, then x u16, y u16, type u8, facing u8 and
+# flags u8 arrays of SIM_MAX_BUILDINGS entries each.
+
+SIM_HEADER = struct.Struct("<QQQ")   # published seq, renderer ack, tile changes written
+SIM_SLOT = struct.Struct("<QIII")    # tick, buildings, state length, building layout version
+SIM_RING = 1 << 16
+SIM_STATE_MAX = 1 << 16
+SIM_MAX_BUILDINGS = 1 << 16
+SIM_SLOT_DATA = 64
+SIM_SLOT_SIZE = SIM_SLOT_DATA + SIM_STATE_MAX + SIM_MAX_BUILDINGS * 7
+SIM_HELD, SIM_STALLED = 1, 2
+BUILDING_KINDS = list(BUILDING_TYPES.values())
+BUILDING_KIND_IDS = {name: i for i, name in enumerate(BUILDING_TYPES)}
+FACING_IDS = {f: i for i, f in enumerate(FACINGS)}
+
+def sim_layout(width, height):
+    ring = 64
+    slots = ring + SIM_RING * 4
+    tiles = slots + 2 * SIM_SLOT_SIZE
+    return ring, slots, tiles, tiles + width * height * 4
+
+def sim_arrays(buf, at, n):
+    # Building arrays of slot at `at`, as views into the block
+    data, m = at + SIM_SLOT_DATA + SIM_STATE_MAX, SIM_MAX_BUILDINGS
+    return (buf[data:data + 2 * n].cast("H"), buf[data + 2 * m:data + 2 * m + 2 * n].cast("H"),
+            buf[data + 4 * m:data + 4 * m + n], buf[data + 5 * m:data + 5 * m + n], buf[data + 6 * m:data + 6 * m + n])
+
+class SimHost:
+    # Child-process side: a headless engine publishing into shared memory
+    def __init__(self, seed, cache_dir, commands, events):
+        self.commands, self.events = commands, events
+        g = self.engine = GameEngine(headless=True)
+        g.notify_hook = lambda msg, color: events.put(("notify", msg, color))
+        g.start_game(seed, cache_dir=cache_dir)
+        w = g.world
+        n = w.width * w.height
+        ring, self.slots_at, tiles, size = sim_layout(w.width, w.height)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        buf = self.buf = self.shm.buf
+        buf[tiles:tiles + n] = w.types
+        buf[tiles + n:tiles + 4 * n] = w.colors
+        w.types, w.colors = buf[tiles:tiles + n], buf[tiles + n:tiles + 4 * n]
+        self.ring = buf[ring:self.slots_at].cast("I")
+        self.tile_writes = 0
+        w.tile_listeners.append(self.on_tile)
+        w.building_listeners.append(self.on_building)
+        self.table = None
+        self.table_version = 0
+        self.slot_versions = [-1, -1]
+        self.intents = (0, 0, 0, 0)
+        self.blueprint = None
+        events.put(("ready", self.shm.name, w.seed, w.width, w.height))
+
+    def on_tile(self, x, y):
+        self.ring[self.tile_writes % SIM_RING] = y * self.engine.world.width + x
+        self.tile_writes += 1
+
+    def on_building(self, event, b):
+        if event != "recipe": self.table = None
+
+    def building_table(self):
+        # Position, type and facing only change when buildings come and
+        # go, so they are packed once per change rather than per tick
+        if self.table is None:
+            order = list(self.engine.world.buildings.values())[:SIM_MAX_BUILDINGS]
+            n = len(order)
+            self.table = (order, struct.pack(f"<{n}H", *(b.x for b in order)), struct.pack(f"<{n}H", *(b.y for b in order)),
+                          bytes(BUILDING_KIND_IDS[b.type] for b in order), bytes(FACING_IDS[b.facing] for b in order))
+            self.table_version += 1
+        return self.table
+
+    def drain(self):
+        while True:
+            try:
+                msg = self.commands.get_nowait()
+            except queue.Empty:
+                return True
+            if msg[0] == "quit": return False
+            if msg[0] == "move":
+                self.intents = tuple(msg[1:])
+                continue
+            try:
+                self.engine.execute(msg)
+            except (ValueError, TypeError, KeyError):
+                pass
+
+    def publish(self):
+        buf, g = self.buf, self.engine
+        struct.pack_into("<Q", buf, 16, self.tile_writes)
+        seq, ack, _ = SIM_HEADER.unpack_from(buf, 0)
+        if ack < seq: return
+        slot = (seq + 1) % 2
+        at = self.slots_at + slot * SIM_SLOT_SIZE
+        order, xs, ys, kinds, facings = self.building_table()
+        n = len(order)
+        bx, by, bk, bf, bflags = sim_arrays(buf, at, n)
+        if self.slot_versions[slot] != self.table_version:
+            bx.cast("B")[:] = xs
+            by.cast("B")[:] = ys
+            bk[:], bf[:] = kinds, facings
+            self.slot_versions[slot] = self.table_version
+        bflags[:] = bytes((SIM_HELD if b.inventory.items else 0) | (SIM_STALLED if b.stalled else 0) for b in order)
+        state = json.dumps({
+            "players": [[p.rect.x, p.rect.y, p.facing, p.hotbar_index, p.inventory.items] for p in (g.p1, g.p2)],
+            "points": g.unlocks.points,
+            "unlocked": [k for k, v in g.unlocks.unlocks.items() if v["unlocked"]],
+            "haulers": [[h.screen_pos((0, 0)), bool(h.inventory.items)] for h in g.world.haulers.values()],
+        }).encode()
+        buf[at + SIM_SLOT_DATA:at + SIM_SLOT_DATA + len(state)] = state
+        SIM_SLOT.pack_into(buf, at, g.tick_no, n, len(state), self.table_version)
+        struct.pack_into("<Q", buf, 0, seq + 1)
+
+    def run(self):
+        g, period = self.engine, 1 / FPS
+        parent = multiprocessing.parent_process()
+        next_t = time.perf_counter()
+        while self.drain():
+            g.move_intent = self.intents
+            g.update()
+            self.publish()
+            if g.blueprint is not self.blueprint:
+                bp = self.blueprint = g.blueprint
+                self.events.put(("blueprint", bp.width, bp.height, bp.entries) if bp else ("blueprint", 0, 0, []))
+            if g.tick_no % FPS == 0 and parent and not parent.is_alive(): break
+            next_t += period
+            delay = next_t - time.perf_counter()
+            if delay < -1:
+                # Same catch-up as the network server
+                missed = int(-delay * FPS)
+                g.world.fast_forward(missed)
+                g.tick_no += missed
+                next_t = time.perf_counter()
+            time.sleep(max(0, delay))
+
+    def close(self):
+        # Views into the block have to go before it can be unmapped
+        self.engine.world.detach()
+        self.ring = None
+        self.shm.close()
+
+def run_sim_process(seed, cache_dir, commands, events):
+    host = SimHost(seed, cache_dir, commands, events)
+    try:
+        host.run()
+    finally:
+        host.close()
+
+class SimLink:
+    # Render-side end of a SimHost, polled like NetClient. The building
+    # table is drawn straight from the slot's arrays, with no per-frame
+    # copy into Building objects.
+    def __init__(self, seed=None, cache_dir=WORLD_CACHE_DIR):
+        ctx = multiprocessing.get_context("spawn")
+        self.commands, self.events = ctx.Queue(), ctx.Queue()
+        self.proc = ctx.Process(target=run_sim_process, args=(seed, cache_dir, self.commands, self.events), daemon=True)
+        self.proc.start()
+        self.shm = None
+        self.owned = {1, 2}
+        self.intents = None
+        self.server_tick = 0
+        self.seq = 0
+        self.tiles_read = 0
+        self.arrays = ((), (), (), (), ())
+        self.haulers = []
+        self.table_version = 0
+        self.index = {}
+        self.rate = 0.0
+        self.rate_mark = (time.monotonic(), 0)
+        self.closed = False
+
+    def send_command(self, cmd):
+        self.commands.put(tuple(cmd))
+
+    def send_intents(self, move):
+        if move != self.intents:
+            self.intents = move
+            self.commands.put(("move",) + tuple(move))
+
+    def poll(self, engine):
+        while True:
+            try:
+                msg = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if msg[0] == "ready": self.attach(engine, *msg[1:])
+            elif msg[0] == "notify": engine.notify(msg[1], msg[2])
+            elif msg[0] == "blueprint": engine.blueprint = Blueprint(*msg[1:]) if msg[1] else None
+        if not self.proc.is_alive():
+            self.closed = True
+        elif self.shm:
+            self.read(engine)
+
+    def attach(self, engine, name, seed, width, height):
+        self.shm = shared_memory.SharedMemory(name=name)
+        buf = self.shm.buf
+        ring, self.slots_at, tiles, _ = sim_layout(width, height)
+        n = width * height
+        self.ring = buf[ring:self.slots_at].cast("I")
+        self.world = World(seed, width, height, tiles=(buf[tiles:tiles + n], buf[tiles + n:tiles + 4 * n]))
+        engine.adopt_state(self.world, [Player(1, width // 2, height // 2, BLUE), Player(2, width // 2 + 2, height // 2, GREEN)], UnlockManager())
+
+    def read(self, engine):
+        buf = self.shm.buf
+        seq, _, writes = SIM_HEADER.unpack_from(buf, 0)
+        if writes != self.tiles_read:
+            world = engine.world
+            if writes - self.tiles_read > SIM_RING:
+                # Too far behind to replay the ring; rescan instead
+                if world.index: world.index.resync()
+                if engine.map_view: engine.generate_minimap()
+            else:
+                w, listeners = world.width, world.tile_listeners
+                for i in range(self.tiles_read, writes):
+                    t = self.ring[i % SIM_RING]
+                    for fn in listeners: fn(t % w, t // w)
+        self.tiles_read = writes
+        if seq != self.seq:
+            # Acking seq hands the other slot back to the writer
+            struct.pack_into("<Q", buf, 8, seq)
+            self.seq = seq
+            at = self.slots_at + (seq % 2) * SIM_SLOT_SIZE
+            tick, n, length, version = SIM_SLOT.unpack_from(buf, at)
+            state = json.loads(bytes(buf[at + SIM_SLOT_DATA:at + SIM_SLOT_DATA + length]))
+            for p, (x, y, facing, hotbar, items) in zip((engine.p1, engine.p2), state["players"]):
+                if p is engine.p1 and items != p.inventory.items: engine.craft_counts = None
+                p.rect.topleft = (x, y)
+                p.facing, p.hotbar_index, p.inventory.items = facing, hotbar, items
+                p.update(0, 0, 0, 0)
+            engine.unlocks.points = state["points"]
+            for key in state["unlocked"]: engine.unlocks.unlocks[key]["unlocked"] = True
+            self.haulers = state["haulers"]
+            self.server_tick = tick
+            self.arrays = sim_arrays(buf, at, n)
+            if version != self.table_version:
+                self.table_version = version
+                self.index = {}
+                for i, (x, y) in enumerate(zip(*self.arrays[:2])):
+                    self.index.setdefault((x // CHUNK_SIZE, y // CHUNK_SIZE), []).append(i)
+        now = time.monotonic()
+        t, seen = self.rate_mark
+        if now - t >= 1:
+            self.rate = (self.seq - seen) / (now - t)
+            self.rate_mark = (now, self.seq)
+
+    def render_buildings(self, surface, cam, sx, sy, ex, ey, ts, sprites):
+        xs, ys, kinds, facings, flags = self.arrays
+        for cy in range(sy // CHUNK_SIZE, ey // CHUNK_SIZE + 1):
+            for cx in range(sx // CHUNK_SIZE, ex // CHUNK_SIZE + 1):
+                for i in self.index.get((cx, cy), ()):
+                    x, y = xs[i], ys[i]
+                    if sx <= x <= ex and sy <= y <= ey:
+                        r = pygame.Rect(x * ts - cam[0], y * ts - cam[1], ts, ts)
+                        sprites.paint(surface, BUILDING_KINDS[kinds[i]], r, FACINGS[facings[i]], flags[i] & SIM_HELD, flags[i] & SIM_STALLED)
+
+    def close(self):
+        if self.proc.is_alive():
+            self.commands.put(("quit",))
+            self.proc.join(1)
+        if self.shm:
+            # The mirror world keeps its tiles as plain copies
+            self.world.detach()
+            self.ring, self.arrays, self.index = None, ((), (), (), (), ()), {}
+            self.shm.unlink()
+            self.shm.close()
+            self.shm = None
+        self.closed = True
+
+# ==========================================
+# PROFILING
+# ==========================================
+
+class PhaseTimer:
+    # One-shot timings for sequential phases such as startup
+    def __init__(self):
+        self.phases = []
+        self.last = time.perf_counter()
+
+    def restart(self):
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000))
+        self.last = now
+
+    def report(self):
+        return [f"{name:<18}{ms:>9.2f} ms" for name, ms in self.phases]
+
+class FrameProfiler:
+    # Call mark(phase) after each phase of a frame; the time since the
+    # previous mark is charged to that phase. end_frame() files the frame.
+    def __init__(self, history=3600):
+        self.frames = deque(maxlen=history)
+        self.current = {}
+        self.last = time.perf_counter()
+        self.frame_no = 0
+        self.stats = {}
+        self.visible = False
+        self.startup = PhaseTimer()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0.0) + (now - self.last) * 1000
+        self.last = now
+
+    def end_frame(self):
+        self.frame_no += 1
+        self.current["total"] = sum(self.current.values())
+        self.frames.append((self.frame_no, self.current))
+        self.current = {}
+        if self.visible and self.frame_no % 30 == 0:
+            self.stats = self.percentiles()
+
+    def percentiles(self, pcts=(50, 95, 99)):
+        series = {}
+        for _, f in self.frames:
+            for k, v in f.items():
+                series.setdefault(k, []).append(v)
+        out = {}
+        n_frames = len(self.frames)
+        for k, vals in series.items():
+            # phases absent from a frame took 0 ms in it
+            vals += [0.0] * (n_frames - len(vals))
+            vals.sort()
+            out[k] = tuple(vals[min(len(vals) - 1, len(vals) * p // 100)] for p in pcts)
+        return out
+
+    def export(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        phases = []
+        for _, f in self.frames:
+            for k in f:
+                if k not in phases: phases.append(k)
+        with open(path, "w", newline="") as fh:
+            if path.endswith(".json"):
+                json.dump({"phases": phases, "percentiles": self.percentiles(),
+                           "startup_ms": dict(self.startup.phases),
+                           "frames": [dict(frame=n, **f) for n, f in self.frames]}, fh)
+            else:
+                fh.write(",".join(["frame"] + phases) + "\n")
+                for n, f in self.frames:
+                    fh.write(",".join([str(n)] + [f"{f.get(k, 0.0):.3f}" for k in phases]) + "\n")
+        return path
+
+    def draw(self, surface, font, extra=()):
+        if not self.stats: self.stats = self.percentiles()
+        rows = [f"{'phase':<10}{'p50':>8}{'p95':>8}{'p99':>8}"]
+        for k, (a, b, c) in self.stats.items():
+            rows.append(f"{k:<10}{a:>8.2f}{b:>8.2f}{c:>8.2f}")
+        if self.startup.phases:
+            rows += ["startup"] + self.startup.report()
+        rows += extra
+        rows.append("F3: Hide | F4: CSV | Shift+F4: JSON | Ctrl+F3: Governor")
+        w = max(font.size(r)[0] for r in rows) + 16
+        x = surface.get_width() - w - 10
+        bg = pygame.Surface((w, len(rows) * 18 + 10), pygame.SRCALPHA)
+        bg.fill((0, 0, 0, 180))
+        surface.blit(bg, (x, 50))
+        for i, r in enumerate(rows):
+            col = GOLD if i == 0 else (SKY_BLUE if i == len(rows) - 1 else WHITE)
+            surface.blit(font.render(r, True, col), (x + 8, 55 + i * 18))
+
+class QualityGovernor:
+    # Trades looks for frame time. Frame work time (the frame minus its
+    # idle wait) is checked every WINDOW frames: a 90th percentile over
+    # budget steps one level down LEVELS, and RECOVER windows in a row
+    # under HEADROOM of the budget step back up. Each level keeps the cuts
+    # of the levels before it.
+    LEVELS = ("full quality", "essence pulse frozen", "flat tile decorations", "HUD every other frame",
+              "render scale 75%", "render scale 50%", "catch-up 2 ticks", "no catch-up")
+    WINDOW = 30
+    HEADROOM = 0.6
+    RECOVER = 4
+
+    def __init__(self, budget_ms=1000 / FPS):
+        self.budget = budget_ms
+        self.enabled = True
+        self.level = 0
+        self.load = 0.0
+        self.calm = 0
+        self.times = []
+
+    def record(self, work_ms):
+        if not self.enabled: return
+        self.times.append(work_ms)
+        if len(self.times) < self.WINDOW: return
+        self.times.sort()
+        self.load = self.times[self.WINDOW * 9 // 10] / self.budget
+        self.times = []
+        if self.load > 1:
+            self.calm = 0
+            self.level = min(self.level + 1, len(self.LEVELS) - 1)
+        elif self.load < self.HEADROOM and self.level:
+            self.calm += 1
+            if self.calm >= self.RECOVER:
+                self.calm = 0
+                self.level -= 1
+        else:
+            self.calm = 0
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.level, self.calm, self.times = 0, 0, []
+        return self.enabled
+
+    @property
+    def pulse(self): return self.level < 1
+    @property
+    def decorations(self): return self.level < 2
+    @property
+    def hud_every(self): return 2 if self.level >= 3 else 1
+    @property
+    def scale(self): return 0.5 if self.level >= 5 else (0.75 if self.level >= 4 else 1.0)
+    @property
+    def catch_up(self): return 1 if self.level >= 7 else (2 if self.level >= 6 else CATCH_UP_TICKS)
+
+    def report(self):
+        if not self.enabled: return ["quality governor off"]
+        return [f"quality {self.level}/{len(self.LEVELS) - 1}: {self.LEVELS[self.level]}",
+                f"  load {self.load:.0%} of {self.budget:.1f} ms"]
+
+class MemoryMonitor:
+    # Structure-aware byte counts per subsystem, sampled on a timer,
+    # plus optional tracemalloc diffs. A subsystem whose estimate rose in
+    # every one of the last GROWTH_SAMPLES samples is flagged. Rows in
+    # ESTIMATED are per-item guesses rather than measured sizes and are
+    # marked as such in the panel and the dump.
+    GROWTH_SAMPLES = 6
+    ESTIMATED = frozenset(("journal.queue",))
+    JOURNAL_RECORD_BYTES = 120  # SimpleQueue cannot be looked into
+
+    def __init__(self, interval=5.0, history=120):
+        self.interval = interval
+        self.history = deque(maxlen=history)
+        self.last_sample = time.monotonic()
+        self.visible = False
+        self.latest = {}
+        self.flags = []
+        self.hoarders = []
+        self.inv_totals = {}
+        self.inv_streaks = {}
+        self.trace_prev = None
+        self.trace_top = []
+
+    def maybe_sample(self, engine):
+        now = time.monotonic()
+        if now - self.last_sample >= self.interval:
+            self.last_sample = now
+            self.sample(engine)
+
+    def measure(self, engine):
+        out = {}
+        w = engine.world
+        if w:
+            out["world.tiles"] = (w.width * w.height, len(w.types) + len(w.colors) + sys.getsizeof(w.types) + sys.getsizeof(w.colors))
+            b_bytes = sys.getsizeof(w.buildings) + sys.getsizeof(w.building_chunks)
+            inv_n = inv_bytes = 0
+            for b in w.buildings.values():
+                b_bytes += sys.getsizeof(b) + sys.getsizeof(b.__dict__) + sys.getsizeof(b.rect)
+                inv_n += len(b.inventory.items)
+                inv_bytes += sys.getsizeof(b.inventory.items)
+            for chunk in w.building_chunks.values():
+                b_bytes += sys.getsizeof(chunk)
+            out["world.buildings"] = (len(w.buildings), b_bytes)
+            out["building.inventories"] = (inv_n, inv_bytes)
+            snap_n = snap_bytes = 0
+            for snap in w.snapshots:
+                snap_n += len(snap.tiles) + len(snap.buildings)
+                snap_bytes += sys.getsizeof(snap.tiles) + sum(sys.getsizeof(t) for t in snap.tiles.values())
+                snap_bytes += sys.getsizeof(snap.buildings) + sum(sys.getsizeof(loc) + (sys.getsizeof(r) + sys.getsizeof(r[5]) if r else 0)
+                                                                  for loc, r in snap.buildings.items())
+                if snap.timers is not None: snap_bytes += sys.getsizeof(snap.timers)
+            out["snapshots"] = (snap_n, snap_bytes)
+        players = [p for p in (engine.p1, engine.p2) if p]
+        out["player.inventories"] = (sum(len(p.inventory.items) for p in players),
+                                     sum(sys.getsizeof(p.inventory.items) for p in players))
+        out["notifications"] = (len(engine.notifications),
+                                sys.getsizeof(engine.notifications) + sum(sys.getsizeof(n) + sys.getsizeof(n[0]) for n in engine.notifications))
+        surf_n = surf_bytes = 0
+        surfaces = [engine.minimap_surface] + (engine.map_view.levels[1:] if engine.map_view else [])
+        for surf in surfaces:
+            if surf:
+                surf_n += 1
+                surf_bytes += surf.get_width() * surf.get_height() * surf.get_bytesize()
+        out["surfaces"] = (surf_n, surf_bytes)
+        frames = engine.profiler.frames
+        out["profiler.frames"] = (len(frames), sys.getsizeof(frames) + sum(sys.getsizeof(fr) + sys.getsizeof(fr[1]) + sum(map(sys.getsizeof, fr[1].values()))
+                                                                           for fr in frames))
+        idx = w.index if w else None
+        out["tiles.index"] = (sum(len(c) for d in idx.chunks for c in d.values()), idx.nbytes()) if idx else (0, 0)
+        paths = w.paths if w else None
+        out["paths.fields"] = (len(paths.fields), sys.getsizeof(paths.passable) + sys.getsizeof(paths.fields)
+                               + sum(sys.getsizeof(f) + sys.getsizeof(f.__dict__) + sys.getsizeof(f.dist) for f in paths.fields.values())) if paths else (0, 0)
+        # Ints from -5 to 256 are shared by the interpreter, so only the
+        # larger counts cost their own object
+        rings = engine.stats.rings
+        out["stats.rings"] = (len(rings), sys.getsizeof(rings) + sum(sys.getsizeof(k) + sys.getsizeof(rs) + sum(sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r if not -5 <= v <= 256)
+                                                                                                        for r in rs) for k, rs in rings.items()))
+        flow = engine.flow
+        flow_bytes = sys.getsizeof(flow.backlog)
+        if flow.closed:
+            _, before, counts = flow.closed
+            flow_bytes += sys.getsizeof(before) + sys.getsizeof(counts) + sum(sys.getsizeof(c) + sys.getsizeof(c[0]) for c in counts.values())
+        out["flow.window"] = (len(flow.backlog), flow_bytes)
+        if engine.journal:
+            out["journal.queue"] = (engine.journal.queue.qsize(), engine.journal.queue.qsize() * self.JOURNAL_RECORD_BYTES)
+        lapse = engine.timelapse
+        out["timelapse.queue"] = (lapse.queue.qsize(), lapse.queue.qsize() * lapse.frame_bytes + (len(lapse.rgb) if lapse.rgb else 0))
+        return out
+
+    def sample(self, engine):
+        self.latest = self.measure(engine)
+        self.history.append((time.time(), self.latest))
+        self.flags = []
+        recent = list(self.history)[-self.GROWTH_SAMPLES:]
+        if len(recent) == self.GROWTH_SAMPLES:
+            for key in self.latest:
+                vals = [s.get(key, (0, 0))[1] for _, s in recent]
+                if all(b > a for a, b in zip(vals, vals[1:])):
+                    self.flags.append(f"{key} grew {vals[0]} -> {vals[-1]} B over {len(vals)} samples")
+        if engine.world: self.watch_buildings(engine.world)
+        if tracemalloc.is_tracing(): self.trace_sample()
+
+    def watch_buildings(self, world):
+        # Buildings whose stock keeps rising, e.g. drills with no target
+        totals, streaks = {}, {}
+        for loc, b in world.buildings.items():
+            total = sum(b.inventory.items.values())
+            totals[loc] = total
+            if total > self.inv_totals.get(loc, total):
+                streaks[loc] = self.inv_streaks.get(loc, 0) + 1
+        self.inv_totals, self.inv_streaks = totals, streaks
+        hoarders = []
+        for loc, n in streaks.items():
+            if n >= 3:
+                b = world.buildings[loc]
+                blocked = world.get_building(*b.get_neighbor_coords()) is None
+                hoarders.append((totals[loc], loc, b.type, blocked))
+        hoarders.sort(reverse=True)
+        self.hoarders = hoarders
+        if hoarders:
+            blocked = sum(1 for h in hoarders if h[3])
+            self.flags.append(f"{len(hoarders)} buildings accumulating items ({blocked} with no output target)")
+
+    def toggle_tracing(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self.trace_prev = None
+            self.trace_top = []
+            return False
+        tracemalloc.start()
+        return True
+
+    def trace_sample(self):
+        snap = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        if self.trace_prev:
+            stats = snap.compare_to(self.trace_prev, "lineno")
+            self.trace_top = [f"{s.traceback[0].filename.split(os.sep)[-1]}:{s.traceback[0].lineno} {s.size_diff:+d} B ({s.size} B)" for s in stats[:8]]
+        else:
+            self.trace_top = [f"{s.traceback[0].filename.split(os.sep)[-1]}:{s.traceback[0].lineno} {s.size} B" for s in snap.statistics("lineno")[:8]]
+        self.trace_prev = snap
+
+    def report(self):
+        return {
+            "time": time.time(),
+            "subsystems": {k: {"count": c, "bytes": b, "estimated": k in self.ESTIMATED} for k, (c, b) in self.latest.items()},
+            "flags": self.flags,
+            "hoarders": [{"x": loc[0], "y": loc[1], "type": t, "items": n, "no_target": blocked} for n, loc, t, blocked in self.hoarders[:50]],
+            "tracemalloc": self.trace_top,
+            "history": [{"time": ts, **{k: b for k, (c, b) in smp.items()}} for ts, smp in self.history],
+        }
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as fh:
+            json.dump(self.report(), fh, indent=1)
+        return path
+
+    def draw(self, surface, font):
+        rows = [f"{'subsystem':<22}{'count':>9}{'KB':>11}"]
+        for k, (c, b) in self.latest.items():
+            rows.append(f"{k:<22}{c:>9}{('~' if k in self.ESTIMATED else '') + f'{b / 1024:.1f}':>11}")
+        for f in self.flags: rows.append("! " + f)
+        for n, loc, t, blocked in self.hoarders[:3]:
+            rows.append(f"  {t} at {loc}: {n} items{' (no target)' if blocked else ''}")
+        if self.trace_top: rows += ["tracemalloc:"] + ["  " + t for t in self.trace_top[:5]]
+        rows.append(f"F2: Hide | Shift+F2: Dump | Ctrl+F2: tracemalloc {'ON' if tracemalloc.is_tracing() else 'OFF'}")
+        w = max(font.size(r)[0] for r in rows) + 16
+        bg = pygame.Surface((w, len(rows) * 18 + 10), pygame.SRCALPHA)
+        bg.fill((0, 0, 0, 180))
+        surface.blit(bg, (10, 50))
+        for i, r in enumerate(rows):
+            col = GOLD if i == 0 else (RED if r.startswith("!") else (SKY_BLUE if i == len(rows) - 1 else WHITE))
+            surface.blit(font.render(r, True, col), (18, 55 + i * 18))
+
+# --- LOGISTICS ---
+# Buildings count their own work-cycle outcomes and the items they hand
+# on, so the cost is one increment per machine cycle. Every window the
+# monitor collects and clears those counters; the report is built on
+# demand from the last complete window. A building has one output tile,
+# so its hand-off count is the rate on that edge.
+
+FLOW_WORK, FLOW_STARVED, FLOW_BLOCKED, FLOW_IDLE = range(4)
+FLOW_STATES = ("work", "starved", "blocked", "idle")
+
+class FlowMonitor:
+    def __init__(self, window=30 * FPS):
+        self.window = window
+        self.visible = False
+        self.reset()
+
+    def reset(self):
+        self.ticks = 0
+        self.backlog = {}
+        self.closed = None
+        self.cached = None
+
+    def attach(self, world):
+        self.reset()
+        world.flow = self
+        self.collect(world)
+
+    def tick(self, world):
+        self.ticks += 1
+        if self.ticks >= self.window: self.roll(world)
+
+    def collect(self, world):
+        # -> {loc: (cycles, sent, held)}, clearing the building counters
+        out = {}
+        for loc, b in world.buildings.items():
+            out[loc] = (b.cycles, b.sent, sum(b.inventory.items.values()))
+            b.cycles = [0, 0, 0, 0]
+            b.sent = 0
+        return out
+
+    def roll(self, world):
+        counts = self.collect(world)
+        self.closed = (self.ticks, self.backlog, counts)
+        self.cached = None
+        self.ticks = 0
+        self.backlog = {loc: c[2] for loc, c in counts.items()}
+
+    def analyze(self, world):
+        # Bottleneck score is in items/min of unmet flow at a machine: its
+        # own backlog growth plus the failed hand-offs of machines feeding it.
+        # Computed once per closed window, and at most once a second over
+        # the running one before the first window closes. Returns
+        # (ticks, minutes, machines sorted by score, {loc: machine}, edges)
+        # with machines as (score, loc, b, cycles, n, held, growth, upstream).
+        key = self.closed if self.closed else self.ticks // FPS
+        if self.cached and (self.cached[0] is key if self.closed else self.cached[0] == key): return self.cached[1]
+        if self.closed: ticks, before, counts = self.closed
+        else:
+            ticks, before = self.ticks, self.backlog
+            counts = {loc: (b.cycles, b.sent, sum(b.inventory.items.values())) for loc, b in world.buildings.items()}
+        minutes = max(ticks, 1) / (FPS * 60)
+        none = ((0, 0, 0, 0), 0, 0)
+        feeders, edges = {}, []
+        buildings = world.buildings
+        for loc, b in buildings.items():
+            t = b.target
+            if t in buildings: feeders.setdefault(t, []).append(loc)
+            sent = counts.get(loc, none)[1]
+            if sent: edges.append((sent, loc, t))
+        machines = []
+        for loc, b in buildings.items():
+            if isinstance(b, Totem): continue
+            c, _, held = counts.get(loc, none)
+            growth = (held - before.get(loc, held)) / minutes
+            fs = feeders.get(loc)
+            upstream = sum(counts.get(f, none)[0][FLOW_BLOCKED] for f in fs) / minutes if fs else 0.0
+            machines.append((max(growth, 0) + upstream, loc, b, c, sum(c), held, growth, upstream))
+        machines.sort(key=lambda m: -m[0])
+        result = (ticks, minutes, machines, {m[1]: m for m in machines}, edges)
+        self.cached = (key, result)
+        return result
+
+    @staticmethod
+    def describe(m):
+        score, loc, b, c, n, held, growth, upstream = m
+        if c[FLOW_BLOCKED] * 2 > n: reason = "output blocked"
+        elif n and c[FLOW_WORK] / n > 0.9 and score > 0: reason = "saturated"
+        elif upstream: reason = "feeders blocked"
+        elif growth > 0: reason = "backlog growing"
+        else: reason = ""
+        return {
+            "x": loc[0], "y": loc[1], "type": b.type, "cycles": n, "stalled": b.stalled,
+            **{FLOW_STATES[i]: round(c[i] / n, 3) if n else 0 for i in range(4)},
+            "backlog": held, "growth_per_min": round(growth, 2),
+            "upstream_blocked_per_min": round(upstream, 2), "score": round(score, 2), "reason": reason,
+        }
+
+    def report(self, world, top=20):
+        ticks, minutes, machines, _, edges = self.analyze(world)
+        return {
+            "window_ticks": ticks,
+            "complete": self.closed is not None,
+            "bottlenecks": [self.describe(m) for m in machines[:top] if m[0] > 0],
+            "machines": [self.describe(m) for m in machines],
+            "edges": [{"from": list(src), "to": list(dst), "per_min": round(sent / minutes, 2)}
+                      for sent, src, dst in sorted(edges, reverse=True)],
+        }
+
+    def dump(self, world, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as fh:
+            json.dump(self.report(world), fh, indent=1)
+        return path
+
+    def draw_overlay(self, surface, cam, world, sx, sy, ex, ey, ts=TILE_SIZE):
+        _, _, machines, by_loc, _ = self.analyze(world)
+        rank = {m[1]: i + 1 for i, m in enumerate(machines[:9]) if m[0] > 0}
+        for b in world.buildings_in_rect(sx, sy, ex, ey):
+            loc = (b.x, b.y)
+            m = by_loc.get(loc)
+            if m is None: continue
+            c, n = m[3], m[4] or 1
+            r = pygame.Rect(loc[0] * ts - cam[0], loc[1] * ts - cam[1], ts, ts)
+            if loc in rank: col = RED
+            elif c[FLOW_BLOCKED] / n > 0.5: col = (255, 140, 0)
+            elif c[FLOW_STARVED] / n > 0.5 or c[FLOW_IDLE] / n > 0.5: col = SKY_BLUE
+            else: col = GREEN
+            pygame.draw.rect(surface, col, r, 3)
+        return rank
+
+    def draw(self, surface, font, world):
+        ticks, _, machines, _, _ = self.analyze(world)
+        rows = [f"LOGISTICS ({ticks} ticks{'' if self.closed else ', partial'})"]
+        for i, m in enumerate(self.describe(m) for m in machines[:9] if m[0] > 0):
+            rows.append(f"{i + 1}. {m['type']} ({m['x']},{m['y']}) {m['score']:.1f}/min {m['reason']} | work {m['work']:.0%} backlog {m['backlog']}")
+        if len(rows) == 1: rows.append("No bottlenecks")
+        rows.append("F8: Hide | Shift+F8: Export report")
+        w = max(font.size(r)[0] for r in rows) + 16
+        bg = pygame.Surface((w, len(rows) * 18 + 10), pygame.SRCALPHA)
+        bg.fill((0, 0, 0, 180))
+        surface.blit(bg, (SCREEN_WIDTH - w - 10, 50))
+        for i, r in enumerate(rows):
+            col = GOLD if i == 0 else (SKY_BLUE if i == len(rows) - 1 else WHITE)
+            surface.blit(font.render(r, True, col), (SCREEN_WIDTH - w - 2, 55 + i * 18))
+
+# ==========================================
+# TIMELAPSE
+# ==========================================
+# The main loop's share of a captured frame is one copy of its pixels into
+# a bytes buffer. Scaling, PNG encoding and file writes happen on a worker
+# thread; if it falls behind, new frames are dropped instead of waited on.
+
+TIMELAPSE_DIR = "timelapse"
+TIMELAPSE_INTERVAL = 5.0
+TIMELAPSE_PENDING = 8
+# Output size relative to the source: the screen is halved, the one pixel
+# per tile world map is enlarged
+TIMELAPSE_SCALES = {"view": 0.5, "map": 4}
+
+class TimelapseRecorder:
+    def __init__(self, directory=TIMELAPSE_DIR, interval=TIMELAPSE_INTERVAL, source="view"):
+        self.directory = directory
+        self.interval = interval
+        self.source = source
+        self.queue = queue.Queue(maxsize=TIMELAPSE_PENDING)
+        self.thread = None
+        self.path = None
+        self.next_at = 0.0
+        self.written = self.dropped = 0
+        self.frame_bytes = 0
+        self.error = None
+        # "map" source: the world at one pixel per tile with buildings
+        # drawn in, kept current by tile and building listeners
+        self.world = None
+        self.rgb = None
+
+    def start(self):
+        self.path = os.path.join(self.directory, time.strftime("%Y%m%d_%H%M%S"))
+        os.makedirs(self.path, exist_ok=True)
+        self.next_at = 0.0
+        self.written = self.dropped = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="timelapse-writer", daemon=True)
+        self.thread.start()
+        return self.path
+
+    def stop(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.attach(None)
+
+    def attach(self, world):
+        if self.world:
+            self.world.tile_listeners.remove(self.on_tile)
+            self.world.building_listeners.remove(self.on_building)
+        self.world, self.rgb = world, None
+        if world is None: return
+        self.rgb = minimap_rgb(world)
+        for b in world.buildings.values(): self.plot(b.x, b.y, b.map_color)
+        world.tile_listeners.append(self.on_tile)
+        world.building_listeners.append(self.on_building)
+
+    def plot(self, x, y, color):
+        i = (y * self.world.width + x) * 3
+        self.rgb[i:i + 3] = bytes(color)
+
+    def on_tile(self, x, y):
+        if (x, y) not in self.world.buildings: self.plot(x, y, minimap_color(self.world, x, y))
+
+    def on_building(self, event, b):
+        if event == "add": self.plot(b.x, b.y, b.map_color)
+        elif event == "remove": self.plot(b.x, b.y, minimap_color(self.world, b.x, b.y))
+
+    def maybe_capture(self, engine):
+        now = time.monotonic()
+        if not self.thread or now < self.next_at: return
+        self.next_at = now + self.interval
+        if self.source == "map":
+            if not engine.world: return
+            if self.world is not engine.world: self.attach(engine.world)
+            frame = (bytes(self.rgb), (self.world.width, self.world.height), None)
+        else:
+            # Raw pixels in the display's own format; converting to RGB here
+            # would cost ten times the copy
+            screen = engine.screen
+            frame = (screen.get_buffer().raw, screen.get_size(), (screen.get_bitsize(), screen.get_masks()))
+        self.frame_bytes = len(frame[0])
+        try:
+            self.queue.put_nowait(frame + (TIMELAPSE_SCALES[self.source],))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None: return
+            pixels, size, fmt, scale = frame
+            try:
+                if fmt:
+                    surf = pygame.Surface(size, 0, *fmt)
+                    surf.get_buffer().write(pixels)
+                else:
+                    surf = pygame.image.frombuffer(pixels, size, "RGB")
+                out = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+                surf = (pygame.transform.smoothscale if scale < 1 else pygame.transform.scale)(surf, out)
+                # Numbered by frames written, so drops leave no gaps
+                pygame.image.save(surf, os.path.join(self.path, f"frame_{self.written + 1:06d}.png"))
+                self.written += 1
+            except (OSError, pygame.error) as e:
+                self.error = e
+
 # ==========================================
 # MAIN GAME CLASS
 # ==========================================
 
+class FontCache:
+    # SysFont scans every system font directory on first use, which can take
+    # seconds on machines with large font collections. The file and faux-bold
+    # flag it settles on are remembered here so later runs open the file directly.
+    def __init__(self, path=FONT_CACHE):
+        self.path = path
+        self.dirty = False
+        try:
+            with open(path) as fh: self.entries = json.load(fh)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, name, size, bold=False):
+        key = f"{name.lower()}:{int(bold)}"
+        hit = self.entries.get(key)
+        if hit and (hit[0] is None or os.path.exists(hit[0])):
+            font = pygame.font.Font(hit[0], size)
+            font.set_bold(hit[1])
+            return font
+        found = []
+        def construct(path, size, fake_bold, fake_italic):
+            found.append([path, fake_bold])
+            font = pygame.font.Font(path, size)
+            font.set_bold(fake_bold)
+            return font
+        font = pygame.font.SysFont(name, size, bold=bold, constructor=construct)
+        self.entries[key] = found[0]
+        self.dirty = True
+        return font
+
+    def save(self):
+        if not self.dirty: return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as fh: json.dump(self.entries, fh)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+        self.dirty = False
+
 class GameEngine:
-    def __init__(self):
-        pygame.init()
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption("Factorial")
-        self.clock = pygame.time.Clock()
-        self.font = pygame.font.SysFont("Consolas", 14, bold=True)
-        self.title_font = pygame.font.SysFont("Verdana", 40, bold=True)
+    def __init__(self, headless=False, persist=True):
+        # Headless engines run the simulation and commands only: no
+        # window, fonts, minimap, autosave or input log. persist=False
+        # keeps the window but skips autosave and the input log.
+        self.headless = headless
+        self.persist = persist and not headless
+        self.profiler = FrameProfiler()
+        self.memory = MemoryMonitor()
+        self.flow = FlowMonitor()
+        self.stats = ProductionStats()
+        self.stats_view = [0, 1]
+        self.ecology = Ecology()
+        timer = self.profiler.startup
+        if not headless:
+            # Only the modules the game uses; pygame.init() would also bring
+            # up audio and joysticks, which are never touched
+            pygame.display.init()
+            pygame.font.init()
+            timer.mark("pygame_init")
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            pygame.display.set_caption("Factorial")
+            self.clock = pygame.time.Clock()
+            timer.mark("display")
+            fonts = FontCache()
+            timer.mark("font_cache")
+            self.font = fonts.get("Consolas", 14, bold=True)
+            self.title_font = fonts.get("Verdana", 40, bold=True)
+            fonts.save()
+            timer.mark("fonts")
+        self.startup_base = len(timer.phases)
         
         self.state = GameState.MENU
         self.unlocks = UnlockManager()
@@ -424,43 +3361,349 @@ class GameEngine:
         self.notifications = []
         
         self.minimap_surface = None
+        self.map_view = None
+        self.journal = None
+        self.journal_state = None
 
-    def start_game(self, seed=None):
+        self.rng = random.Random()
+        self.tick_no = 0
+        self.move_intent = (0, 0, 0, 0)
+        self.input_log = None
+        self.quick_snap = None
+        self.undo_stack = []
+        self.net = None
+        self.notify_hook = None
+        self.blueprint = None
+        self.blueprint_corner = None
+        self.hauler_source = None
+        self.render_scale = 1.0
+        self.render_smooth = False
+        self.sprites = BuildingSprites()
+        self.framebuffer = None
+        self.timelapse = TimelapseRecorder()
+        self.governor = QualityGovernor()
+        self.sim_debt = 0.0
+        self.hud_ops = None
+        self.hud_frame = 0
+        self.craft_counts = None
+
+    def start_game(self, seed=None, cache_dir=WORLD_CACHE_DIR):
         if seed is None: seed = random.randint(0, 9999)
-        self.world = World(seed)
+        timer = self.profiler.startup
+        del timer.phases[self.startup_base:]
+        timer.restart()
+        self.world = World.create(seed, cache_dir=cache_dir, timer=timer)
         self.p1 = Player(1, self.world.width//2, self.world.height//2, BLUE)
         self.p2 = Player(2, self.world.width//2 + 2, self.world.height//2, GREEN)
+        self.hook_players()
+        self.flow.attach(self.world)
+        self.stats.attach(self.world)
         self.state = GameState.PLAYING
-        self.generate_minimap()
+        self.begin_session({"seed": seed})
+        if self.headless: return
+        self.drop_minimap()
+        self.world.tile_index()
+        timer.mark("tile_index")
+        self.start_journal()
+        timer.mark("journal")
+
+    def hook_players(self):
+        # Player inventories report through the world like every other
+        # inventory, so the journal, the net server and the crafting menu
+        # all hear about them
+        for p in (self.p1, self.p2): p.inventory.listener = self.world.on_inventory_change
+        if self.on_inventory_changed not in self.world.inventory_listeners: self.world.inventory_listeners.append(self.on_inventory_changed)
+        self.craft_counts = None
+
+    def on_inventory_changed(self, owner, item, delta):
+        if owner == ("p", 1): self.craft_counts = None
+
+    def begin_session(self, start):
+        # Gameplay randomness comes from this stream only, seeded from the
+        # world so a replay of the same start sees the same rolls.
+        if self.input_log: self.input_log.close(self.tick_no)
+        self.input_log = None
+        self.rng = random.Random(self.world.seed * 7919 + 17)
+        self.tick_no = 0
+        self.move_intent = (0, 0, 0, 0)
+        self.quick_snap = None
+        self.undo_stack = []
+        self.blueprint = None
+        self.blueprint_corner = None
+        self.hauler_source = None
+        if self.persist:
+            try:
+                self.input_log = InputLog(os.path.join(REPLAY_DIR, f"session_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"), start)
+            except OSError:
+                self.input_log = None
+
+    def save_game(self, path=None):
+        path = path or os.path.join(SAVE_DIR, "quicksave.fsav")
+        self.world.detach()
+        try:
+            write_save(path, self.world, [self.p1, self.p2], self.unlocks)
+        except OSError as e:
+            self.notify(f"Save failed: {e}", RED); return
+        self.notify(f"Saved {path}", SKY_BLUE)
+
+    def load_game(self, path=None, recover=False):
+        path = path or os.path.join(SAVE_DIR, "quicksave.fsav")
+        # Nothing on self changes until the whole save has checked out
+        try:
+            world, players, unlocks = recover_autosave() if recover else read_save(path)
+            if [p.id for p in players] != [1, 2]:
+                raise SaveError(f"Expected players 1 and 2, found {sorted(p.id for p in players)}")
+        except (OSError, SaveError, ValueError) as e:
+            self.notify(f"Load failed: {e}", RED)
+            return False
+        self.world, (self.p1, self.p2), self.unlocks = world, players, unlocks
+        self.hook_players()
+        self.flow.attach(self.world)
+        self.stats.attach(self.world)
+        self.state = GameState.PLAYING
+        self.begin_session({"save": None if recover else path})
+        if self.headless: return True
+        self.drop_minimap()
+        self.world.tile_index()
+        self.start_journal()
+        self.notify("Recovered autosave" if recover else f"Loaded {path}", SKY_BLUE)
+        return True
+
+    # --- AUTOSAVE ---
+    def start_journal(self):
+        self.stop_journal()
+        if not self.persist: return
+        self.journal = Journal()
+        try:
+            self.journal.start(self.world, [self.p1, self.p2], self.unlocks)
+        except OSError as e:
+            self.journal = None
+            self.notify(f"Autosave disabled: {e}", RED)
+            return
+        self.journal_state = None
+
+    def stop_journal(self):
+        if self.journal:
+            self.journal.stop()
+            self.journal = None
+
+    def journal_tick(self):
+        self.journal_state = self.record_player_changes(self.journal.record, self.journal_state)
+
+    def record_player_changes(self, record, last):
+        # Points, unlocks, positions and hotbar slots change in many places;
+        # diff them once per tick instead. Returns the state to pass in next time.
+        flags = tuple(v["unlocked"] for v in self.unlocks.unlocks.values())
+        state = (self.unlocks.points, self.p1.rect.topleft, self.p1.facing, self.p2.rect.topleft, self.p2.facing, flags,
+                 self.p1.hotbar_index, self.p2.hotbar_index)
+        if last is None or state[0] != last[0]:
+            record(("points", state[0]))
+        if last is None or state[1:3] != last[1:3]:
+            record(("pos", 1, state[1][0], state[1][1], state[2]))
+        if last is None or state[3:5] != last[3:5]:
+            record(("pos", 2, state[3][0], state[3][1], state[4]))
+        if last is None or state[5] != last[5]:
+            prev = last[5] if last else (False,) * len(flags)
+            for key, on, was in zip(self.unlocks.unlocks, flags, prev):
+                if on and not was: record(("unlock", key))
+        for p_id, i in ((1, state[6]), (2, state[7])):
+            if last is None or i != last[5 + p_id]: record(("hotbar", p_id, i))
+        return state
+
+    # --- SNAPSHOTS ---
+    def take_snapshot(self):
+        players = [(p.rect.topleft, p.facing, p.hotbar_index, dict(p.inventory.items)) for p in (self.p1, self.p2)]
+        flags = {k: v["unlocked"] for k, v in self.unlocks.unlocks.items()}
+        # Haulers are few, so they are copied whole rather than per chunk
+        haulers = [hauler_record(h) for h in self.world.haulers.values()]
+        return (self.world.snapshot(), players, self.unlocks.points, flags, self.rng.getstate(), haulers)
+
+    def restore_snapshot(self, snap):
+        w_snap, players, points, flags, rng_state, haulers = snap
+        self.world.restore(w_snap)
+        for h_id in list(self.world.haulers): self.world.remove_hauler(h_id)
+        for rec in haulers:
+            h = hauler_from_record(rec)
+            items = h.inventory.items
+            h.inventory.items = {}
+            self.world.add_hauler(h)
+            for item, amt in items.items():
+                h.inventory.add(item, amt)
+        for p, (pos, facing, hotbar, items) in zip((self.p1, self.p2), players):
+            p.rect.topleft = pos
+            p.facing = facing
+            p.hotbar_index = hotbar
+            # Through add/remove so the autosave journal sees the change
+            for item, amt in list(p.inventory.items.items()):
+                if item not in items: p.inventory.remove(item, amt)
+            for item, amt in items.items():
+                have = p.inventory.items.get(item, 0)
+                if have > amt: p.inventory.remove(item, have - amt)
+                elif have < amt: p.inventory.add(item, amt - have)
+        self.unlocks.points = points
+        for k, v in flags.items():
+            self.unlocks.unlocks[k]["unlocked"] = v
+        self.rng.setstate(rng_state)
+
+    def quick_snapshot(self):
+        if self.quick_snap: self.quick_snap[0].release()
+        self.quick_snap = self.take_snapshot()
+        self.notify("Snapshot taken", SKY_BLUE)
+
+    def quick_restore(self):
+        if not self.quick_snap:
+            self.notify("No snapshot yet (F6)", RED); return
+        self.restore_snapshot(self.quick_snap)
+        self.notify("Snapshot restored", SKY_BLUE)
+
+    def push_undo(self, player, placed):
+        self.undo_stack.append((self.tick_no, player, placed))
+        self.expire_undo()
+
+    def undo_placement(self):
+        # The inverse of the placement only: each building still standing
+        # is removed, and it and whatever it holds go back to the player
+        # who placed it. Everything else keeps running.
+        if not self.undo_stack:
+            self.notify("Nothing to undo", RED); return
+        _, player, placed = self.undo_stack.pop()
+        n = 0
+        for b in placed:
+            if self.world.get_building(b.x, b.y) is not b: continue
+            for item, amt in list(b.inventory.items.items()):
+                b.inventory.remove(item, amt)
+                player.inventory.add(item, amt)
+            self.world.remove_building(b.x, b.y)
+            player.inventory.add(b.type)
+            n += 1
+        self.notify(f"Undid placement ({n} building{'s' if n != 1 else ''})" if n else "Placement already gone", SKY_BLUE if n else RED)
+
+    def expire_undo(self):
+        while self.undo_stack and (len(self.undo_stack) > UNDO_DEPTH or self.tick_no - self.undo_stack[0][0] > UNDO_TICKS):
+            self.undo_stack.pop(0)
+
+    def fork(self, snap=None):
+        # Headless copy of the game as of snap (or now) for what-if runs;
+        # the fork shares nothing mutable with the live game.
+        temp = snap is None
+        if temp: snap = self.take_snapshot()
+        g = GameEngine(headless=True)
+        g.world = snap[0].materialize()
+        g.p1 = Player(1, 0, 0, BLUE)
+        g.p2 = Player(2, 0, 0, GREEN)
+        g.rng = random.Random()
+        g.restore_snapshot((g.world.snapshot(),) + snap[1:])
+        g.world.snapshots.clear()
+        g.flow.attach(g.world)
+        g.stats.attach(g.world)
+        g.tick_no = self.tick_no
+        g.state = GameState.PLAYING
+        if temp: snap[0].release()
+        return g
+
+    # --- NETWORK CLIENT ---
+    def connect(self, host, port=NET_PORT, player=0):
+        # The server runs the simulation; this engine only mirrors it
+        self.persist = False
+        self.net = NetClient(host, port, player)
+        self.notify(f"Connecting to {host}:{port}...", SKY_BLUE)
+
+    def start_split(self, seed=None):
+        # The simulation runs in a child process on another core and this
+        # engine only draws; it is driven through self.net like a client
+        self.persist = False
+        self.net = SimLink(seed)
+        self.notify("Starting simulation process...", SKY_BLUE)
+
+    def adopt_state(self, world, players, unlocks):
+        self.world, (self.p1, self.p2), self.unlocks = world, players, unlocks
+        self.hook_players()
+        if self.state == GameState.MENU: self.state = GameState.PLAYING
+        self.drop_minimap()
+
+    def quit(self):
+        if self.net: self.net.close()
+        self.stop_journal()
+        self.timelapse.stop()
+        if self.input_log: self.input_log.close(self.tick_no)
+        pygame.quit(); sys.exit()
 
     def generate_minimap(self):
     
-        self.minimap_surface = pygame.Surface((self.world.width, self.world.height))
-        for loc, tile in self.world.tiles.items():
-            c = tile.base_color
-            if tile.type == TileType.ORE_IRON: c = (150, 100, 100)
-            if tile.type == TileType.ORE_COPPER: c = (200, 120, 60)
-            if tile.type == TileType.ORE_GOLD: c = GOLD
-            if tile.type == TileType.ORE_COAL: c = (20, 20, 20)
-            if tile.type == TileType.TREE: c = TREE_GREEN
-            self.minimap_surface.set_at(loc, c)
+        self.minimap_surface = build_minimap(self.world).convert()
+        self.map_view = MapView(self.minimap_surface)
+        self.map_view.fit(SCREEN_WIDTH, SCREEN_HEIGHT)
+        if self.on_tile_changed not in self.world.tile_listeners: self.world.tile_listeners.append(self.on_tile_changed)
+
+    def drop_minimap(self):
+        # The map is built the first time it is opened, not with the world
+        self.minimap_surface = None
+        self.map_view = None
+        if self.state == GameState.MAP_VIEW: self.generate_minimap()
+
+    def open_map(self):
+        if not self.map_view: self.generate_minimap()
+        self.state = GameState.MAP_VIEW
+
+    def on_tile_changed(self, x, y):
+        if self.map_view: self.map_view.set_pixel(x, y, minimap_color(self.world, x, y))
 
     def handle_input(self):
         keys = pygame.key.get_pressed()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                pygame.quit(); sys.exit()
+                self.quit()
 
             if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F2:
+                    if event.mod & pygame.KMOD_CTRL:
+                        on = self.memory.toggle_tracing()
+                        self.notify(f"tracemalloc {'on' if on else 'off'}", SKY_BLUE)
+                    elif event.mod & pygame.KMOD_SHIFT:
+                        self.memory.sample(self)
+                        path = self.memory.dump(os.path.join("profiles", f"memory_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+                        self.notify(f"Saved {path}", SKY_BLUE)
+                    else:
+                        self.memory.visible = not self.memory.visible
+                        if self.memory.visible: self.memory.sample(self)
+                if event.key == pygame.K_F3:
+                    if event.mod & pygame.KMOD_CTRL:
+                        self.notify(f"Quality governor {'on' if self.governor.toggle() else 'off'}", SKY_BLUE)
+                    else:
+                        self.profiler.visible = not self.profiler.visible
+                if event.key == pygame.K_F8 and self.world:
+                    if event.mod & pygame.KMOD_SHIFT:
+                        path = self.flow.dump(self.world, os.path.join("profiles", f"logistics_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+                        self.notify(f"Saved {path}", SKY_BLUE)
+                    else:
+                        self.flow.visible = not self.flow.visible
+                if event.key == pygame.K_F11 and not self.headless:
+                    if event.mod & pygame.KMOD_SHIFT:
+                        self.set_render_scale(self.render_scale, not self.render_smooth)
+                    else:
+                        i = RENDER_SCALES.index(self.render_scale) if self.render_scale in RENDER_SCALES else -1
+                        self.set_render_scale(RENDER_SCALES[(i + 1) % len(RENDER_SCALES)])
+                    self.notify(f"Render scale {self.render_scale:.0%} ({'smooth' if self.render_smooth else 'nearest'})", SKY_BLUE)
+                if event.key == pygame.K_F12 and not self.headless:
+                    self.toggle_timelapse(event.mod & pygame.KMOD_SHIFT)
+                if event.key == pygame.K_F4:
+                    ext = "json" if event.mod & pygame.KMOD_SHIFT else "csv"
+                    path = self.profiler.export(os.path.join("profiles", f"frames_{time.strftime('%Y%m%d_%H%M%S')}.{ext}"))
+                    self.notify(f"Saved {path}", SKY_BLUE)
                 if event.key == pygame.K_ESCAPE:
-                    if self.state in [GameState.PLAYING, GameState.MAP_VIEW, GameState.CRAFTING_MENU, GameState.UNLOCK_MENU]: 
+                    if self.state in [GameState.PLAYING, GameState.MAP_VIEW, GameState.CRAFTING_MENU, GameState.UNLOCK_MENU, GameState.STATS]: 
                         self.state = GameState.MENU
-                    elif self.state == GameState.MENU: pygame.quit(); sys.exit()
+                    elif self.state == GameState.MENU: self.quit()
                    
 
             if self.state == GameState.MENU:
                 if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_RETURN: self.start_game()
+                    if self.net:
+                        if event.key == pygame.K_RETURN and self.world: self.state = GameState.PLAYING
+                    else:
+                        if event.key == pygame.K_RETURN: self.start_game()
+                        if event.key == pygame.K_F9: self.load_game()
+                        if event.key == pygame.K_F10: self.load_game(recover=True)
                     if event.key == pygame.K_c: self.state = GameState.CONTROLS
             
             elif self.state == GameState.CONTROLS:
@@ -472,46 +3715,93 @@ class GameEngine:
 
             elif self.state == GameState.PLAYING:
                 if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_b: self.p1_interact()
+                    if event.key == pygame.K_b: self.execute(("p1_interact",))
                     if event.key == pygame.K_q: self.state = GameState.CRAFTING_MENU
-                    if event.key == pygame.K_TAB: self.p1.cycle_hotbar()
-                    if event.key == pygame.K_m: self.state = GameState.MAP_VIEW
+                    if event.key == pygame.K_TAB: self.execute(("cycle_hotbar",))
+                    if event.key == pygame.K_m: self.open_map()
                     if event.key == pygame.K_c: self.state = GameState.CONTROLS
+                    if event.key == pygame.K_i: self.state = GameState.STATS
                     
-                    if event.key == pygame.K_SPACE or event.key == pygame.K_RETURN: self.p2_interact()
+                    if event.key == pygame.K_SPACE or event.key == pygame.K_RETURN: self.execute(("p2_interact",))
                     if event.key == pygame.K_p: self.state = GameState.UNLOCK_MENU
-                    if event.key == pygame.K_o: self.p2_build_totem()
-                    if event.key == pygame.K_l: self.p2_replant()
+                    if event.key == pygame.K_o: self.execute(("p2_build_totem",))
+                    if event.key == pygame.K_l: self.execute(("p2_replant",))
+                    if event.key == pygame.K_F5: self.save_game()
+                    if event.key == pygame.K_F6: self.execute(("quick_snapshot",))
+                    if event.key == pygame.K_F7: self.execute(("quick_restore",))
+                    if event.key == pygame.K_z: self.execute(("undo_placement",))
+                    if event.key == pygame.K_v:
+                        if event.mod & pygame.KMOD_SHIFT:
+                            self.blueprint = self.blueprint_corner = None
+                        elif self.blueprint_corner is None:
+                            self.blueprint_corner = self.p1_target()
+                            self.notify("Blueprint corner set, V again on the opposite corner", SKY_BLUE)
+                        else:
+                            self.execute(("capture_blueprint",) + self.blueprint_corner + self.p1_target())
+                            self.blueprint_corner = None
+                    if event.key == pygame.K_g: self.execute(("stamp_blueprint",) + self.p1_target())
+                    if event.key == pygame.K_r: self.execute(("cycle_recipe",))
+                    if event.key == pygame.K_h:
+                        target = self.p1_target()
+                        if event.mod & pygame.KMOD_SHIFT:
+                            self.execute(("recall_haulers",) + target)
+                        elif self.hauler_source is None or self.hauler_source == target:
+                            self.hauler_source = None if self.hauler_source else target
+                            if self.hauler_source: self.notify("Hauler pickup set, H again on the drop-off building", SKY_BLUE)
+                        else:
+                            self.execute(("assign_hauler",) + self.hauler_source + target)
+                            self.hauler_source = None
+                    if event.key == pygame.K_F9 and not self.net: self.load_game()
 
             elif self.state == GameState.MAP_VIEW:
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_m or event.key == pygame.K_ESCAPE: self.state = GameState.PLAYING
+                    if event.key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS): self.map_view.zoom_by(2)
+                    if event.key in (pygame.K_MINUS, pygame.K_KP_MINUS): self.map_view.zoom_by(0.5)
+                    if event.key == pygame.K_HOME: self.map_view.fit(SCREEN_WIDTH, SCREEN_HEIGHT)
+                if event.type == pygame.MOUSEWHEEL:
+                    self.map_view.zoom_by(1.25 ** event.y)
+                if event.type == pygame.MOUSEMOTION and event.buttons[0]:
+                    self.map_view.pan(-event.rel[0], -event.rel[1])
+
+            elif self.state == GameState.STATS:
+                if event.type == pygame.KEYDOWN:
+                    if event.key in (pygame.K_i, pygame.K_ESCAPE): self.state = GameState.PLAYING
+                    n = len(self.stats.items())
+                    if n and event.key in (pygame.K_UP, pygame.K_w): self.stats_view[0] = (self.stats_view[0] - 1) % n
+                    if n and event.key in (pygame.K_DOWN, pygame.K_s): self.stats_view[0] = (self.stats_view[0] + 1) % n
+                    if pygame.K_1 <= event.key <= pygame.K_3: self.stats_view[1] = event.key - pygame.K_1
 
             elif self.state == GameState.UNLOCK_MENU:
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_p: self.state = GameState.PLAYING
-                    if event.key == pygame.K_1: self.try_unlock("inventory")
-                    if event.key == pygame.K_2: self.try_unlock("mining")
-                    if event.key == pygame.K_3: self.try_unlock("crafting")
-                    if event.key == pygame.K_4: self.try_unlock("smelting")
-                    if event.key == pygame.K_5: self.try_unlock("automation")
-                    if event.key == pygame.K_6: self.try_unlock("advanced")
-                    if event.key == pygame.K_7: self.try_unlock("druidry")
+                    if event.key == pygame.K_1: self.execute(("try_unlock", "inventory"))
+                    if event.key == pygame.K_2: self.execute(("try_unlock", "mining"))
+                    if event.key == pygame.K_3: self.execute(("try_unlock", "crafting"))
+                    if event.key == pygame.K_4: self.execute(("try_unlock", "smelting"))
+                    if event.key == pygame.K_5: self.execute(("try_unlock", "automation"))
+                    if event.key == pygame.K_6: self.execute(("try_unlock", "advanced"))
+                    if event.key == pygame.K_7: self.execute(("try_unlock", "druidry"))
 
             elif self.state == GameState.CRAFTING_MENU:
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_q: self.state = GameState.PLAYING
                     recipe_keys = list(RECIPES.keys())
+                    count = "max" if event.mod & pygame.KMOD_SHIFT else (10 if event.mod & pygame.KMOD_CTRL else 1)
                     if event.key >= pygame.K_1 and event.key <= pygame.K_9:
                         idx = event.key - pygame.K_1
                         if idx < len(recipe_keys):
-                            self.craft(recipe_keys[idx])
+                            self.execute(("craft", recipe_keys[idx], count))
                     if event.key == pygame.K_0 and len(recipe_keys) >= 10:
-                        self.craft(recipe_keys[9])
+                        self.execute(("craft", recipe_keys[9], count))
 
         if self.state == GameState.PLAYING:
-            self.p1.update(keys, self.world.width*TILE_SIZE, self.world.height*TILE_SIZE)
-            self.p2.update(keys, self.world.width*TILE_SIZE, self.world.height*TILE_SIZE)
+            self.move_intent = self.p1.read_keys(keys) + self.p2.read_keys(keys)
+        elif self.state == GameState.MAP_VIEW:
+            spd = 12
+            dx = (keys[pygame.K_d] or keys[pygame.K_RIGHT]) - (keys[pygame.K_a] or keys[pygame.K_LEFT])
+            dy = (keys[pygame.K_s] or keys[pygame.K_DOWN]) - (keys[pygame.K_w] or keys[pygame.K_UP])
+            if dx or dy: self.map_view.pan(dx * spd, dy * spd)
 
     def p1_interact(self):
         if not self.unlocks.can_do("inventory"):
@@ -533,6 +3823,7 @@ class GameEngine:
         if t_type and t_type != TileType.GRASS and t_type != TileType.SAND:
             if t_type == TileType.TREE:
                 self.p1.inventory.add("wood", 1)
+                self.stats.produce("wood")
                 self.world.set_tile_type(tx, ty, TileType.GRASS)
                 self.notify("Chopped Wood")
                 return
@@ -545,6 +3836,7 @@ class GameEngine:
                 }
                 if t_type in res_map:
                     self.p1.inventory.add(res_map[t_type], 1)
+                    self.stats.produce(res_map[t_type])
                     self.world.set_tile_type(tx, ty, TileType.GRASS)
                     self.notify(f"Mined {res_map[t_type]}")
             else:
@@ -552,33 +3844,99 @@ class GameEngine:
             return
 
         selected = self.p1.get_selected_item()
-        if selected and selected in ["furnace", "drill", "conveyor", "assembler"]:
-             if selected == "furnace" and not self.unlocks.can_do("smelting"): return
-             if (selected == "drill" or selected == "conveyor") and not self.unlocks.can_do("automation"): return
-             if selected == "assembler" and not self.unlocks.can_do("advanced"): return
+        b_class = BUILDING_TYPES.get(selected)
+        if b_class and b_class.placed_by == 1:
+             if not self.unlocks.can_do(b_class.unlock): return
              
              self.place_building(tx, ty, selected, self.p1)
 
     def place_building(self, x, y, b_type, player):
         if (x, y) not in self.world.buildings and self.world.get_tile_type(x,y) != TileType.WATER:
-            if player.inventory.remove(b_type, 1):
-                self.world.buildings[(x, y)] = Building(x, y, b_type, player.facing)
+            if player.inventory.has(b_type, 1):
+                player.inventory.remove(b_type, 1)
+                b = Building(x, y, b_type, player.facing)
+                self.world.add_building(b)
+                self.push_undo(player, [b])
                 self.notify(f"Placed {b_type}")
 
-    def craft(self, item_key):
-        if item_key == "totem": return 
-        recipe = RECIPES[item_key]
-        
+    def p1_target(self):
+        return int(self.p1.interact_rect.centerx // TILE_SIZE), int(self.p1.interact_rect.centery // TILE_SIZE)
 
-        for req, amt in recipe["inputs"].items():
-            if not self.p1.inventory.has(req, amt):
-                self.notify("Missing materials!", RED); return
-        
+    def capture_blueprint(self, x0, y0, x1, y1):
+        self.blueprint = Blueprint.capture(self.world, x0, y0, x1, y1)
+        self.notify(f"Blueprint: {len(self.blueprint.entries)} buildings ({self.blueprint.width}x{self.blueprint.height})", SKY_BLUE)
 
-        for req, amt in recipe["inputs"].items():
-            self.p1.inventory.remove(req, amt)
-        self.p1.inventory.add(item_key, recipe["output"])
-        self.notify(f"Crafted {item_key}!")
+    def stamp_blueprint(self, x, y):
+        # All or nothing: footprint, unlocks and materials are checked up
+        # front, then the whole set is paid for and inserted as one batch.
+        bp = self.blueprint
+        if not bp or not bp.entries: return
+        cost = bp.cost()
+        for t in cost:
+            if not self.unlocks.can_do(BUILDING_TYPES[t].unlock):
+                self.notify(f"Locked: {t}", RED); return
+        missing = [f"{n - self.p1.inventory.items.get(t, 0)} {t}" for t, n in cost.items() if not self.p1.inventory.has(t, n)]
+        if missing:
+            self.notify("Need " + ", ".join(missing), RED); return
+        reason = bp.check(self.world, x, y)
+        if reason:
+            self.notify(reason, RED); return
+        for t, n in cost.items():
+            self.p1.inventory.remove(t, n)
+        placed = bp.buildings(x, y)
+        self.world.add_buildings(placed)
+        self.push_undo(self.p1, placed)
+        self.notify(f"Stamped {len(bp.entries)} buildings")
+
+    def assign_hauler(self, sx, sy, dx, dy):
+        src, dst = self.world.get_building(sx, sy), self.world.get_building(dx, dy)
+        if src is None or dst is None:
+            self.notify("Haulers run between two buildings", RED); return
+        if not self.p1.inventory.has("hauler"):
+            self.notify("Need a hauler (craft one)", RED); return
+        self.p1.inventory.remove("hauler")
+        self.world.add_hauler(Hauler(self.world.next_hauler, sx, sy, (sx, sy), (dx, dy)))
+        self.notify(f"Hauler: {src.type} -> {dst.type}", SKY_BLUE)
+
+    def recall_haulers(self, x, y):
+        # Every hauler serving the building comes back with its cargo
+        mine = [h for h in self.world.haulers.values() if (x, y) in (h.source, h.dest)]
+        for h in mine:
+            for item, amt in list(h.inventory.items.items()):
+                h.inventory.remove(item, amt)
+                self.p1.inventory.add(item, amt)
+            self.world.remove_hauler(h.id)
+            self.p1.inventory.add("hauler")
+        self.notify(f"Recalled {len(mine)} hauler(s)" if mine else "No haulers serve this building", SKY_BLUE if mine else RED)
+
+    def cycle_recipe(self):
+        b = self.world.get_building(*self.p1_target())
+        if not b or not b.default_recipe: return
+        names = [r[0] for r in b.recipes]
+        self.world.set_recipe(b, names[(names.index(b.recipe) + 1) % len(names)])
+        self.notify(f"{b.type.capitalize()} now makes {b.recipe}")
+
+    def craft(self, item_key, count=1):
+        # count is a number of batches, or "max"
+        if not craftable(item_key): return 
+        inv = self.p1.inventory
+        if count == "max": count = max_crafts(inv.items, item_key)
+        plan = plan_craft(inv.items, item_key, count) if count > 0 else None
+        if plan is None:
+            self.notify("Missing materials!", RED); return
+
+        # Applied as net changes per item, after the whole plan checked out
+        final, made = plan
+        for item in list(inv.items):
+            if final.get(item, 0) < inv.items[item]: inv.remove(item, inv.items[item] - final.get(item, 0))
+        for item, amt in final.items():
+            if amt > inv.items.get(item, 0): inv.add(item, amt - inv.items.get(item, 0))
+        for it, k in made.items():
+            for req, amt in RECIPES[it]["inputs"].items():
+                self.stats.consume(req, amt * k)
+            self.stats.produce(it, RECIPES[it]["output"] * k)
+        extra = sum(made.values()) - count
+        self.notify(f"Crafted {count * RECIPES[item_key]['output']} {item_key}" + (f" ({extra} sub-crafts)" if extra else "!"))
 
     def p2_interact(self):
         tx = int(self.p2.interact_rect.centerx // TILE_SIZE)
@@ -586,7 +3944,7 @@ class GameEngine:
         t_type = self.world.get_tile_type(tx, ty)
         
         if t_type == TileType.ESSENCE:
-            pts = random.randint(15, 30)
+            pts = self.rng.randint(15, 30)
             self.unlocks.points += pts
             self.world.set_tile_type(tx, ty, TileType.GRASS)
             self.notify(f"P2: +{pts} Essence", GOLD)
@@ -598,7 +3956,7 @@ class GameEngine:
 
         elif t_type == TileType.STONE and self.unlocks.points >= 10:
             self.unlocks.points -= 10
-            rnd = random.random()
+            rnd = self.rng.random()
             new_t = TileType.ORE_IRON
             if rnd < 0.3: new_t = TileType.ORE_COPPER
             elif rnd < 0.4: new_t = TileType.ORE_COAL
@@ -616,7 +3974,7 @@ class GameEngine:
             self.notify("P2: Replanted Tree", GREEN)
 
     def p2_build_totem(self):
-        if not self.unlocks.can_do("druidry"): 
+        if not self.unlocks.can_do(Totem.unlock): 
             self.notify("Unlock Nature Totem first!", RED); return
         
         tx = int(self.p2.interact_rect.centerx // TILE_SIZE)
@@ -624,7 +3982,7 @@ class GameEngine:
         
         if (tx, ty) not in self.world.buildings and self.unlocks.points >= 50:
             self.unlocks.points -= 50
-            self.world.buildings[(tx, ty)] = Building(tx, ty, "totem", "DOWN")
+            self.world.add_building(Building(tx, ty, "totem", "DOWN"))
             self.notify("P2: Summoned Totem", GOLD)
         elif self.unlocks.points < 50:
             self.notify("Need 50 Essence", RED)
@@ -636,72 +3994,187 @@ class GameEngine:
             self.notify("Cannot Buy (Points/Already Owned)", RED)
 
     def notify(self, msg, color=WHITE):
+        if self.notify_hook: self.notify_hook(msg, color)
+        if self.headless: return
         self.notifications.append([msg, color, 120])
 
     # --- RENDERING ---
-    def render_world(self, surface, cam, player):
+    def render_world(self, surface, cam, player, scale=1.0):
+        # Draws at ts pixels per tile; below TILE_SIZE the surface is part
+        # of the scaled framebuffer and cam is shrunk to match
+        ts = round(TILE_SIZE * scale)
+        k = ts / TILE_SIZE
+        if ts != TILE_SIZE: cam = (cam[0] * ts // TILE_SIZE, cam[1] * ts // TILE_SIZE)
         surface.fill(BLACK)
-        sx = max(0, cam[0] // TILE_SIZE)
-        sy = max(0, cam[1] // TILE_SIZE)
-        ex = min(self.world.width, sx + (HALF_WIDTH // TILE_SIZE) + 2)
-        ey = min(self.world.height, sy + (SCREEN_HEIGHT // TILE_SIZE) + 2)
+        sx = max(0, cam[0] // ts)
+        sy = max(0, cam[1] // ts)
+        ex = min(self.world.width, sx + (surface.get_width() // ts) + 2)
+        ey = min(self.world.height, sy + (surface.get_height() // ts) + 2)
 
+        types, colors, w = self.world.types, self.world.colors, self.world.width
+        gov = self.governor
+        flat = {} if gov.decorations else FLAT_TILE_COLORS
+        pulse = (5 + math.sin(time.perf_counter()*10)*2 if gov.pulse else 5) * k
         for y in range(sy, ey):
             for x in range(sx, ex):
-                t = self.world.tiles.get((x,y))
-                if t:
-                    r = t.rect.move(-cam[0], -cam[1])
-                    pygame.draw.rect(surface, t.base_color, r)
-                    if t.type == TileType.TREE: pygame.draw.circle(surface, TREE_GREEN, r.center, 12)
-                    elif t.type == TileType.ORE_IRON: pygame.draw.circle(surface, (180, 140, 140), r.center, 6)
-                    elif t.type == TileType.ORE_COPPER: pygame.draw.circle(surface, (200, 100, 50), r.center, 6)
-                    elif t.type == TileType.ORE_GOLD: pygame.draw.circle(surface, GOLD, r.center, 6)
-                    elif t.type == TileType.ORE_COAL: pygame.draw.circle(surface, COAL_BLACK, r.center, 7)
-                    elif t.type == TileType.ESSENCE:
-                        pulse = 5 + math.sin(pygame.time.get_ticks()*0.01)*2
-                        pygame.draw.circle(surface, GOLD, r.center, pulse)
+                i = y * w + x
+                t_type = TILE_TYPES[types[i]]
+                r = pygame.Rect(x * ts - cam[0], y * ts - cam[1], ts, ts)
+                pygame.draw.rect(surface, flat.get(t_type) or tuple(colors[i*3:i*3+3]), r)
+                if flat: continue
+                if t_type == TileType.TREE: pygame.draw.circle(surface, TREE_GREEN, r.center, 12 * k)
+                elif t_type == TileType.ORE_IRON: pygame.draw.circle(surface, (180, 140, 140), r.center, 6 * k)
+                elif t_type == TileType.ORE_COPPER: pygame.draw.circle(surface, (200, 100, 50), r.center, 6 * k)
+                elif t_type == TileType.ORE_GOLD: pygame.draw.circle(surface, GOLD, r.center, 6 * k)
+                elif t_type == TileType.ORE_COAL: pygame.draw.circle(surface, COAL_BLACK, r.center, 7 * k)
+                elif t_type == TileType.ESSENCE: pygame.draw.circle(surface, GOLD, r.center, pulse)
 
+        sprites = self.sprites
+        if isinstance(self.net, SimLink):
+            self.net.render_buildings(surface, cam, sx, sy, ex, ey, ts, sprites)
         for b in self.world.buildings.values():
             if sx <= b.x <= ex and sy <= b.y <= ey:
-                b.render(surface, cam)
+                r = pygame.Rect(b.x * ts - cam[0], b.y * ts - cam[1], ts, ts)
+                sprites.paint(surface, type(b), r, b.facing, bool(b.inventory.items), b.stalled)
+        if isinstance(self.net, SimLink):
+            for pos, loaded in self.net.haulers:
+                Hauler.paint(surface, (pos[0] * ts // TILE_SIZE - cam[0], pos[1] * ts // TILE_SIZE - cam[1]), loaded, ts)
+        for d in self.world.haulers.values():
+            if sx <= d.x <= ex and sy <= d.y <= ey:
+                Hauler.paint(surface, d.screen_pos(cam, ts), bool(d.inventory.items), ts)
+        if self.hauler_source and player is self.p1:
+            hx, hy = self.hauler_source
+            pygame.draw.rect(surface, (240, 230, 120), (hx * ts - cam[0], hy * ts - cam[1], ts, ts), 2)
+        if self.flow.visible:
+            for (x, y), n in self.flow.draw_overlay(surface, cam, self.world, sx, sy, ex, ey, ts).items():
+                if sx <= x <= ex and sy <= y <= ey:
+                    surface.blit(self.font.render(str(n), True, WHITE), (x * ts - cam[0] + 4, y * ts - cam[1] + 2))
 
-        self.p1.render(surface, cam)
-        self.p2.render(surface, cam)
+        if player is self.p1 and (self.blueprint or self.blueprint_corner):
+            tx, ty = self.p1_target()
+            if self.blueprint_corner:
+                cx, cy = self.blueprint_corner
+                r = pygame.Rect(min(cx, tx) * ts - cam[0], min(cy, ty) * ts - cam[1],
+                                (abs(tx - cx) + 1) * ts, (abs(ty - cy) + 1) * ts)
+                pygame.draw.rect(surface, SKY_BLUE, r, 2)
+            else:
+                bp = self.blueprint
+                col = GREEN if bp.check(self.world, tx, ty) is None else RED
+                pygame.draw.rect(surface, col, (tx * ts - cam[0], ty * ts - cam[1], bp.width * ts, bp.height * ts), 2)
+                m = round(6 * k)
+                for dx, dy, _, _ in bp.entries:
+                    if sx <= tx + dx <= ex and sy <= ty + dy <= ey:
+                        pygame.draw.rect(surface, col, ((tx + dx) * ts - cam[0] + m, (ty + dy) * ts - cam[1] + m, ts - 2 * m, ts - 2 * m), 1)
+
+        self.p1.render(surface, cam, ts)
+        self.p2.render(surface, cam, ts)
+
+    def toggle_timelapse(self, switch_source=False):
+        lapse = self.timelapse
+        if switch_source:
+            lapse.source = "map" if lapse.source == "view" else "view"
+            self.notify(f"Timelapse source: {lapse.source}", SKY_BLUE)
+        elif lapse.thread:
+            lapse.stop()
+            msg = f"Timelapse: {lapse.written} frames in {lapse.path}" + (f", {lapse.dropped} dropped" if lapse.dropped else "")
+            self.notify(f"{msg} ({lapse.error})" if lapse.error else msg, RED if lapse.error else SKY_BLUE)
+        else:
+            self.notify(f"Recording timelapse ({lapse.source}) to {lapse.start()}", SKY_BLUE)
+
+    def world_views(self):
+        # (scale, framebuffer, left view, right view) at the lower of the
+        # chosen and the governor's render scale; at full scale the views
+        # are drawn straight into the screen
+        scale = min(self.render_scale, self.governor.scale)
+        if self.framebuffer is None or self.framebuffer[0] != scale:
+            if scale == 1:
+                fb = self.screen
+            else:
+                fb = pygame.Surface((round(SCREEN_WIDTH * scale), round(SCREEN_HEIGHT * scale))).convert()
+            w, h = fb.get_size()
+            self.framebuffer = (scale, fb, fb.subsurface((0, 0, w // 2, h)), fb.subsurface((w // 2, 0, w - w // 2, h)))
+        return self.framebuffer
+
+    def set_render_scale(self, scale, smooth=None):
+        self.render_scale = scale
+        if smooth is not None: self.render_smooth = smooth
+        self.framebuffer = None
+        self.sprites.cache.clear()
 
     def draw_hud(self):
         if self.p1 is None: return 
-       
-        pygame.draw.rect(self.screen, (20, 20, 30), (0, 0, SCREEN_WIDTH, 40))
+        # Text rendering and the resource scan are the HUD's cost; when the
+        # governor asks, the last layout is blitted again in between
+        self.hud_frame += 1
+        every = self.governor.hud_every
+        if self.hud_ops is None or self.hud_frame % every == 0:
+            self.hud_ops = self.layout_hud(every)
+        for fn, args in self.hud_ops: fn(self.screen, *args)
+
+    def layout_hud(self, frames):
+        # Draw calls as (function, args after the target surface), for the
+        # next `frames` frames
+        ops = []
+        rect, blit = pygame.draw.rect, pygame.Surface.blit
+        ops.append((rect, ((20, 20, 30), (0, 0, SCREEN_WIDTH, 40))))
         t1 = self.font.render(f"P1 (Engineer) | TAB: Cycle Item | Q: Craft | B: Interact", True, BLUE)
-        self.screen.blit(t1, (10, 10))
+        ops.append((blit, (t1, (10, 4))))
         t2 = self.font.render(f"P2 (Druid): {self.unlocks.points} Essence | P: Unlocks | O: Totem | L: Plant", True, GREEN)
-        self.screen.blit(t2, (HALF_WIDTH + 10, 10))
+        ops.append((blit, (t2, (HALF_WIDTH + 10, 4))))
+        for p, x in ((self.p1, 10), (self.p2, HALF_WIDTH + 10)):
+            ops.append((blit, (self.font.render(self.scan_text(p), True, LIGHT_GRAY), (x, 22))))
 
         items = self.p1.inventory.get_list()
         if items:
             bar_w = len(items) * 40
-            pygame.draw.rect(self.screen, (0, 0, 0, 150), (10, SCREEN_HEIGHT - 50, bar_w + 10, 45))
+            ops.append((rect, ((0, 0, 0, 150), (10, SCREEN_HEIGHT - 50, bar_w + 10, 45))))
             for i, item in enumerate(items):
                 col = WHITE if i == self.p1.hotbar_index else GRAY
-                pygame.draw.rect(self.screen, col, (15 + i*40, SCREEN_HEIGHT - 45, 36, 36), 2)
+                ops.append((rect, (col, (15 + i*40, SCREEN_HEIGHT - 45, 36, 36), 2)))
 
                 short = item[:3].upper()
                 txt = self.font.render(short, True, col)
-                self.screen.blit(txt, (18 + i*40, SCREEN_HEIGHT - 35))
+                ops.append((blit, (txt, (18 + i*40, SCREEN_HEIGHT - 35))))
           
                 cnt = self.p1.inventory.items[item]
                 num = self.font.render(str(cnt), True, WHITE)
-                self.screen.blit(num, (18 + i*40, SCREEN_HEIGHT - 20))
+                ops.append((blit, (num, (18 + i*40, SCREEN_HEIGHT - 20))))
 
     
         y = 50
         for n in self.notifications[:]:
             txt = self.font.render(n[0], True, n[1])
-            self.screen.blit(txt, (SCREEN_WIDTH//2 - txt.get_width()//2, y))
+            ops.append((blit, (txt, (SCREEN_WIDTH//2 - txt.get_width()//2, y))))
             y += 20
-            n[2] -= 1
+            n[2] -= frames
             if n[2] <= 0: self.notifications.remove(n)
 
+        if isinstance(self.net, SimLink):
+            txt = self.font.render(f"SIM tick {self.net.server_tick} | {self.net.rate:.0f} snapshots/s", True, GRAY)
+            ops.append((blit, (txt, (SCREEN_WIDTH - txt.get_width() - 10, SCREEN_HEIGHT - 20))))
+        elif self.net:
+            net = self.net
+            txt = self.font.render(f"NET tick {net.server_tick} | in {net.rate_in / 1024:.1f} KB/s | out {net.rate_out / 1024:.1f} KB/s", True, GRAY)
+            ops.append((blit, (txt, (SCREEN_WIDTH - txt.get_width() - 10, SCREEN_HEIGHT - 20))))
+        return ops
+
+    # Resources around each player for the HUD, from the world's tile index.
+    # The first type listed per player also gets a pointer to the nearest.
+    SCAN_RADIUS = 16
+    SCAN = {1: ((TileType.ORE_IRON, "iron"), (TileType.ORE_COPPER, "copper"), (TileType.ORE_COAL, "coal"), (TileType.ORE_GOLD, "gold")),
+            2: ((TileType.ESSENCE, "essence"), (TileType.TREE, "trees"), (TileType.STONE, "stone"))}
+
+    def scan_text(self, p):
+        px, py = p.rect.centerx // TILE_SIZE, p.rect.centery // TILE_SIZE
+        r, kinds = self.SCAN_RADIUS, self.SCAN[p.id]
+        parts = [f"{name} {self.world.count_tiles(t, px - r, py - r, px + r, py + r)}" for t, name in kinds]
+        near = self.world.nearest_tiles(kinds[0][0], px, py)
+        if near:
+            dx, dy = near[0][0] - px, near[0][1] - py
+            heading = ("E", "SE", "S", "SW", "W", "NW", "N", "NE")[round(math.atan2(dy, dx) / (math.pi / 4)) % 8]
+            parts.append(f"| nearest {kinds[0][1]} {round(math.hypot(dx, dy))} {heading}")
+        return f"Within {r}: " + " ".join(parts)
+
     def draw_menus(self):
         if self.state == GameState.CONTROLS:
             self.screen.fill((20, 25, 30))
@@ -712,9 +4185,12 @@ class GameEngine:
                 "Move: W A S D",
                 "Interact/Mine/Take: B",
                 "Open Crafting: Q",
+                "Production Stats: I",
+                "Change Assembler Recipe: R",
                 "Cycle Selected Item: TAB",
                 "Place Selected Item: B (on empty ground)",
-                "Open Map: M",
+                "Hauler Drone: H on pickup then drop-off building | Shift+H: Recall",
+                "Open Map: M (Wheel/+/- Zoom, Drag/WASD Pan)",
                 "",
                 "PLAYER 2 (The Druid - Green)",
                 "Move: ARROWS",
@@ -723,6 +4199,13 @@ class GameEngine:
                 "Build Nature Totem: O",
                 "Replant Tree: L",
                 "",
+                "Quicksave: F5 | Quickload: F9 | Recover Autosave: F10 (Menu)",
+                "Instant Snapshot: F6 | Restore Snapshot: F7 | Undo Placement: Z",
+                "Blueprint: V on two corners to capture, G to stamp, Shift+V to clear",
+                "Frame Profiler: F3 (Ctrl = Quality Governor) | Export Timings: F4 (Shift = JSON) | Timelapse: F12 (Shift = View/Map)",
+                "Memory Panel: F2 | Dump: Shift+F2 | tracemalloc: Ctrl+F2",
+                "Logistics Overlay: F8 | Export Report: Shift+F8 | Render Scale: F11 (Shift = Smooth)",
+                "",
                 "Press C or ESC to Return"
             ]
             y = 50
@@ -735,26 +4218,20 @@ class GameEngine:
                 y += 30
 
         elif self.state == GameState.MAP_VIEW:
-            if self.minimap_surface:
-                scale = min(SCREEN_WIDTH / self.world.width, SCREEN_HEIGHT / self.world.height)
-                w, h = int(self.world.width * scale), int(self.world.height * scale)
-                scaled_map = pygame.transform.scale(self.minimap_surface, (w, h))
-                
-                ox = (SCREEN_WIDTH - w) // 2
-                oy = (SCREEN_HEIGHT - h) // 2
+            if self.map_view:
                 self.screen.fill((10,10,10))
-                self.screen.blit(scaled_map, (ox, oy))
+                self.map_view.draw(self.screen, self.world)
                 
-                p1x = int(self.p1.rect.centerx / (self.world.width*TILE_SIZE) * w)
-                p1y = int(self.p1.rect.centery / (self.world.height*TILE_SIZE) * h)
-                pygame.draw.circle(self.screen, BLUE, (ox+p1x, oy+p1y), 5)
+                p1 = self.map_view.world_to_screen(self.p1.rect.centerx / TILE_SIZE, self.p1.rect.centery / TILE_SIZE, SCREEN_WIDTH, SCREEN_HEIGHT)
+                pygame.draw.circle(self.screen, BLUE, p1, 5)
                 
-                p2x = int(self.p2.rect.centerx / (self.world.width*TILE_SIZE) * w)
-                p2y = int(self.p2.rect.centery / (self.world.height*TILE_SIZE) * h)
-                pygame.draw.circle(self.screen, GREEN, (ox+p2x, oy+p2y), 5)
+                p2 = self.map_view.world_to_screen(self.p2.rect.centerx / TILE_SIZE, self.p2.rect.centery / TILE_SIZE, SCREEN_WIDTH, SCREEN_HEIGHT)
+                pygame.draw.circle(self.screen, GREEN, p2, 5)
                 
                 txt = self.title_font.render("WORLD MAP (M to close)", True, WHITE)
                 self.screen.blit(txt, (20, 20))
+                hint = self.font.render("WASD/Arrows or Drag: Pan | Wheel or +/-: Zoom | HOME: Fit", True, SKY_BLUE)
+                self.screen.blit(hint, (20, SCREEN_HEIGHT - 30))
 
         elif self.state == GameState.UNLOCK_MENU:
             overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
@@ -780,65 +4257,225 @@ class GameEngine:
             self.screen.blit(header, (SCREEN_WIDTH//2 - header.get_width()//2, 50))
             y = 120
             idx = 1
+            if self.craft_counts is None:
+                # Recounted only when P1's backpack changes
+                self.craft_counts = {k: max_crafts(self.p1.inventory.items, k) for k, v in RECIPES.items() if v["type"] != "nature"}
             for k, v in RECIPES.items():
                 if v["type"] == "nature": continue 
                 ins = ", ".join([f"{amt} {n}" for n, amt in v["inputs"].items()])
-                txt = f"[{idx}] {k.upper()} (x{v['output']}) requires: {ins}"
-                affordable = True
-                for n, amt in v["inputs"].items():
-                    if not self.p1.inventory.has(n, amt): affordable = False
-                col = WHITE if affordable else GRAY
+                most = self.craft_counts[k]
+                txt = f"[{idx % 10}] {k.upper()} (x{v['output']}) requires: {ins} | can make {most}"
+                col = WHITE if most else GRAY
                 surf = self.font.render(txt, True, col)
                 self.screen.blit(surf, (SCREEN_WIDTH//2 - surf.get_width()//2, y))
                 y += 40
                 idx += 1
             
-            hint = self.font.render("Press 1-9 to Craft | Q to Close", True, SKY_BLUE)
+            hint = self.font.render("1-9: Craft | Shift: Max | Ctrl: x10 | Q to Close", True, SKY_BLUE)
             self.screen.blit(hint, (SCREEN_WIDTH//2 - hint.get_width()//2, SCREEN_HEIGHT - 50))
 
-    def run(self):
-        while True:
-            self.handle_input()
-            if self.state == GameState.PLAYING:
-                for b in self.world.buildings.values():
-                    b.update(self.world)
-                self.cam1[0] = self.p1.rect.centerx - HALF_WIDTH//2
-                self.cam1[1] = self.p1.rect.centery - SCREEN_HEIGHT//2
-                self.cam2[0] = self.p2.rect.centerx - HALF_WIDTH//2
-                self.cam2[1] = self.p2.rect.centery - SCREEN_HEIGHT//2
+        elif self.state == GameState.STATS:
+            overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+            overlay.fill((0,0,0, 230))
+            self.screen.blit(overlay, (0,0))
+            header = self.title_font.render("PRODUCTION", True, GOLD)
+            self.screen.blit(header, (SCREEN_WIDTH//2 - header.get_width()//2, 50))
+            stats = self.stats
+            items = stats.items()
+            sel, res = self.stats_view
+            sel = min(sel, len(items) - 1) if items else 0
+            y = 120
+            self.screen.blit(self.font.render(f"{'item':<14}{'made/min':>10}{'used/min':>10}", True, GOLD), (40, y))
+            for i, item in enumerate(items):
+                y += 22
+                row = f"{item:<14}{stats.per_minute('produced', item):>10.1f}{stats.per_minute('consumed', item):>10.1f}"
+                self.screen.blit(self.font.render(row, True, WHITE if i == sel else GRAY), (40, y))
+            if items:
+                name, span, slots = STAT_RESOLUTIONS[res]
+                gx, gy, gw, gh = 360, 140, SCREEN_WIDTH - 400, SCREEN_HEIGHT - 260
+                pygame.draw.rect(self.screen, (40, 40, 50), (gx, gy, gw, gh), 1)
+                made = stats.history("produced", items[sel], res)
+                used = stats.history("consumed", items[sel], res)
+                top = max(max(made), max(used), 1)
+                for series, col in ((made, GREEN), (used, RED)):
+                    pts = [(gx + i * gw // (slots - 1), gy + gh - v * gh // top) for i, v in enumerate(series)]
+                    pygame.draw.lines(self.screen, col, False, pts, 2)
+                label = f"{items[sel]}: made (green) / used (red) per {name} slot, last {slots} slots | peak {top}"
+                self.screen.blit(self.font.render(label, True, WHITE), (gx, gy - 22))
+            else:
+                self.screen.blit(self.font.render("Nothing produced yet", True, GRAY), (40, y + 30))
+            hint = self.font.render("UP/DOWN: Item | 1: 1s  2: 1min  3: 10min | I to Close", True, SKY_BLUE)
+            self.screen.blit(hint, (SCREEN_WIDTH//2 - hint.get_width()//2, SCREEN_HEIGHT - 50))
 
-            if self.state == GameState.MENU:
-                self.screen.fill((10, 10, 20))
-                t = self.title_font.render("ECO-FACTORY", True, WHITE)
-                self.screen.blit(t, (SCREEN_WIDTH//2 - t.get_width()//2, 200))
-                
-                btn_text = "Press ENTER to Start"
-                b1 = self.font.render(btn_text, True, SKY_BLUE)
-                self.screen.blit(b1, (SCREEN_WIDTH//2 - b1.get_width()//2, 300))
-                
-                btn_ctrl = "Press C for Controls"
-                b2 = self.font.render(btn_ctrl, True, GOLD)
-                self.screen.blit(b2, (SCREEN_WIDTH//2 - b2.get_width()//2, 350))
-
-            elif self.state in [GameState.CONTROLS, GameState.MAP_VIEW, GameState.UNLOCK_MENU, GameState.CRAFTING_MENU]:
-                 if self.state == GameState.MAP_VIEW:
-                     self.draw_menus()
-                 else:
-                    self.draw_hud() 
-                    self.draw_menus()
+    # --- COMMANDS ---
+    # Every gameplay action goes through execute() so it can be logged
+    # with the tick it happened on and replayed headlessly.
+    COMMANDS = ("p1_interact", "craft", "cycle_hotbar", "p2_interact", "p2_replant", "p2_build_totem", "try_unlock",
+                "quick_snapshot", "quick_restore", "undo_placement", "capture_blueprint", "stamp_blueprint", "cycle_recipe",
+                "assign_hauler", "recall_haulers")
+
+    def execute(self, cmd):
+        if cmd[0] not in self.COMMANDS: raise ValueError(f"Unknown command {cmd[0]}")
+        if self.net:
+            # The blueprint isn't in the deltas and the hotbar slot comes
+            # back a round trip late; update the mirror now
+            if cmd[0] == "cycle_hotbar": self.p1.cycle_hotbar()
+            if cmd[0] == "capture_blueprint" and not isinstance(self.net, SimLink): self.capture_blueprint(*cmd[1:])
+            self.net.send_command(cmd); return
+        if self.input_log: self.input_log.record(self.tick_no, cmd)
+        if cmd[0] == "cycle_hotbar": self.p1.cycle_hotbar()
+        else: getattr(self, cmd[0])(*cmd[1:])
+
+    def state_hash(self):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(bytes(self.world.types))
+        for (x, y), b in sorted(self.world.buildings.items()):
+            h.update(f"{x},{y},{b.type},{b.facing},{b.timer},{sorted(b.inventory.items.items())};".encode())
+        for d in self.world.haulers.values():
+            h.update(f"{d.id},{d.x},{d.y},{d.source},{d.dest},{d.timer},{sorted(d.inventory.items.items())};".encode())
+        for p in (self.p1, self.p2):
+            h.update(f"{p.rect},{p.facing},{p.hotbar_index},{list(p.inventory.items.items())};".encode())
+        h.update(f"{self.unlocks.points},{[v['unlocked'] for v in self.unlocks.unlocks.values()]}".encode())
+        h.update(repr(self.rng.getstate()).encode())
+        return h.hexdigest()
+
+    def update(self, ticks=1):
+        if self.net:
+            self.update_client()
+        elif self.state == GameState.PLAYING:
+            # Held movement applies to every tick, so catch-up ticks keep
+            # players moving at the same speed as the machines
+            move = self.move_intent
+            w_px, h_px = self.world.width*TILE_SIZE, self.world.height*TILE_SIZE
+            for _ in range(ticks):
+                if self.input_log and any(move): self.input_log.record(self.tick_no, ("move",) + move)
+                self.p1.update(move[0], move[1], w_px, h_px)
+                self.p2.update(move[2], move[3], w_px, h_px)
+                self.world.tick()
+                self.ecology.tick(self.world, self.rng)
+                self.tick_no += 1
+                if self.undo_stack: self.expire_undo()
+                if self.input_log and self.tick_no % REPLAY_CHECKPOINT == 0:
+                    self.input_log.checkpoint(self.tick_no, self.state_hash())
+                if self.journal: self.journal_tick()
+            self.move_intent = (0, 0, 0, 0)
+            self.profiler.mark("sim")
+        if self.state == GameState.PLAYING:
+            self.cam1[0] = self.p1.rect.centerx - HALF_WIDTH//2
+            self.cam1[1] = self.p1.rect.centery - SCREEN_HEIGHT//2
+            self.cam2[0] = self.p2.rect.centerx - HALF_WIDTH//2
+            self.cam2[1] = self.p2.rect.centery - SCREEN_HEIGHT//2
+
+    def update_client(self):
+        net = self.net
+        net.poll(self)
+        if net.closed:
+            net.close()
+            self.net = None
+            self.state = GameState.MENU
+            self.notify("Disconnected from server" if isinstance(net, NetClient) else "Simulation process exited", RED)
+            return
+        if self.state == GameState.PLAYING: net.send_intents(self.move_intent)
+        self.move_intent = (0, 0, 0, 0)
+        self.tick_no = net.server_tick
+        self.profiler.mark("net")
+
+    def draw(self):
+        prof = self.profiler
+        if self.state == GameState.MENU:
+            self.screen.fill((10, 10, 20))
+            t = self.title_font.render("ECO-FACTORY", True, WHITE)
+            self.screen.blit(t, (SCREEN_WIDTH//2 - t.get_width()//2, 200))
             
-            else:
-                s1 = pygame.Surface((HALF_WIDTH, SCREEN_HEIGHT))
-                s2 = pygame.Surface((HALF_WIDTH, SCREEN_HEIGHT))
-                self.render_world(s1, self.cam1, self.p1)
-                self.render_world(s2, self.cam2, self.p2)
-                self.screen.blit(s1, (0,0))
-                self.screen.blit(s2, (HALF_WIDTH, 0))
-                pygame.draw.line(self.screen, BLACK, (HALF_WIDTH, 0), (HALF_WIDTH, SCREEN_HEIGHT), 4)
-                self.draw_hud()
+            btn_text = "Press ENTER to Start"
+            b1 = self.font.render(btn_text, True, SKY_BLUE)
+            self.screen.blit(b1, (SCREEN_WIDTH//2 - b1.get_width()//2, 300))
             
+            btn_ctrl = "Press C for Controls | F9 to Load | F10 to Recover Autosave"
+            b2 = self.font.render(btn_ctrl, True, GOLD)
+            self.screen.blit(b2, (SCREEN_WIDTH//2 - b2.get_width()//2, 350))
+
+        elif self.state in [GameState.CONTROLS, GameState.MAP_VIEW, GameState.UNLOCK_MENU, GameState.CRAFTING_MENU, GameState.STATS]:
+             if self.state == GameState.MAP_VIEW:
+                 self.draw_menus()
+             else:
+                self.draw_hud() 
+                self.draw_menus()
+        
+        else:
+            scale, fb, s1, s2 = self.world_views()
+            self.render_world(s1, self.cam1, self.p1, scale)
+            prof.mark("render_p1")
+            self.render_world(s2, self.cam2, self.p2, scale)
+            prof.mark("render_p2")
+            if fb is not self.screen:
+                upscale = pygame.transform.smoothscale if self.render_smooth else pygame.transform.scale
+                upscale(fb, (SCREEN_WIDTH, SCREEN_HEIGHT), self.screen)
+                prof.mark("upscale")
+            pygame.draw.line(self.screen, BLACK, (HALF_WIDTH, 0), (HALF_WIDTH, SCREEN_HEIGHT), 4)
+            self.draw_hud()
+            prof.mark("hud")
+        prof.mark("draw")
+        if prof.visible: prof.draw(self.screen, self.font, self.governor.report())
+        if self.memory.visible: self.memory.draw(self.screen, self.font)
+        if self.flow.visible and self.world and self.state == GameState.PLAYING: self.flow.draw(self.screen, self.font, self.world)
+
+    def ticks_due(self):
+        # A long frame owes the simulation the ticks it spanned; pay up to
+        # the governor's catch-up limit and forgive the rest
+        owed = self.sim_debt + self.clock.get_time() * FPS / 1000
+        n = max(1, min(int(owed), self.governor.catch_up))
+        self.sim_debt = max(-1.0, min(owed - n, 1.0))
+        return n
+
+    def run(self):
+        prof = self.profiler
+        while True:
+            self.handle_input()
+            prof.mark("input")
+            self.update(self.ticks_due())
+            self.memory.maybe_sample(self)
+            self.draw()
+            self.timelapse.maybe_capture(self)
+            prof.mark("timelapse")
             pygame.display.flip()
+            prof.mark("flip")
             self.clock.tick(FPS)
+            prof.mark("idle")
+            self.governor.record(sum(prof.current.values()) - prof.current["idle"])
+            prof.end_frame()
+
+def option(name, default=None):
+    if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv):
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
 
 if __name__ == "__main__":
-    GameEngine().run()
\ No newline at end of file
+    if option("--replay"):
+        ticks, secs, passed, bad = run_replay(option("--replay"), verify="--no-verify" not in sys.argv)
+        print(f"Replayed {ticks} ticks in {secs:.2f}s ({ticks / max(secs, 1e-9):.0f} ticks/s), "
+              f"{passed} checkpoints OK, {len(bad)} mismatched")
+        for tick, want, got in bad:
+            print(f"  tick {tick}: expected {want}, got {got}")
+        sys.exit(1 if bad else 0)
+    if "--server" in sys.argv:
+        seed = option("--seed")
+        try:
+            NetServer(int(seed) if seed else None, option("--host", "127.0.0.1"), int(option("--port", NET_PORT)), quiet="--quiet" in sys.argv).run()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    game = GameEngine()
+    if option("--timelapse"):
+        game.timelapse.interval = float(option("--timelapse"))
+        game.timelapse.source = option("--timelapse-source", "view")
+        game.timelapse.start()
+    if option("--render-scale"):
+        game.set_render_scale(float(option("--render-scale")), "--smooth" in sys.argv)
+    if option("--connect"):
+        host, _, port = option("--connect").partition(":")
+        game.connect(host, int(port or NET_PORT), int(option("--player", 0)))
+    elif "--split" in sys.argv:
+        seed = option("--seed")
+        game.start_split(int(seed) if seed else None)
+    game.run()
\ No newline at end of file
@@ -0,0 +1,115 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import random
+
+from main import GameEngine, Building, Hauler, TileType, Journal, InputLog, REPLAY_CHECKPOINT, write_save, recover_autosave, run_replay
+
+# ==========================================
+# FIXTURES
+# ==========================================
+# A small running factory near the players, then a scripted session
+# that drives it only through execute() and held movement, the same
+# inputs the replay log records.
+
+def factory(tmp_path, seed=7):
+    g = GameEngine(headless=True)
+    g.start_game(seed, cache_dir=str(tmp_path / "cache"))
+    for v in g.unlocks.unlocks.values(): v["unlocked"] = True
+    g.unlocks.points = 500
+    w, cx, cy = g.world, g.world.width // 2, g.world.height // 2
+    for i in range(6):
+        x, y = cx - 8 + 3 * i, cy + 4
+        w.set_tile_type(x, y, TileType.ORE_IRON)
+        w.set_tile_type(x + 1, y, TileType.GRASS)
+        w.add_building(Building(x, y, "drill", "RIGHT"))
+        w.add_building(Building(x + 1, y, "furnace", "DOWN"))
+    for x in range(cx - 8, cx + 8):
+        w.set_tile_type(x, cy + 6, TileType.GRASS)
+        w.add_building(Building(x, cy + 6, "conveyor", "RIGHT"))
+    w.buildings[(cx - 8, cy + 6)].inventory.add("ore_copper", 5)
+    w.set_tile_type(cx - 8, cy - 6, TileType.ORE_COPPER)
+    w.add_building(Building(cx - 8, cy - 6, "drill", "UP"))
+    w.add_building(Building(cx + 6, cy - 6, "furnace", "DOWN"))
+    w.add_hauler(Hauler(w.next_hauler, cx - 8, cy - 6, (cx - 8, cy - 6), (cx + 6, cy - 6)))
+    for item, n in (("drill", 4), ("conveyor", 10), ("furnace", 2), ("hauler", 2), ("iron_ingot", 20), ("wood", 10)):
+        g.p1.inventory.add(item, n)
+    return g
+
+def play(g, ticks, seed=1):
+    rng = random.Random(seed)
+    cx, cy = g.world.width // 2, g.world.height // 2
+    # Placing and gathering dominate; a rewind now and then
+    commands = [("p1_interact",)] * 6 + [("cycle_hotbar",)] * 3 + [("p2_interact",), ("p2_replant",), ("craft", "gear", 1),
+                ("cycle_recipe",), ("undo_placement",), ("quick_snapshot",), ("assign_hauler", cx - 8, cy + 4, cx + 6, cy - 6),
+                ("recall_haulers", cx + 6, cy - 6)]
+    move = (0, 0, 0, 0)
+    for t in range(ticks):
+        if t % 20 == 0: move = tuple(rng.choice((-1, 0, 0, 1)) for _ in range(4))
+        if t % 7 == 0: g.execute(rng.choice(commands))
+        if t % 250 == 249: g.execute(("quick_restore",))
+        g.move_intent = move
+        g.update()
+
+def hash_with_rng(g, other):
+    # state_hash covers the gameplay rng, which a load reseeds
+    g.rng.setstate(other.rng.getstate())
+    return g.state_hash()
+
+# ==========================================
+# SAVE FORMAT
+# ==========================================
+
+def test_save_round_trip(tmp_path):
+    g = factory(tmp_path)
+    play(g, 300)
+    path = str(tmp_path / "round.fsav")
+    write_save(path, g.world, [g.p1, g.p2], g.unlocks)
+    loaded = GameEngine(headless=True)
+    assert loaded.load_game(path)
+    assert hash_with_rng(loaded, g) == g.state_hash()
+    assert len(loaded.world.buildings) == len(g.world.buildings)
+
+def test_load_without_both_players_keeps_game(tmp_path):
+    g = factory(tmp_path)
+    path = str(tmp_path / "one.fsav")
+    write_save(path, g.world, [g.p1], g.unlocks)
+    world, p1, before = g.world, g.p1, g.state_hash()
+    assert not g.load_game(path)
+    assert g.world is world and g.p1 is p1 and g.state_hash() == before
+
+# ==========================================
+# AUTOSAVE JOURNAL
+# ==========================================
+
+def test_journal_recovery_matches_live(tmp_path):
+    g = factory(tmp_path)
+    g.journal = Journal(directory=str(tmp_path / "saves"))
+    g.journal.start(g.world, [g.p1, g.p2], g.unlocks)
+    play(g, 400)
+    g.stop_journal()
+    recovered = GameEngine(headless=True)
+    recovered.world, (recovered.p1, recovered.p2), recovered.unlocks = recover_autosave(str(tmp_path / "saves"))
+    # Machine and hauler timers move every tick and are not journaled
+    for loc, b in recovered.world.buildings.items(): b.timer = g.world.buildings[loc].timer
+    for h_id, h in recovered.world.haulers.items(): h.timer = g.world.haulers[h_id].timer
+    assert hash_with_rng(recovered, g) == g.state_hash()
+
+# ==========================================
+# INPUT LOG REPLAY
+# ==========================================
+
+def test_replay_checkpoints_match(tmp_path):
+    start = str(tmp_path / "start.fsav")
+    g = factory(tmp_path)
+    write_save(start, g.world, [g.p1, g.p2], g.unlocks)
+    live = GameEngine(headless=True)
+    assert live.load_game(start)
+    log = str(tmp_path / "session.jsonl")
+    live.input_log = InputLog(log, {"save": start})
+    play(live, 2 * REPLAY_CHECKPOINT + 50)
+    live.input_log.close(live.tick_no)
+    ticks, _, passed, bad = run_replay(log)
+    assert ticks == live.tick_no
+    assert passed == 2 and not bad